@@ -0,0 +1,420 @@
+"""
+Headless JSON API over AgentService, for internal tools.
+
+    python api_server.py --port 8080                 # Gemini (GEMINI_API_KEY from .env)
+    python api_server.py --port 8080 --fake          # offline stand-in provider
+
+Endpoints (JSON in, JSON out; Authorization: Bearer <DIPLOMAT_API_TOKEN>). Without a token
+the server only binds to a loopback address and only answers local clients:
+
+    GET    /healthz
+    POST   /v1/advice                         {text, recipient, relation, tone, channel, username?, use_cache?}
+    POST   /v1/outcome                        {suggestion_id, accepted, final_text?}
+    POST   /v1/users                          {username, email, password}
+    GET    /v1/users/<username>
+    PATCH  /v1/users/<username>               {self_context?, new_username?}
+    DELETE /v1/users/<username>
+    GET    /v1/users/<username>/contacts
+    POST   /v1/users/<username>/contacts      {name, relationship, description?}
+    PUT    /v1/users/<username>/contacts/<name>   {name?, relationship?, description?}
+    DELETE /v1/users/<username>/contacts/<name>
+
+Connections are kept alive (HTTP/1.1) and handled by their own threads; the actual work runs
+on a bounded worker pool. When every worker is busy and the queue is full, requests get
+429 + Retry-After right away instead of piling up. Work that exceeds --timeout answers 504.
+"""
+import os
+import json
+import uuid
+import hmac
+import argparse
+import ipaddress
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+from infrastructure.llm_errors import LLMError, RateLimitError, LLMTimeoutError
+
+MAX_BODY_BYTES = 1024 * 1024
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+# --- Worker Pool ---
+
+class WorkerPool:
+    """
+    `workers` threads plus room for `queue_size` waiting jobs; submit() refuses beyond that.
+    """
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.stats = {"workers": workers, "queue_size": queue_size, "in_flight": 0, "completed": 0, "rejected": 0, "timed_out": 0}
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise ApiError(429, "Server is busy, retry shortly", {"Retry-After": "1"})
+        with self._lock:
+            self.stats["in_flight"] += 1
+        future = self._executor.submit(fn, *args)
+        # The slot is only freed when the work is really done, even if the caller stopped waiting
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.stats["timed_out"] += 1
+            raise ApiError(504, f"Request took longer than {self.timeout:.0f}s")
+
+    def _release(self, future):
+        with self._lock:
+            self.stats["in_flight"] -= 1
+            self.stats["completed"] += 1
+        self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+# --- API ---
+
+class DiplomatApi:
+    """
+    Routes and request handling, independent of the HTTP plumbing below.
+    """
+    def __init__(self, service, suggestion_capacity: int = 10000):
+        self.service = service
+        # Suggestions handed out, so /v1/outcome can refer to them by id (oldest dropped first)
+        self._suggestions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._suggestion_capacity = suggestion_capacity
+        self._lock = threading.Lock()
+
+    def route(self, method: str, path: str):
+        """
+        Returns (handler, path params) or raises ApiError(404/405).
+        """
+        parts = [unquote(p) for p in path.strip("/").split("/") if p]
+        if parts == ["healthz"]:
+            routes = {}
+        elif parts[:1] != ["v1"]:
+            raise ApiError(404, "Not found")
+        else:
+            parts = parts[1:]
+            if parts == ["advice"]:
+                routes = {"POST": self.advice}
+            elif parts == ["outcome"]:
+                routes = {"POST": self.outcome}
+            elif parts == ["users"]:
+                routes = {"POST": self.create_user}
+            elif len(parts) == 2 and parts[0] == "users":
+                routes = {"GET": self.get_user, "PATCH": self.update_user, "DELETE": self.delete_user}
+            elif len(parts) == 3 and parts[0] == "users" and parts[2] == "contacts":
+                routes = {"GET": self.list_contacts, "POST": self.add_contact}
+            elif len(parts) == 4 and parts[0] == "users" and parts[2] == "contacts":
+                routes = {"PUT": self.update_contact, "DELETE": self.delete_contact}
+            else:
+                raise ApiError(404, "Not found")
+            parts = parts[1::2] # the path parameters: username, contact name
+        handler = routes.get(method)
+        if handler is None:
+            raise ApiError(405, f"{method} not allowed here")
+        return handler, parts
+
+    # --- Helpers ---
+
+    def _user(self, username: str):
+        user = self.service.repository.get_user(username)
+        if user is None:
+            raise ApiError(404, f"No user {username!r}")
+        return user
+
+    @staticmethod
+    def _field(body: dict, name: str, default=None, required: bool = True, kind: type = str):
+        value = body.get(name, default)
+        if required and value in (None, ""):
+            raise ApiError(400, f"'{name}' is required")
+        if value is not None and not isinstance(value, kind):
+            raise ApiError(400, f"'{name}' must be {'true or false' if kind is bool else 'a string'}")
+        return value
+
+    @staticmethod
+    def _user_json(user) -> dict:
+        return {
+            "username": user.username,
+            "email": user.email,
+            "self_context": user.self_context,
+            "contacts": [DiplomatApi._contact_json(c) for c in user.contacts]
+        }
+
+    @staticmethod
+    def _contact_json(contact) -> dict:
+        return {"name": contact.name, "relationship": contact.relationship, "description": contact.description}
+
+    # --- Advice ---
+
+    def advice(self, body: dict):
+        username = self._field(body, "username", required=False)
+        user = self._user(username) if username else None
+        refined = self.service.get_advice(
+            user,
+            self._field(body, "text"),
+            self._field(body, "recipient", "", required=False),
+            self._field(body, "relation", "", required=False),
+            self._field(body, "tone", "Professional", required=False),
+            self._field(body, "channel", "Chat Message", required=False),
+            use_cache=bool(body.get("use_cache", True))
+        )
+        suggestion_id = uuid.uuid4().hex
+        with self._lock:
+            self._suggestions[suggestion_id] = (username, refined)
+            while len(self._suggestions) > self._suggestion_capacity:
+                self._suggestions.popitem(last=False)
+        return 200, {
+            "suggestion_id": suggestion_id,
+            "suggestion": refined.suggested_content,
+            "reasoning": refined.reasoning,
+            "changes": refined.changes_made,
+            "tone": refined.original_message.intended_tone.value,
+            "channel": refined.original_message.channel.value
+        }
+
+    def outcome(self, body: dict):
+        # Validate before taking the suggestion, so a bad request doesn't use it up
+        suggestion_id = self._field(body, "suggestion_id")
+        accepted = self._field(body, "accepted", kind=bool)
+        final_text = self._field(body, "final_text", required=False)
+        with self._lock:
+            entry = self._suggestions.pop(suggestion_id, None)
+        if entry is None:
+            raise ApiError(404, "Unknown or already answered suggestion_id")
+        username, refined = entry
+        default_final = refined.suggested_content if accepted else refined.original_message.content
+        user = self._user(username) if username else None
+        self.service.record_outcome(user, refined, accepted, final_text or default_final)
+        return 204, None
+
+    # --- Users ---
+
+    def create_user(self, body: dict):
+        username = self._field(body, "username")
+        if not self.service.register(username, self._field(body, "email", "", required=False), self._field(body, "password")):
+            raise ApiError(409, f"User {username!r} already exists")
+        return 201, self._user_json(self._user(username))
+
+    def get_user(self, body: dict, username: str):
+        return 200, self._user_json(self._user(username))
+
+    def update_user(self, body: dict, username: str):
+        user = self._user(username)
+        self_context = self._field(body, "self_context", required=False)
+        new_username = self._field(body, "new_username", required=False)
+        if "self_context" in body:
+            self.service.update_context(user, self_context or "")
+        if new_username and new_username != username:
+            if not self.service.change_username(user, new_username):
+                raise ApiError(409, f"Username {new_username!r} is taken")
+        return 200, self._user_json(user)
+
+    def delete_user(self, body: dict, username: str):
+        self.service.delete_account(self._user(username))
+        return 204, None
+
+    # --- Contacts ---
+
+    def list_contacts(self, body: dict, username: str):
+        return 200, [self._contact_json(c) for c in self._user(username).contacts]
+
+    def add_contact(self, body: dict, username: str):
+        user = self._user(username)
+        name = self._field(body, "name")
+        if not self.service.add_contact(user, name, self._field(body, "relationship"),
+                                        self._field(body, "description", "", required=False)):
+            raise ApiError(409, f"Contact {name!r} already exists")
+        return 201, self._contact_json(user.get_contact(name))
+
+    def update_contact(self, body: dict, username: str, name: str):
+        user = self._user(username)
+        contact = user.get_contact(name)
+        if contact is None:
+            raise ApiError(404, f"No contact {name!r}")
+        new_name = self._field(body, "name", required=False) or contact.name
+        if not self.service.update_contact(
+            user, name,
+            new_name,
+            self._field(body, "relationship", required=False) or contact.relationship,
+            self._field(body, "description", contact.description, required=False)
+        ):
+            raise ApiError(409, f"Contact {new_name!r} already exists")
+        return 200, self._contact_json(contact)
+
+    def delete_contact(self, body: dict, username: str, name: str):
+        user = self._user(username)
+        if user.get_contact(name) is None:
+            raise ApiError(404, f"No contact {name!r}")
+        self.service.delete_contact(user, name)
+        return 204, None
+
+# --- HTTP ---
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    server_version = "Diplomat"
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _handle(self, method: str):
+        server = self.server
+        try:
+            self._check_auth()
+            body = self._read_json()
+            if self.path.split("?")[0].strip("/") == "healthz":
+                # Answered here, not on the pool: health checks must work while it is saturated
+                status, payload = 200, {"status": "ok", "pool": dict(server.pool.stats)}
+            else:
+                handler, params = server.api.route(method, self.path.split("?")[0])
+                status, payload = server.pool.run(handler, body, *params)
+        except ApiError as e:
+            status, payload = e.status, {"error": str(e)}
+            self._extra_headers = e.headers
+        except RateLimitError as e:
+            status, payload = 429, {"error": "Model is rate limited, retry shortly"}
+            self._extra_headers = {"Retry-After": str(int(e.retry_after or 30))}
+        except LLMTimeoutError as e:
+            status, payload = 504, {"error": str(e)}
+        except LLMError as e:
+            status, payload = 502, {"error": str(e)}
+        except Exception as e:
+            self.log_error("Unhandled error: %r", e)
+            status, payload = 500, {"error": "Internal error"}
+        self._respond(status, payload)
+
+    def _check_auth(self):
+        token = self.server.token
+        if not token:
+            # No token, no remote access (deleting and renaming users would be open to anyone)
+            if not is_loopback(self.client_address[0]):
+                self.close_connection = True # the body is never read, see _read_json
+                raise ApiError(401, "Set DIPLOMAT_API_TOKEN to serve non-local clients")
+            return
+        sent = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(sent.encode(), f"Bearer {token}".encode()):
+            self.close_connection = True
+            raise ApiError(401, "Missing or wrong bearer token")
+
+    def _read_json(self) -> dict:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True # can't tell where the body ends
+            raise ApiError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True # the unread body would be parsed as the next request
+            raise ApiError(413, "Body too large")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Body must be a JSON object")
+        return body
+
+    def _respond(self, status: int, payload):
+        data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close") # so keep-alive clients reconnect instead of failing
+        for name, value in getattr(self, "_extra_headers", {}).items():
+            self.send_header(name, value)
+        self._extra_headers = {}
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api: DiplomatApi, pool: WorkerPool, keepalive: float, token: str = None, quiet: bool = False):
+        # Idle keep-alive connections are dropped after `keepalive` seconds (socket timeout)
+        handler = type("Handler", (ApiHandler,), {"timeout": keepalive})
+        super().__init__(address, handler)
+        self.api = api
+        self.pool = pool
+        self.token = token
+        self.quiet = quiet
+
+def main():
+    parser = argparse.ArgumentParser(description="Diplomat HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="requests processed at once")
+    parser.add_argument("--queue", type=int, default=16, help="requests allowed to wait for a worker before 429")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a request answers 504")
+    parser.add_argument("--keepalive", type=float, default=15, help="idle seconds before a connection is closed")
+    parser.add_argument("--fake", action="store_true", help="use the offline stand-in LLM provider")
+    parser.add_argument("--quiet", action="store_true", help="no access log")
+    args = parser.parse_args()
+    token = os.getenv("DIPLOMAT_API_TOKEN")
+    if not token and not is_loopback(args.host):
+        parser.error(f"refusing to listen on {args.host} without DIPLOMAT_API_TOKEN (anyone could delete users)")
+
+    if args.fake:
+        os.environ["DIPLOMAT_LLM_PROVIDER"] = "fake"
+    # A model router sizes its call pool for this many requests at once
+    os.environ.setdefault("DIPLOMAT_LLM_CONCURRENCY", str(args.workers))
+    # Imported after --fake so the container picks the provider up
+    from application.container import get_container
+
+    service = get_container().service
+    pool = WorkerPool(args.workers, args.queue, args.timeout)
+    server = ApiServer((args.host, args.port), DiplomatApi(service), pool, args.keepalive,
+                       token=token, quiet=args.quiet)
+    print(f"Diplomat API on http://{args.host}:{args.port} ({args.workers} workers, queue {args.queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+        service.repository.flush()
+
+if __name__ == "__main__":
+    main()
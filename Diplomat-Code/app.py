@@ -1,6 +1,8 @@
+import datetime
 import streamlit as st
-from application.service import get_service
+from application.container import get_container
 from domain.models import Tone, CommunicationChannel
+from infrastructure.llm_errors import LLMError, RateLimitError
 
 # --- CONFIG & STYLING ---
 # --- CONFIG & STYLING ---
@@ -9,6 +11,7 @@ st.set_page_config(page_title="Diplomat", page_icon="🕊️", layout="wide")
 if "theme" not in st.session_state:
     st.session_state.theme = "Dark"
 
+@st.cache_data
 def get_theme_css(theme):
     if theme == "Dark":
         return """
@@ -75,8 +78,13 @@ def get_theme_css(theme):
 st.markdown(get_theme_css(st.session_state.theme), unsafe_allow_html=True)
 
 # --- STATE MANAGEMENT ---
+@st.cache_resource
+def load_service():
+    # One service (repository, agent, LLM client) per server process, shared by all sessions
+    return get_container().service
+
 if "agent_service" not in st.session_state:
-    st.session_state.agent_service = get_service()
+    st.session_state.agent_service = load_service()
 
 if "current_user" not in st.session_state:
     st.session_state.current_user = None
@@ -84,6 +92,12 @@ if "current_user" not in st.session_state:
 if "current_suggestion" not in st.session_state:
     st.session_state.current_suggestion = None  # Holds RefinedMessage
 
+if "tone_comparison" not in st.session_state:
+    st.session_state.tone_comparison = None  # List[RefinedMessage], one per compared tone
+
+HISTORY_PAGE_SIZE = 20
+RELATIONSHIPS = ["Boss", "Colleague", "Friend", "Family", "Client", "Professor", "Student", "Romantic Interest", "Acquaintance", "Intern", "Subordinate", "Hiring Manager", "Service Provider", "Mentor", "Neighbour", "Stranger", "Other"]
+
 
 @st.dialog("Authentication")
 def auth_dialog():
@@ -211,9 +225,11 @@ def contact_dialog():
     
     if st.button("Save Contact"):
         if c_name:
-            st.session_state.agent_service.add_contact(user, c_name, c_rel, c_desc)
-            st.success("Saved!")
-            st.rerun()
+            if st.session_state.agent_service.add_contact(user, c_name, c_rel, c_desc):
+                st.success("Saved!")
+                st.rerun()
+            else:
+                st.error("A contact with that name already exists")
         else:
             st.error("Name is required")
 
@@ -221,9 +237,8 @@ def contact_dialog():
 def edit_contact_dialog(contact_name):
     user = st.session_state.current_user
     # Find contact
-    try:
-        contact = next(c for c in user.contacts if c.name == contact_name)
-    except StopIteration:
+    contact = user.get_contact(contact_name)
+    if contact is None:
         st.error("Contact not found")
         # Ensure we don't crash if contact was deleted externally
         if st.button("Close"):
@@ -231,15 +246,17 @@ def edit_contact_dialog(contact_name):
         return
 
     new_name = st.text_input("Name", value=contact.name)
-    new_rel = st.selectbox("Relationship", ["Boss", "Colleague", "Friend", "Family", "Client", "Professor", "Student", "Romantic Interest", "Acquaintance", "Intern", "Subordinate", "Hiring Manager", "Service Provider", "Mentor", "Neighbour", "Stranger", "Other"], index=["Boss", "Colleague", "Friend", "Family", "Client", "Professor", "Student", "Romantic Interest", "Acquaintance", "Intern", "Subordinate", "Hiring Manager", "Service Provider", "Mentor", "Neighbour", "Stranger", "Other"].index(contact.relationship) if contact.relationship in ["Boss", "Colleague", "Friend", "Family", "Client", "Professor", "Student", "Romantic Interest", "Acquaintance", "Intern", "Subordinate", "Hiring Manager", "Service Provider", "Mentor", "Neighbour", "Stranger", "Other"] else 8)
+    new_rel = st.selectbox("Relationship", RELATIONSHIPS, index=RELATIONSHIPS.index(contact.relationship) if contact.relationship in RELATIONSHIPS else 8)
     new_desc = st.text_input("Notes (Optional)", value=contact.description)
     
     col_save, col_del = st.columns([1, 1])
     with col_save:
         if st.button("Save Changes", type="primary"):
-            st.session_state.agent_service.update_contact(user, contact.name, new_name, new_rel, new_desc)
-            st.success("Updated!")
-            st.rerun()
+            if st.session_state.agent_service.update_contact(user, contact.name, new_name, new_rel, new_desc):
+                st.success("Updated!")
+                st.rerun()
+            else:
+                st.error("A contact with that name already exists")
     
     with col_del:
         if st.button("🗑️ Delete Contact", type="primary"): 
@@ -249,42 +266,128 @@ def edit_contact_dialog(contact_name):
 @st.dialog("Message History", width="large")
 def history_dialog():
     user = st.session_state.current_user
-    history = sorted(user.memory.history, key=lambda x: x.timestamp, reverse=True)
     
-    if not history:
-        st.info("No history found.")
+    # Filter (recipient list and filtering both come from storage); the list is read once per opening
+    if "history_recipients" not in st.session_state:
+        st.session_state.history_recipients = ["All"] + user.memory.history.recipients()
+    recipients = st.session_state.history_recipients
+    search_text = st.text_input("Search", placeholder='words or "an exact phrase"')
+    selected_recipient = st.selectbox("Filter by Recipient", recipients)
+    recipient = None if selected_recipient == "All" else selected_recipient
+
+    with st.expander("More filters"):
+        f1, f2, f3 = st.columns(3)
+        tone = f1.selectbox("Tone", ["Any"] + [t.value for t in Tone])
+        relation = f2.selectbox("Relationship", ["Any"] + RELATIONSHIPS)
+        outcome = f3.selectbox("Outcome", ["Any", "Accepted", "Rejected"])
+        dates = st.date_input("Date range", value=(), format="YYYY-MM-DD")
+
+    # Full-text search as soon as there's text or a filter beyond the recipient; plain paging otherwise
+    search = {
+        "text": search_text.strip(),
+        "tone": None if tone == "Any" else tone,
+        "relation": None if relation == "Any" else relation,
+        "accepted": None if outcome == "Any" else outcome == "Accepted",
+        "since": datetime.datetime.combine(dates[0], datetime.time.min) if dates else None,
+        "until": datetime.datetime.combine(dates[-1] + datetime.timedelta(days=1), datetime.time.min) if dates else None
+    }
+    if any(v is not None and v != "" for v in search.values()):
+        state = st.session_state.get("history_search")
+        if not state or state["query"] != (search, recipient):
+            state = {"query": (search, recipient), "limit": HISTORY_PAGE_SIZE}
+            st.session_state.history_search = state
+        hits = st.session_state.agent_service.search_history(user, recipient=recipient, limit=state["limit"], **search)
+        if not hits:
+            st.info("No matching messages.")
+            return
+        st.markdown("---")
+        for hit in hits:
+            render_history_item(hit.interaction)
+        if len(hits) == state["limit"] and st.button("Show more results"):
+            state["limit"] += HISTORY_PAGE_SIZE
+            st.rerun(scope="fragment")
         return
-
-    # Filter
-    all_recipients = set(h.message.recipient_name for h in history)
-    recipients = ["All"] + sorted(list(all_recipients))
     
-    selected_recipient = st.selectbox("Filter by Recipient", recipients)
+    # Newest-first pages, kept across dialog reruns until the filter changes
+    pages = st.session_state.get("history_pages")
+    if not pages or pages["recipient"] != recipient:
+        first = user.memory.history.page(limit=HISTORY_PAGE_SIZE, recipient=recipient)
+        pages = {"recipient": recipient, "items": first.items, "cursor": first.next_cursor}
+        st.session_state.history_pages = pages
     
-    if selected_recipient != "All":
-        history = [h for h in history if h.message.recipient_name == selected_recipient]
+    if not pages["items"]:
+        st.info("No history found.")
+        return
     
     st.markdown("---")
     
-    for h in history:
-        with st.container(border=True):
-            cols = st.columns([3, 1])
-            cols[0].markdown(f"**To:** {h.message.recipient_name}")
-            cols[1].caption(h.timestamp.strftime("%Y-%m-%d %H:%M"))
-            
-            st.caption("Original Draft")
-            st.text(h.message.content)
-            
-            st.caption("Agent Response")
-            st.markdown(f"```text\n{h.final_content}\n```")
-            
-            if h.accepted:
-                st.caption("✅ Accepted")
-            else:
-                st.caption("❌ Rejected")
+    for h in pages["items"]:
+        render_history_item(h)
+    
+    if pages["cursor"] is not None:
+        if st.button("Load older messages"):
+            more = user.memory.history.page(limit=HISTORY_PAGE_SIZE, before=pages["cursor"], recipient=recipient)
+            pages["items"] = pages["items"] + more.items
+            pages["cursor"] = more.next_cursor
+            st.rerun(scope="fragment")
+
+def render_history_item(h):
+    with st.container(border=True):
+        cols = st.columns([3, 1])
+        cols[0].markdown(f"**To:** {h.message.recipient_name}")
+        cols[1].caption(h.timestamp.strftime("%Y-%m-%d %H:%M"))
+        
+        st.caption("Original Draft")
+        st.text(h.message.content)
+        
+        st.caption("Agent Response")
+        st.markdown(f"```text\n{h.final_content}\n```")
+        
+        if h.accepted:
+            st.caption("✅ Accepted")
+        else:
+            st.caption("❌ Rejected")
 
 # --- SIDEBAR (Context & Auth) ---
-with st.sidebar:
+# Fragments: opening a dialog or editing a contact reruns only the sidebar, not the page.
+# Whatever the main area depends on (login, theme, selected contact) still calls a full st.rerun().
+
+@st.fragment
+def contacts_panel():
+    user = st.session_state.current_user
+    st.markdown("### 📒 Saved Contacts")
+    
+    if st.button("➕ Add New Contact"):
+        contact_dialog()
+        
+    
+    # Ensure state exists
+    if "selected_contact_name" not in st.session_state:
+        st.session_state.selected_contact_name = "Custom"
+        
+    # Custom Button
+    if st.button("Custom", 
+                 type="primary" if st.session_state.selected_contact_name == "Custom" else "secondary", 
+                 use_container_width=True):
+        st.session_state.selected_contact_name = "Custom"
+        st.rerun()
+        
+    # List Contacts
+    for c in user.contacts:
+        c1, c2 = st.columns([0.8, 0.2])
+        with c1:
+            if st.button(c.name, 
+                         key=f"btn_sel_{c.name}", 
+                         type="primary" if st.session_state.selected_contact_name == c.name else "secondary",
+                         use_container_width=True):
+                st.session_state.selected_contact_name = c.name
+                st.rerun()
+        with c2:
+            if st.button("⚙️", key=f"btn_edit_{c.name}", type="tertiary"):
+                edit_contact_dialog(c.name)
+
+@st.fragment
+def sidebar_panel():
     st.title("🕊️ Diplomat")
     
     # --- AUTH SECTION ---
@@ -317,42 +420,20 @@ with st.sidebar:
             st.rerun()
 
         if st.button("📜 History"):
+            # Start from the newest page every time the dialog is opened
+            st.session_state.pop("history_pages", None)
+            st.session_state.pop("history_recipients", None)
+            st.session_state.pop("history_search", None)
             history_dialog()
 
         if st.button("⚙️ Settings"):
             settings_dialog()
         
         st.markdown("---")
-        st.markdown("### 📒 Saved Contacts")
-        
-        if st.button("➕ Add New Contact"):
-            contact_dialog()
-            
-        
-        # Ensure state exists
-        if "selected_contact_name" not in st.session_state:
-            st.session_state.selected_contact_name = "Custom"
-            
-        # Custom Button
-        if st.button("Custom", 
-                     type="primary" if st.session_state.selected_contact_name == "Custom" else "secondary", 
-                     use_container_width=True):
-            st.session_state.selected_contact_name = "Custom"
-            st.rerun()
-            
-        # List Contacts
-        for c in user.contacts:
-            c1, c2 = st.columns([0.8, 0.2])
-            with c1:
-                if st.button(c.name, 
-                             key=f"btn_sel_{c.name}", 
-                             type="primary" if st.session_state.selected_contact_name == c.name else "secondary",
-                             use_container_width=True):
-                    st.session_state.selected_contact_name = c.name
-                    st.rerun()
-            with c2:
-                if st.button("⚙️", key=f"btn_edit_{c.name}", type="tertiary"):
-                    edit_contact_dialog(c.name)
+        contacts_panel()
+
+with st.sidebar:
+    sidebar_panel()
 
 # --- MAIN AREA ---
 
@@ -375,19 +456,16 @@ with c_side:
         st.session_state.selected_contact_name = "Custom"
 
     if selected_contact_name != "Custom" and st.session_state.current_user:
-        try:
-            contact = next(c for c in st.session_state.current_user.contacts if c.name == selected_contact_name)
+        contact = st.session_state.current_user.get_contact(selected_contact_name)
+        if contact is not None:
             recipient_name = st.text_input("Recipient Name", value=contact.name, disabled=True)
             relationship = st.text_input("Relationship", value=contact.relationship, disabled=True)
-        except StopIteration:
+        else:
             st.session_state.selected_contact_name = "Custom"
             st.rerun()
     else:
         recipient_name = st.text_input("Recipient Name", placeholder="e.g., Mr. Smith")
-        relationship = st.selectbox(
-            "Relationship", 
-            ["Boss", "Colleague", "Friend", "Family", "Client", "Professor", "Student", "Romantic Interest", "Acquaintance", "Intern", "Subordinate", "Hiring Manager", "Service Provider", "Mentor", "Neighbour", "Stranger", "Other"]
-        )
+        relationship = st.selectbox("Relationship", RELATIONSHIPS)
 
     tone = st.selectbox("Target Tone", [t.value for t in Tone])
     channel = st.selectbox("Format", [c.value for c in CommunicationChannel])
@@ -395,34 +473,99 @@ with c_side:
     msg_context = st.text_area("Situation Context", height=130)
     st.info("Optional: Add specific context (e.g., 'They are angry').")
 
+    compare_tones = st.multiselect("Compare Tones", [t.value for t in Tone], max_selections=4)
+
 # --- LEFT SIDE (Draft & Action) ---
 with c_main:
     st.markdown("### 📝Drafting")
     user_draft = st.text_area("Draft your message here...", height=500, placeholder="e.g., Hey u, send me the files ASAP.")
     analyze_btn = st.button("✨ Analyze & Refine", type="primary", use_container_width=True)
+    compare_btn = st.button("🔀 Compare Tones", use_container_width=True, disabled=len(compare_tones) < 2)
 
 # --- LOGIC FLOW ---
 
-if analyze_btn and user_draft:
+def full_draft() -> str:
     # AppendContext
-    full_text_to_analyze = user_draft
     if msg_context:
-        full_text_to_analyze = f"[Context: {msg_context}] \nMessage: {user_draft}"
-
-    with st.spinner("Thinking..."):
-        suggestion = st.session_state.agent_service.get_advice(
-            st.session_state.current_user, 
-            full_text_to_analyze, 
-            recipient_name, 
-            relationship, 
-            tone,
-            channel
-        )
-        st.session_state.current_suggestion = suggestion
+        return f"[Context: {msg_context}] \nMessage: {user_draft}"
+    return user_draft
+
+def show_llm_error(e: LLMError):
+    # Nothing is stored as a suggestion, so the user can simply press the button again
+    if isinstance(e, RateLimitError):
+        st.warning("System is currently cooling down (Rate Limit). Please wait 30-60 seconds and try again.")
+    else:
+        st.error(f"Error generating suggestion: {e}")
+
+# The draft was edited (text areas rerun the script once the user pauses / leaves the field):
+# start on the suggestion Analyze would ask for, so it is ready when the button is clicked
+if st.session_state.current_user and selected_contact_name != "Custom" and not (analyze_btn or compare_btn):
+    # Context alone isn't a message: with an empty draft this just cancels the user's last prefetch
+    st.session_state.agent_service.prefetch_advice(
+        st.session_state.current_user, full_draft() if user_draft.strip() else "", recipient_name, relationship, tone, channel
+    )
+
+if analyze_btn and user_draft:
+    full_text_to_analyze = full_draft()
+
+    # Stream the rewrite as it is generated; the explanation follows once it's complete
+    st.markdown("---")
+    st.subheader("💡 Suggestion")
+    stream = st.session_state.agent_service.get_advice_stream(
+        st.session_state.current_user, 
+        full_text_to_analyze, 
+        recipient_name, 
+        relationship, 
+        tone,
+        channel
+    )
+    try:
+        st.write_stream(stream)
+    except LLMError as e:
+        show_llm_error(e)
+    else:
+        st.session_state.current_suggestion = stream.result
         st.session_state.suggestion_status = "pending"
+        # Re-render through the regular suggestion panel below (with reasoning and decision buttons)
+        st.rerun()
+
+if compare_btn and user_draft:
+    full_text_to_analyze = full_draft()
+
+    try:
+        with st.spinner(f"Trying {len(compare_tones)} tones..."):
+            st.session_state.tone_comparison = st.session_state.agent_service.get_advice_batch(
+                st.session_state.current_user,
+                full_text_to_analyze,
+                recipient_name,
+                relationship,
+                [(t, channel) for t in compare_tones]
+            )
+    except LLMError as e:
+        show_llm_error(e)
+
+# Side-by-side comparison: picking one makes it the regular suggestion below
+if st.session_state.tone_comparison:
+    st.markdown("---")
+    st.subheader("🔀 Tone Comparison")
+    columns = st.columns(len(st.session_state.tone_comparison))
+    for i, (col, option) in enumerate(zip(columns, st.session_state.tone_comparison)):
+        with col:
+            st.markdown(f"**{option.original_message.intended_tone.value}**")
+            st.markdown(f"```text\n{option.suggested_content}\n```")
+            st.caption(option.reasoning)
+            if st.button("Use this", key=f"compare_pick_{i}", use_container_width=True):
+                st.session_state.current_suggestion = option
+                st.session_state.suggestion_status = "pending"
+                st.session_state.tone_comparison = None
+                st.rerun()
 
 # Display Result
-if st.session_state.current_suggestion:
+@st.fragment
+def suggestion_panel(full_text_to_analyze, recipient_name, relationship, tone, channel):
+    """
+    Accept / Reject / Regenerate only rerun this panel; the inputs are the ones of the last full run.
+    """
     refined = st.session_state.current_suggestion
     
     st.markdown("---")
@@ -444,7 +587,7 @@ if st.session_state.current_suggestion:
             )
             st.toast("Learned: You liked this style!")
             st.session_state.suggestion_status = "accepted"
-            st.rerun()
+            st.rerun(scope="fragment")
         
         if b2.button("❌ Reject"):
             st.session_state.agent_service.record_outcome(
@@ -452,7 +595,7 @@ if st.session_state.current_suggestion:
             )
             st.toast("Learned: You disliked this style.")
             st.session_state.suggestion_status = "rejected"
-            st.rerun()
+            st.rerun(scope="fragment")
             
     else:
         st.info("Thank you for your feedback!")
@@ -461,22 +604,26 @@ if st.session_state.current_suggestion:
     if status == "rejected":
         if st.button("🔄 Regenerate Response"):
              # Re-run logic with same params
-             full_text_to_analyze = user_draft
-             if msg_context:
-                full_text_to_analyze = f"[Context: {msg_context}] \nMessage: {user_draft}"
-             
-             with st.spinner("Regenerating..."):
-                suggestion = st.session_state.agent_service.get_advice(
-                    st.session_state.current_user, 
-                    full_text_to_analyze, 
-                    recipient_name, 
-                    relationship, 
-                    tone,
-                    channel
-                )
+             try:
+                with st.spinner("Regenerating..."):
+                    suggestion = st.session_state.agent_service.get_advice(
+                        st.session_state.current_user, 
+                        full_text_to_analyze, 
+                        recipient_name, 
+                        relationship, 
+                        tone,
+                        channel,
+                        use_cache=False # the user wants a different answer, not the cached one
+                    )
+             except LLMError as e:
+                show_llm_error(e)
+             else:
                 st.session_state.current_suggestion = suggestion
                 st.session_state.suggestion_status = "pending"
-                st.rerun()
+                st.rerun(scope="fragment")
+
+if st.session_state.current_suggestion:
+    suggestion_panel(full_draft(), recipient_name, relationship, tone, channel)
 
 # --- DIALOG TRIGGERS ---
 if "confirm_delete_account" in st.session_state:
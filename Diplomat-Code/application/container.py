@@ -0,0 +1,58 @@
+import threading
+
+class Container:
+    """
+    Builds the app's long-lived objects on first use and shares them:
+    one repository, one agent / rule engine, one service. The LLM provider (and with it
+    the google.generativeai import and client) is only created on the first model call.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._repository = None
+        self._agent = None
+        self._service = None
+        self._env_loaded = False
+
+    def _load_env(self):
+        # .env must be read before anything looks at DIPLOMAT_* / GEMINI_API_KEY
+        if not self._env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            self._env_loaded = True
+
+    @property
+    def repository(self):
+        with self._lock:
+            if self._repository is None:
+                self._load_env()
+                from infrastructure.repository import get_repository
+                self._repository = get_repository()
+            return self._repository
+
+    @property
+    def agent(self):
+        with self._lock:
+            if self._agent is None:
+                from domain.agent import DiplomatAgent
+                from domain.rules import RuleEngine
+                # RuleEngine without a provider creates it lazily, on the first refine call
+                self._agent = DiplomatAgent(self.repository, brain=RuleEngine())
+            return self._agent
+
+    @property
+    def service(self):
+        with self._lock:
+            if self._service is None:
+                from application.service import AgentService
+                self._service = AgentService(repository=self.repository, agent=self.agent)
+            return self._service
+
+_container = None
+_container_lock = threading.Lock()
+
+def get_container() -> Container:
+    global _container
+    with _container_lock:
+        if _container is None:
+            _container = Container()
+        return _container
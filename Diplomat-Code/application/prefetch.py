@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+from domain.models import RefinedMessage
+from infrastructure.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class PrefetchKey:
+    username: str
+    text: str
+    recipient: str
+    relation: str
+    tone: str
+    channel: str
+
+class PrefetchScheduler:
+    """
+    Computes a likely suggestion in the background so Analyze can return it right away.
+
+    Each user has at most one prefetch in flight: scheduling a different key (the draft
+    changed) cancels the previous one, or drops its result if it is already running.
+    All prefetches together are capped at `share` of the LLM requests-per-minute quota,
+    however many users there are, and each user at `user_share` of it, so one busy
+    editor can't use up everyone's prefetches. Per-user state is kept for the
+    `max_users` most recently active users.
+    """
+    def __init__(self, workers: int = 2, share: float = None, user_share: float = None, rpm: float = None,
+                 max_users: int = 1024):
+        if share is None:
+            share = float(os.getenv("DIPLOMAT_PREFETCH_SHARE", "0.25"))
+        if user_share is None:
+            user_share = float(os.getenv("DIPLOMAT_PREFETCH_USER_SHARE", "0.1"))
+        if rpm is None:
+            rpm = float(os.getenv("DIPLOMAT_LLM_RPM", "10"))
+        self.per_minute = share * rpm
+        self.per_user_minute = min(user_share, share) * rpm
+        self.max_users = max_users
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._budget = self._bucket(self.per_minute)
+        self._user_budgets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._jobs: "OrderedDict[str, Tuple[PrefetchKey, Future]]" = OrderedDict() # username -> latest job
+        # Last key handed out per user: the rerun right after Analyze must not prefetch it again
+        self._served: "OrderedDict[str, PrefetchKey]" = OrderedDict()
+        self.stats = {"scheduled": 0, "hits": 0, "misses": 0, "cancelled": 0, "over_budget": 0}
+
+    @staticmethod
+    def _bucket(per_minute: float) -> TokenBucket:
+        return TokenBucket(capacity=max(1.0, per_minute), refill_per_second=per_minute / 60)
+
+    def _evict(self):
+        # Caller holds self._lock. Least recently active users go first; a job that was
+        # never taken (the user left) is cancelled and its result dropped.
+        while len(self._jobs) > self.max_users:
+            self._drop(next(iter(self._jobs)))
+        while len(self._served) > self.max_users:
+            self._served.popitem(last=False)
+        while len(self._user_budgets) > self.max_users:
+            self._user_budgets.popitem(last=False)
+
+    def schedule(self, key: PrefetchKey, compute: Callable[[], RefinedMessage]) -> bool:
+        """
+        Starts `compute` for `key` unless it is already prefetched or the user (or everyone) is out of budget.
+        """
+        with self._lock:
+            if self._served.get(key.username) == key:
+                return False
+            job = self._jobs.get(key.username)
+            if job is not None:
+                if job[0] == key:
+                    return True
+                self._drop(key.username)
+
+            user_budget = self._user_budgets.get(key.username)
+            if user_budget is None:
+                user_budget = self._user_budgets[key.username] = self._bucket(self.per_user_minute)
+            self._user_budgets.move_to_end(key.username)
+            now = time.monotonic()
+            if (self.per_user_minute <= 0 or user_budget.wait_time(1, now) > 0
+                    or self._budget.wait_time(1, now) > 0):
+                self.stats["over_budget"] += 1
+                self._evict()
+                return False
+            self._budget.take(1)
+            user_budget.take(1)
+
+            self._jobs[key.username] = (key, self._executor.submit(compute))
+            self._evict()
+            self.stats["scheduled"] += 1
+            return True
+
+    def take(self, key: PrefetchKey) -> Optional[RefinedMessage]:
+        """
+        The prefetched suggestion for exactly this request, waiting for it if still in flight.
+        None if there is none (or it failed): the caller then computes it normally.
+        """
+        with self._lock:
+            self._served[key.username] = key
+            self._served.move_to_end(key.username)
+            self._evict()
+            job = self._jobs.get(key.username)
+            if job is None or job[0] != key:
+                self.stats["misses"] += 1
+                return None
+            del self._jobs[key.username]
+
+        try:
+            refined = job[1].result()
+        except CancelledError:
+            refined = None
+        except Exception:
+            logger.debug("Prefetch failed", exc_info=True)
+            refined = None
+
+        with self._lock:
+            self.stats["hits" if refined is not None else "misses"] += 1
+        return refined
+
+    def cancel(self, username: str):
+        with self._lock:
+            self._drop(username)
+
+    def _drop(self, username: str):
+        job = self._jobs.pop(username, None)
+        if job is not None:
+            job[1].cancel() # no-op once running; the result is simply never read
+            self.stats["cancelled"] += 1
@@ -1,11 +1,31 @@
+import asyncio
+import datetime
+import threading
+from typing import List, Tuple, Optional
 from domain.agent import DiplomatAgent
-from domain.models import RefinedMessage, AppUser, Contact
-from infrastructure.repository import Repository
+from domain.models import RefinedMessage, AppUser, Contact, SearchHit
+from domain.search import SearchQuery
+from infrastructure.repository import get_repository
+from application.prefetch import PrefetchScheduler, PrefetchKey
+
+class AdviceStream:
+    """
+    Iterate to get the suggestion text as it arrives (e.g. st.write_stream);
+    once exhausted, `result` holds the finished RefinedMessage.
+    """
+    def __init__(self, generator):
+        self._generator = generator
+        self.result: RefinedMessage = None
+
+    def __iter__(self):
+        self.result = yield from self._generator
 
 class AgentService:
-    def __init__(self):
-        self.agent = DiplomatAgent()
-        self.repository = Repository()
+    def __init__(self, repository=None, agent: DiplomatAgent = None):
+        # One shared (cached) repository for the service and the agent (see application/container.py)
+        self.repository = repository or get_repository()
+        self.agent = agent or DiplomatAgent(self.repository)
+        self.prefetcher = PrefetchScheduler()
         
         # Temporary "Guest" user for guests
         self.guest_user = AppUser(username="guest", email="", password_hash="", self_context="")
@@ -41,42 +61,157 @@ class AgentService:
     def delete_account(self, user: AppUser):
         self.repository.delete_user(user.username)
 
-    def add_contact(self, user: AppUser, name: str, relation: str, desc: str):
-        c = Contact(name=name, relationship=relation, description=desc)
-        user.contacts.append(c)
+    def add_contact(self, user: AppUser, name: str, relation: str, desc: str) -> bool:
+        if not user.add_contact(Contact(name=name, relationship=relation, description=desc)):
+            return False # Name already taken
         self.repository.save_user(user)
+        return True
 
     def delete_contact(self, user: AppUser, contact_name: str):
-        user.contacts = [c for c in user.contacts if c.name != contact_name]
-        self.repository.save_user(user)
+        if user.remove_contact(contact_name):
+            self.repository.save_user(user)
 
-    def update_contact(self, user: AppUser, old_name: str, new_name: str, new_rel: str, new_desc: str):
-        for c in user.contacts:
-            if c.name == old_name:
-                c.name = new_name
-                c.relationship = new_rel
-                c.description = new_desc
-                break
+    def update_contact(self, user: AppUser, old_name: str, new_name: str, new_rel: str, new_desc: str) -> bool:
+        if user.update_contact(old_name, new_name, new_rel, new_desc) is None:
+            return False # Missing, or the new name is taken
         self.repository.save_user(user)
+        return True
 
-    def get_advice(self, user: AppUser, current_text: str, recipient: str, relation: str, tone: str, channel: str) -> RefinedMessage:
+    def search_history(self, user: AppUser, text: str = "", tone: Optional[str] = None, relation: Optional[str] = None,
+                       recipient: Optional[str] = None, accepted: Optional[bool] = None,
+                       since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+                       limit: int = 20) -> List[SearchHit]:
+        query = SearchQuery(text=text, tone=tone, relationship=relation, recipient=recipient,
+                            accepted=accepted, since=since, until=until)
+        return user.memory.history.search(query, limit)
+
+    def get_advice(self, user: AppUser, current_text: str, recipient: str, relation: str, tone: str, channel: str, use_cache: bool = True) -> RefinedMessage:
+        if use_cache and user:
+            refined = self.prefetcher.take(PrefetchKey(user.username, current_text, recipient, relation, tone, channel))
+            if refined is not None:
+                return refined
+        return self._advise(user, current_text, recipient, relation, tone, channel, use_cache)
+
+    def _advise(self, user: AppUser, current_text: str, recipient: str, relation: str, tone: str, channel: str, use_cache: bool = True) -> RefinedMessage:
         # Use guest if no user provided
         active_user = user if user else self.guest_user
         
         # 1. Sense
         msg = self.agent.sense(current_text, recipient, relation, tone, channel)
         # 2. Think (Pass user for memory/context)
-        refined = self.agent.think(msg, active_user)
+        refined = self.agent.think(msg, active_user, use_cache=use_cache)
         return refined
 
+    def get_advice_stream(self, user: AppUser, current_text: str, recipient: str, relation: str, tone: str, channel: str, use_cache: bool = True) -> AdviceStream:
+        if use_cache and user:
+            refined = self.prefetcher.take(PrefetchKey(user.username, current_text, recipient, relation, tone, channel))
+            if refined is not None:
+                return AdviceStream(self._replay(refined))
+
+        active_user = user if user else self.guest_user
+        
+        # 1. Sense
+        msg = self.agent.sense(current_text, recipient, relation, tone, channel)
+        # 2. Think, streamed
+        return AdviceStream(self.agent.think_stream(msg, active_user, use_cache=use_cache))
+
+    @staticmethod
+    def _replay(refined: RefinedMessage):
+        yield refined.suggested_content
+        return refined
+
+    # --- Prefetch ---
+
+    def prefetch_advice(self, user: AppUser, current_text: str, recipient: str, relation: str, tone: str, channel: str) -> bool:
+        """
+        Starts computing the suggestion Analyze would ask for with these inputs.
+        Replaces (cancels) any earlier prefetch of this user. Returns False if nothing was started.
+        """
+        if not user or not current_text.strip():
+            if user:
+                self.prefetcher.cancel(user.username)
+            return False
+        key = PrefetchKey(user.username, current_text, recipient, relation, tone, channel)
+        return self.prefetcher.schedule(
+            key, lambda: self._advise(user, current_text, recipient, relation, tone, channel)
+        )
+
     def record_outcome(self, user: AppUser, refined: RefinedMessage, accepted: bool, final_text: str):
         active_user = user if user else self.guest_user
         # 4. Learn
         self.agent.learn(refined, accepted, final_text, active_user)
 
-_service_instance = None
+    # --- Async API ---
+
+    async def get_advice_async(self, user: AppUser, current_text: str, recipient: str, relation: str, tone: str, channel: str, use_cache: bool = True) -> RefinedMessage:
+        active_user = user if user else self.guest_user
+        msg = self.agent.sense(current_text, recipient, relation, tone, channel)
+        return await self.agent.think_async(msg, active_user, use_cache=use_cache)
+
+    async def record_outcome_async(self, user: AppUser, refined: RefinedMessage, accepted: bool, final_text: str):
+        active_user = user if user else self.guest_user
+        await self.agent.learn_async(refined, accepted, final_text, active_user)
+
+    async def advise_after_outcome_async(self, user: AppUser, previous: RefinedMessage, accepted: bool, final_text: str,
+                                         current_text: str, recipient: str, relation: str, tone: str, channel: str) -> RefinedMessage:
+        """
+        Records the outcome of the previous suggestion while the next one is being generated.
+        The new suggestion sees the updated preferences: memory is updated before the first await.
+        """
+        _, refined = await asyncio.gather(
+            self.record_outcome_async(user, previous, accepted, final_text),
+            self.get_advice_async(user, current_text, recipient, relation, tone, channel)
+        )
+        return refined
+
+    # --- Fan-out ---
+
+    async def get_advice_batch_async(self, user: AppUser, current_text: str, recipient: str, relation: str,
+                                     targets: List[Tuple[str, str]], use_cache: bool = True) -> List[RefinedMessage]:
+        """
+        One draft, several (tone, channel) targets, all generated concurrently:
+        comparing N tones costs about one round trip of wall-clock time.
+        Results come back in the order of `targets` (duplicates are generated once).
+        """
+        unique = list(dict.fromkeys(targets))
+        results = await asyncio.gather(
+            *(self.get_advice_async(user, current_text, recipient, relation, tone, channel, use_cache=use_cache)
+              for tone, channel in unique),
+            return_exceptions=True # let every target finish before reporting a failure
+        )
+        for r in results:
+            if isinstance(r, BaseException):
+                raise r
+        by_target = dict(zip(unique, results))
+        return [by_target[t] for t in targets]
+
+    def get_advice_batch(self, user: AppUser, current_text: str, recipient: str, relation: str,
+                         targets: List[Tuple[str, str]], use_cache: bool = True) -> List[RefinedMessage]:
+        """
+        Blocking wrapper around get_advice_batch_async (Streamlit scripts run without an event loop).
+        """
+        coro = self.get_advice_batch_async(user, current_text, recipient, relation, targets, use_cache=use_cache)
+        return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+# --- Background Event Loop ---
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """
+    One event loop for the whole process, run by a daemon thread. The async Gemini client
+    binds to the loop it is first used on, so blocking callers submit their coroutines here
+    instead of starting a new loop per call with asyncio.run().
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="advice-event-loop", daemon=True).start()
+    return _loop
+
 def get_service():
-    global _service_instance
-    if _service_instance is None:
-        _service_instance = AgentService()
-    return _service_instance
+    # Kept for scripts; the shared instance lives in the container
+    from application.container import get_container
+    return get_container().service
@@ -0,0 +1,264 @@
+"""
+Runs a file of drafts through the agent's sense -> think pipeline.
+
+    python batch_refine.py --input drafts.jsonl --output refined.jsonl --workers 8
+    python batch_refine.py --input drafts.csv --output refined.jsonl --resume      # after a crash / Ctrl+C
+
+Input rows (JSONL objects or CSV columns): text (or draft), tone, channel, relationship,
+and optionally recipient and id. The input is streamed, never loaded whole.
+
+Output is JSONL, one line per input row in completion order:
+    {"line": 12, "id": "...", "suggestion": "...", "reasoning": "...", "changes": [...]}
+or {"line": 12, "id": "...", "error": "..."} for rows that failed.
+
+Workers never open the user store: --user is read once up front. Rate limits are kept by the
+provider's own limiter, which counts every model call: the thread pool shares one at --rpm / --tpm,
+and with --processes each process gets --rpm / --workers (and --tpm / --workers).
+
+Every --checkpoint-every results, <output>.checkpoint records the first input row not yet
+finished (all rows before it are in the output), the rows after it that did finish (results
+complete out of order), and the matching input and output offsets; --resume continues from there.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# --- Input ---
+
+def read_jsonl(path: str, start_line: int, start_offset: int):
+    """
+    Yields (line number, byte offset of the line, offset of the next line, row).
+    Seeks straight to the checkpoint.
+    """
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        line_no = start_line
+        while True:
+            offset = f.tell()
+            raw = f.readline()
+            if not raw:
+                return
+            if raw.strip():
+                try:
+                    row = json.loads(raw)
+                except ValueError as e:
+                    row = {"_error": f"Invalid JSON: {e}"}
+                yield line_no, offset, f.tell(), row
+            line_no += 1
+
+def read_csv(path: str, start_line: int):
+    # CSV fields can contain newlines, so offsets aren't usable: skip rows instead
+    with open(path, newline="", encoding="utf-8") as f:
+        for line_no, row in enumerate(csv.DictReader(f)):
+            if line_no >= start_line:
+                yield line_no, None, None, row
+
+def read_rows(path: str, fmt: str, start_line: int, start_offset: int):
+    if fmt == "jsonl":
+        return read_jsonl(path, start_line, start_offset)
+    return read_csv(path, start_line)
+
+# --- Worker ---
+
+_agent = None
+_user = None
+
+def load_persona(username) -> tuple:
+    """
+    What think() uses of a user (name, self context, learned preferences), read once in the
+    main process and handed to the workers as plain data, so they never open the store.
+    """
+    if username:
+        from application.container import get_container
+        user = get_container().repository.get_user(username)
+        if user is not None:
+            return user.username, user.self_context, user.memory.relationship_preferences
+    return "batch", "", {}
+
+def _init_worker(persona: tuple, rpm: float, tpm: float):
+    """
+    Runs once per worker process (or once in the main process for the thread pool).
+    `rpm` / `tpm` are this process's share of the limits, for its provider's rate limiter.
+    """
+    global _agent, _user
+    if rpm > 0:
+        # Read when the provider builds its limiter (on the first model call)
+        os.environ["DIPLOMAT_LLM_RPM"] = str(rpm)
+        os.environ["DIPLOMAT_LLM_TPM"] = str(tpm)
+    from domain.agent import DiplomatAgent
+    from domain.rules import RuleEngine
+    from domain.models import AppUser
+    _agent = DiplomatAgent(brain=RuleEngine())
+    username, self_context, preferences = persona
+    _user = AppUser(username=username, email="", password_hash="", self_context=self_context)
+    _user.memory.relationship_preferences = preferences
+
+def refine_row(line_no: int, row: dict) -> dict:
+    result = {"line": line_no, "id": row.get("id")}
+    text = row.get("text") or row.get("draft")
+    if row.get("_error") or not text:
+        result["error"] = row.get("_error") or "Row has no 'text' or 'draft'"
+        return result
+    try:
+        msg = _agent.sense(text, row.get("recipient", ""), row.get("relationship", ""), row.get("tone", ""), row.get("channel", ""))
+        refined = _agent.think(msg, _user)
+    except Exception as e: # LLMError after retries, or anything else: recorded, the batch goes on
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    result.update(
+        suggestion=refined.suggested_content,
+        reasoning=refined.reasoning,
+        changes=refined.changes_made,
+        tone=msg.intended_tone.value,
+        channel=msg.channel.value
+    )
+    return result
+
+# --- Checkpoint ---
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"line": 0, "input_offset": 0, "output_offset": 0}
+
+def save_checkpoint(path: str, checkpoint: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def recover_output(path: str, offset: int) -> set:
+    """
+    Rows finished after the checkpoint (out of order) are already in the output past `offset`:
+    returns their line numbers, and cuts off a half-written last line.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        good_end = offset
+        while True:
+            raw = f.readline()
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(raw)["line"])
+            except (ValueError, KeyError):
+                break
+            good_end = f.tell()
+        f.truncate(good_end)
+    return done
+
+# --- Main ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Refine a JSONL/CSV file of drafts in parallel")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="default: from the input file extension")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--processes", action="store_true", help="process pool instead of threads")
+    parser.add_argument("--rpm", type=float, default=float(os.getenv("DIPLOMAT_LLM_RPM", "10")),
+                        help="requests per minute over all workers (0 = the provider's default limit)")
+    parser.add_argument("--tpm", type=float, default=float(os.getenv("DIPLOMAT_LLM_TPM", "250000")))
+    parser.add_argument("--user", help="refine as this user (persona and learned preferences)")
+    parser.add_argument("--resume", action="store_true", help="continue from <output>.checkpoint")
+    parser.add_argument("--checkpoint-every", type=int, default=50)
+    parser.add_argument("--fake", action="store_true", help="use the offline stand-in LLM provider")
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ["DIPLOMAT_LLM_PROVIDER"] = "fake"
+    fmt = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    checkpoint_path = args.output + ".checkpoint"
+
+    if args.resume:
+        checkpoint = load_checkpoint(checkpoint_path)
+        already_done = set(checkpoint.get("finished_ahead", [])) | recover_output(args.output, checkpoint["output_offset"])
+    else:
+        if os.path.exists(args.output) and os.path.getsize(args.output):
+            sys.exit(f"{args.output} already exists; use --resume to continue it or remove it first")
+        checkpoint = {"line": 0, "input_offset": 0, "output_offset": 0}
+        already_done = set()
+
+    persona = load_persona(args.user)
+    if args.processes:
+        # Every process has its own provider limiter: split the limits so together they stay within them
+        pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                   initargs=(persona, args.rpm / args.workers, args.tpm / args.workers))
+    else:
+        # One process, one shared provider limiter for all the threads
+        _init_worker(persona, args.rpm, args.tpm)
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+    max_in_flight = args.workers * 2 # bounded: reading runs only a little ahead of the workers
+
+    in_flight = {} # future -> line number
+    offsets = {} # line number -> input offset, for rows not finished yet
+    finished_ahead = set() # finished rows past the first unfinished one
+    stats = {"done": 0, "errors": 0, "skipped": len(already_done)}
+    started = time.monotonic()
+    next_line, next_offset = checkpoint["line"], checkpoint["input_offset"]
+
+    def watermark():
+        # First row not finished yet: everything before it is in the output
+        if offsets:
+            first = min(offsets)
+            return first, offsets[first]
+        return next_line, next_offset
+
+    def write_checkpoint(out):
+        line, offset = watermark()
+        finished_ahead.intersection_update(range(line, next_line))
+        save_checkpoint(checkpoint_path, {
+            "line": line,
+            "input_offset": offset or 0,
+            "output_offset": out.tell(),
+            "finished_ahead": sorted(finished_ahead)
+        })
+
+    with open(args.output, "ab") as out:
+        def collect(done_futures):
+            for future in done_futures:
+                line_no = in_flight.pop(future)
+                result = future.result()
+                out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+                out.flush()
+                del offsets[line_no]
+                finished_ahead.add(line_no)
+                stats["done"] += 1
+                stats["errors"] += "error" in result
+                if stats["done"] % args.checkpoint_every == 0:
+                    write_checkpoint(out)
+                    elapsed = time.monotonic() - started
+                    print(f"{stats['done']} done ({stats['errors']} errors), {stats['done'] / elapsed:.1f}/s", file=sys.stderr)
+
+        try:
+            for line_no, offset, end_offset, row in read_rows(args.input, fmt, checkpoint["line"], checkpoint["input_offset"]):
+                next_line, next_offset = line_no + 1, end_offset
+                if line_no in already_done:
+                    continue
+                while len(in_flight) >= max_in_flight:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                offsets[line_no] = offset or 0
+                in_flight[pool.submit(refine_row, line_no, row)] = line_no
+            while in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+        finally:
+            pool.shutdown(wait=not in_flight, cancel_futures=True)
+            write_checkpoint(out)
+
+    elapsed = time.monotonic() - started
+    print(f"Finished: {stats['done']} refined ({stats['errors']} errors), {stats['skipped']} skipped from a previous run, "
+          f"{elapsed:.1f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+History search benchmark: fills a throwaway store with synthetic interactions, then times
+the first search (index build for the file stores) and a mix of ranked, phrase and filtered queries.
+
+    python benchmark_search.py                              # 100k interactions, JSON store
+    python benchmark_search.py --storage sqlite --max-ms 20 # exit 1 if the median query is slower
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from domain.models import AppUser, Message, RefinedMessage, Interaction, Tone
+from domain.search import SearchQuery
+from infrastructure.repository import create_repository
+
+WORDS = ("meeting budget report deadline sorry thanks lunch tomorrow project review invoice client "
+         "proposal weekend party birthday gift contract schedule call update").split()
+RELATIONSHIPS = ["Boss", "Colleague", "Friend", "Family", "Client"]
+RECIPIENTS = ["Ana", "Ben", "Chloe", "Dan", "Eve"]
+
+def make_interactions(count: int, seed: int):
+    rng = random.Random(seed)
+    vocabulary = WORDS + [f"word{i}" for i in range(5000)]
+    start = datetime.now() - timedelta(minutes=count)
+    for i in range(count):
+        text = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(10, 40)))
+        if i % 100 == 0:
+            text += " see you next week"
+        ts = start + timedelta(minutes=i)
+        msg = Message(text, rng.choice(RECIPIENTS), rng.choice(RELATIONSHIPS), rng.choice(list(Tone)), timestamp=ts)
+        refined = RefinedMessage(msg, "Hi, " + text, "", [])
+        yield Interaction(msg, refined, rng.random() < 0.7, "Hi, " + text[:60], timestamp=ts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time history search")
+    parser.add_argument("--storage", choices=["json", "sqlite", "sharded"], default="json")
+    parser.add_argument("--interactions", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=20, help="repetitions of the query mix")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ms", type=float, help="fail if the median query is slower")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="diplomat_search_bench_")
+    name = {"json": "users.json", "sqlite": "users.db", "sharded": "users"}[args.storage]
+    repo = create_repository(args.storage, os.path.join(root, name))
+    user = AppUser(username="bench", email="", password_hash="")
+    repo.save_user(user)
+
+    t0 = time.perf_counter()
+    batch = []
+    for interaction in make_interactions(args.interactions, args.seed):
+        batch.append((interaction, interaction.message.recipient_relationship))
+        if len(batch) == 1000:
+            repo.append_interactions(user, batch)
+            batch = []
+    if batch:
+        repo.append_interactions(user, batch)
+    print(f"filled {args.interactions} interactions ({args.storage}) in {time.perf_counter() - t0:.1f} s")
+
+    midpoint = datetime.now() - timedelta(minutes=args.interactions // 2)
+    queries = [
+        SearchQuery("budget"),
+        SearchQuery("budget deadline"),
+        SearchQuery('"see you next week"'),
+        SearchQuery("word42"),
+        SearchQuery("invoice client", relationship="Client", accepted=True),
+        SearchQuery("report", tone=Tone.FORMAL.value, since=midpoint),
+        SearchQuery("", accepted=False, recipient="Ana"),
+    ]
+
+    t0 = time.perf_counter()
+    repo.search_history(user.username, queries[0])
+    print(f"first search (builds the index if needed): {(time.perf_counter() - t0) * 1000:8.1f} ms")
+
+    timings = {i: [] for i in range(len(queries))}
+    for _ in range(args.runs):
+        for i, query in enumerate(queries):
+            t0 = time.perf_counter()
+            repo.search_history(user.username, query, limit=20)
+            timings[i].append((time.perf_counter() - t0) * 1000)
+
+    for i, query in enumerate(queries):
+        filters = ", ".join(f"{k}={v:%Y-%m-%d}" if isinstance(v, datetime) else f"{k}={v}"
+                            for k, v in vars(query).items() if k != "text" and v is not None)
+        print(f"{statistics.median(timings[i]):8.2f} ms  {query.text or '(no text)':24} {filters}")
+    median_ms = statistics.median(t for ts in timings.values() for t in ts)
+    print(f"median query: {median_ms:.2f} ms")
+
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"FAIL: median query {median_ms:.2f} ms > {args.max_ms:.2f} ms")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Cold-start benchmark: how long a fresh interpreter takes to import the app's modules
+and build the service, and whether anything heavy (the Gemini SDK) sneaks in early.
+
+    python benchmark_startup.py                  # report
+    python benchmark_startup.py --max-ms 300     # exit 1 if building the service is slower
+    python benchmark_startup.py --importtime     # plus the 15 slowest imports (python -X importtime)
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Runs in a fresh interpreter each time, so nothing is already imported or cached
+PROBE = r"""
+import sys, time, json
+t0 = time.perf_counter()
+import application.container
+t1 = time.perf_counter()
+service = application.container.get_container().service
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "service_ms": (t2 - t0) * 1000,
+    "modules": len(sys.modules),
+    "sdk_loaded": "google.generativeai" in sys.modules,
+}))
+"""
+
+# Should stay out of startup: they belong to the first LLM call
+HEAVY_MODULES = ("google.generativeai",)
+
+def run_probe(env: dict) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env: dict, top: int = 15):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import application.container; application.container.get_container().service"],
+                         env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [p.strip() for p in line.split(":", 1)[1].split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Diplomat cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median service build exceeds this")
+    parser.add_argument("--importtime", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Throwaway store: the benchmark must not touch (or be slowed by) real user data
+    env.setdefault("DIPLOMAT_STORAGE_PATH", os.path.join(os.path.abspath(os.getenv("TMPDIR", "/tmp")), "diplomat_startup_bench.json"))
+    env.setdefault("DIPLOMAT_LLM_CACHE_PATH", "")
+
+    results = [run_probe(env) for _ in range(args.runs)]
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    service_ms = statistics.median(r["service_ms"] for r in results)
+    print(f"import application.container: {import_ms:7.1f} ms (median of {args.runs})")
+    print(f"get_container().service:      {service_ms:7.1f} ms")
+    print(f"modules loaded:               {results[0]['modules']}")
+
+    failed = False
+    if any(r["sdk_loaded"] for r in results):
+        print(f"FAIL: {', '.join(HEAVY_MODULES)} imported at startup")
+        failed = True
+    if args.max_ms is not None and service_ms > args.max_ms:
+        print(f"FAIL: startup {service_ms:.1f} ms > {args.max_ms:.1f} ms")
+        failed = True
+
+    if args.importtime:
+        print("\nSlowest imports (cumulative / self, ms):")
+        for cumulative_us, self_us, name in slowest_imports(env):
+            print(f"{cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Script execution time per UI interaction, measured with Streamlit's AppTest
+(no browser; the fake LLM provider and a throwaway store, so only our own code is timed).
+
+    python benchmark_ui.py            # median of 5 runs per interaction
+    python benchmark_ui.py --runs 20
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+# Must be set before the app (and with it the container) is first imported
+_tmp = tempfile.mkdtemp(prefix="diplomat_ui_bench_")
+os.environ.setdefault("DIPLOMAT_LLM_PROVIDER", "fake")
+os.environ.setdefault("DIPLOMAT_FAKE_LATENCY", "0")
+os.environ.setdefault("DIPLOMAT_FAKE_CHUNK_DELAY", "0")
+os.environ.setdefault("DIPLOMAT_LLM_CACHE_PATH", "")
+os.environ["DIPLOMAT_STORAGE_PATH"] = os.path.join(_tmp, "users.json")
+
+from streamlit.testing.v1 import AppTest
+from application.container import get_container
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+USERNAME = "bench"
+CONTACTS = 30
+HISTORY = 500
+
+def seed_user():
+    service = get_container().service
+    service.register(USERNAME, "bench@example.com", "bench")
+    user = service.login(USERNAME, "bench")
+    for i in range(CONTACTS):
+        service.add_contact(user, f"Contact {i:02d}", "Colleague", "")
+    for i in range(HISTORY):
+        refined = service.get_advice(user, f"draft {i}", f"Contact {i % CONTACTS:02d}", "Colleague", "Formal", "Email")
+        service.record_outcome(user, refined, i % 3 != 0, refined.suggested_content)
+    service.repository.flush()
+    return user
+
+def button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+def logged_in_app(user) -> AppTest:
+    at = AppTest.from_file(APP, default_timeout=30)
+    at.session_state["current_user"] = user
+    return at.run()
+
+# Each interaction: (setup returning a ready AppTest, action performing the timed rerun)
+def interactions(user):
+    def draft(at):
+        next(t for t in at.text_area if t.label.startswith("Draft")).input("Hey, can you send me the report today?")
+        return at
+
+    def with_suggestion():
+        at = draft(logged_in_app(user))
+        return button(at, "✨ Analyze & Refine").click().run()
+
+    return {
+        "first load (guest)": (lambda: AppTest.from_file(APP, default_timeout=30), lambda at: at.run()),
+        "first load (logged in)": (lambda: logged_in_app(user), lambda at: at.run()),
+        "theme toggle (guest)": (lambda: AppTest.from_file(APP, default_timeout=30).run(),
+                                 lambda at: at.toggle(key="guest_theme_toggle").set_value(False).run()),
+        "select contact": (lambda: logged_in_app(user), lambda at: button(at, "Contact 07").click().run()),
+        "edit draft": (lambda: logged_in_app(user), lambda at: draft(at).run()),
+        "analyze": (lambda: draft(logged_in_app(user)), lambda at: button(at, "✨ Analyze & Refine").click().run()),
+        "accept suggestion": (with_suggestion, lambda at: button(at, "✅ Accept").click().run()),
+        "open history": (lambda: logged_in_app(user), lambda at: button(at, "📜 History").click().run()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-interaction script time of app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    user = seed_user()
+    print(f"{CONTACTS} contacts, {HISTORY} history entries, {args.runs} runs each\n")
+    print(f"{'interaction':<26}{'median ms':>10}{'max ms':>10}")
+    for name, (setup, action) in interactions(user).items():
+        samples = []
+        for _ in range(args.runs):
+            at = setup()
+            started = time.perf_counter()
+            at = action(at)
+            samples.append((time.perf_counter() - started) * 1000)
+            if at.exception:
+                print(f"{name}: {at.exception[0].message}", file=sys.stderr)
+                break
+        print(f"{name:<26}{statistics.median(samples):>10.1f}{max(samples):>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 from domain.models import Message, RefinedMessage, Interaction, AppUser, Tone, CommunicationChannel
 from domain.rules import RuleEngine
-from infrastructure.repository import Repository
+from infrastructure.repository import get_repository
+import asyncio
 import datetime
 
 class DiplomatAgent:
-    def __init__(self):
-        self.repository = Repository()
-        self.brain = RuleEngine()
+    def __init__(self, repository=None, brain: RuleEngine = None):
+        self._repository = repository
+        self.brain = brain or RuleEngine()
+
+    @property
+    def repository(self):
+        # Only needed by learn(): tools that just refine (batch_refine.py) never open the store
+        if self._repository is None:
+            self._repository = get_repository()
+        return self._repository
 
     # --- 1. SENSE ---
     def sense(self, content: str, recipient: str, relation: str, tone_str: str, channel_str: str) -> Message:
@@ -32,7 +40,7 @@ class DiplomatAgent:
         )
 
     # --- 2. THINK ---
-    def think(self, message: Message, user: AppUser) -> RefinedMessage:
+    def think(self, message: Message, user: AppUser, use_cache: bool = True) -> RefinedMessage:
         """
         Process with User Context.
         """
@@ -49,7 +57,52 @@ class DiplomatAgent:
             message.intended_tone,
             message.channel.value,
             recipient_history_stats,
-            personal_context
+            personal_context,
+            use_cache=use_cache
+        )
+        
+        return RefinedMessage(
+            original_message=message,
+            suggested_content=new_content,
+            reasoning=explanation,
+            changes_made=changes
+        )
+
+    def think_stream(self, message: Message, user: AppUser, use_cache: bool = True):
+        """
+        Streaming THINK: yields suggestion text chunks, returns the RefinedMessage when done.
+        """
+        recipient_history_stats = user.memory.relationship_preferences.get(message.recipient_relationship, {})
+        
+        new_content, explanation, changes = yield from self.brain.refine_message_stream(
+            message.content,
+            message.intended_tone,
+            message.channel.value,
+            recipient_history_stats,
+            user.self_context,
+            use_cache=use_cache
+        )
+        
+        return RefinedMessage(
+            original_message=message,
+            suggested_content=new_content,
+            reasoning=explanation,
+            changes_made=changes
+        )
+
+    async def think_async(self, message: Message, user: AppUser, use_cache: bool = True) -> RefinedMessage:
+        """
+        Async THINK: awaits the LLM instead of holding a thread.
+        """
+        recipient_history_stats = user.memory.relationship_preferences.get(message.recipient_relationship, {})
+        
+        new_content, explanation, changes = await self.brain.refine_message_async(
+            message.content,
+            message.intended_tone,
+            message.channel.value,
+            recipient_history_stats,
+            user.self_context,
+            use_cache=use_cache
         )
         
         return RefinedMessage(
@@ -73,6 +126,20 @@ class DiplomatAgent:
         """
         Update User's specific memory.
         """
+        interaction, rel = self._remember(refined, user_accepted, final_content, user)
+        
+        # Persist just this interaction (queued; the repository batches the actual writes)
+        self.repository.append_interaction(user, interaction, rel)
+
+    async def learn_async(self, refined: RefinedMessage, user_accepted: bool, final_content: str, user: AppUser):
+        """
+        Memory is updated right away; the storage write runs in a worker thread,
+        so the event loop keeps serving other suggestions meanwhile.
+        """
+        interaction, rel = self._remember(refined, user_accepted, final_content, user)
+        await asyncio.to_thread(self.repository.append_interaction, user, interaction, rel)
+
+    def _remember(self, refined: RefinedMessage, user_accepted: bool, final_content: str, user: AppUser):
         interaction = Interaction(
             message=refined.original_message,
             refined_message=refined,
@@ -97,6 +164,5 @@ class DiplomatAgent:
             user.memory.relationship_preferences[rel][tone_key] = current_score + 1
         else:
             user.memory.relationship_preferences[rel][tone_key] = current_score - 1
-            
-        # Persist User
-        self.repository.save_user(user)
+        
+        return interaction, rel
@@ -1,7 +1,9 @@
-from dataclasses import dataclass, field
-from typing import List, Optional, Dict
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Dict, Callable
 from datetime import datetime
 from enum import Enum
+from domain.search import SearchQuery, HistoryIndex
 
 class Tone(Enum):
     FORMAL = "Formal"
@@ -65,6 +67,136 @@ class Contact:
     relationship: str # e.g. "Boss"
     description: str = "" # Optional specific context
 
+@dataclass(frozen=True)
+class HistoryCursor:
+    """
+    Where the next (older) page starts: the last item's timestamp, and how many items
+    at exactly that timestamp were already returned. Interactions can share a timestamp,
+    so the time alone would skip the rest of a tie at a page boundary.
+    """
+    timestamp: datetime
+    skip: int = 0
+
+# loader(before, limit, recipient, skip) -> newest-first interactions older than `before`;
+# with skip set, also those at exactly `before`, minus the first `skip` of them
+HistoryLoader = Callable[[datetime, int, Optional[str], Optional[int]], List[Interaction]]
+
+@dataclass
+class HistoryPage:
+    items: List[Interaction]
+    next_cursor: Optional[HistoryCursor] = None # pass as `before` to get the next (older) page
+
+@dataclass
+class SearchHit:
+    interaction: Interaction
+    score: float # higher is better; 0 when the query has no text (newest first then)
+
+# searcher(query, limit) -> best stored matches
+HistorySearcher = Callable[[SearchQuery, int], List[SearchHit]]
+
+class HistoryView:
+    """
+    Lazily loaded, newest-first view over a user's interactions.
+    Stored interactions are only fetched (page by page) when someone asks;
+    interactions added during this session are kept locally in front of them,
+    indexed by time and by recipient so a page costs O(log n + limit), and in a
+    small full-text index of their own for search().
+    """
+    def __init__(self, loader: Optional[HistoryLoader] = None, recipients_loader: Optional[Callable[[], List[str]]] = None,
+                 searcher: Optional[HistorySearcher] = None):
+        self._loader = loader
+        self._recipients_loader = recipients_loader
+        self._searcher = searcher
+        # Everything in storage is older than this; newer items live in self._added
+        self._loaded_at = datetime.now()
+        # Oldest first, with the timestamps alongside for bisect
+        self._added: List[Interaction] = []
+        self._added_times: List[datetime] = []
+        # recipient -> (interactions, timestamps), same order
+        self._by_recipient: Dict[str, tuple] = {}
+        self._index = HistoryIndex()
+
+    @staticmethod
+    def _insert(items: List[Interaction], times: List[datetime], interaction: Interaction):
+        # Appends are almost always the newest, so this is normally a plain append
+        pos = bisect_right(times, interaction.timestamp)
+        items.insert(pos, interaction)
+        times.insert(pos, interaction.timestamp)
+
+    def append(self, interaction: Interaction):
+        self._insert(self._added, self._added_times, interaction)
+        items, times = self._by_recipient.setdefault(interaction.message.recipient_name, ([], []))
+        self._insert(items, times, interaction)
+        msg = interaction.message
+        self._index.add(interaction, msg.content, interaction.refined_message.suggested_content, interaction.final_content,
+                        interaction.timestamp.isoformat(), msg.intended_tone.value, msg.recipient_relationship,
+                        msg.recipient_name, interaction.accepted)
+
+    def page(self, limit: int = 20, before: Optional[HistoryCursor] = None, recipient: Optional[str] = None) -> HistoryPage:
+        if recipient is None:
+            added, times = self._added, self._added_times
+        else:
+            added, times = self._by_recipient.get(recipient, ([], []))
+        stored_skip = None # storage: strictly older than the bound
+        if before is None:
+            end = len(times)
+        else:
+            # Newest first, session items come before stored ones, ties included
+            start, tie_end = bisect_left(times, before.timestamp), bisect_right(times, before.timestamp)
+            end = max(start, tie_end - before.skip)
+            stored_skip = max(0, before.skip - (tie_end - start))
+        items = added[max(0, end - limit):end][::-1]
+
+        if len(items) < limit and self._loader:
+            if before is None or before.timestamp >= self._loaded_at:
+                items += self._loader(self._loaded_at, limit - len(items), recipient, None)
+            else:
+                items += self._loader(before.timestamp, limit - len(items), recipient, stored_skip)
+
+        next_cursor = None
+        if items and len(items) == limit:
+            last = items[-1].timestamp
+            tie = sum(1 for i in items if i.timestamp == last)
+            if before is not None and before.timestamp == last:
+                tie += before.skip # the tie started on an earlier page
+            next_cursor = HistoryCursor(last, tie)
+        return HistoryPage(items=items, next_cursor=next_cursor)
+
+    def search(self, query: SearchQuery, limit: int = 20) -> List[SearchHit]:
+        """
+        Ranked full-text search (see domain/search.py for the query syntax).
+        Matches among this session's interactions come first, newest first, then the stored
+        matches in their ranking. The two sets of scores come from different corpora
+        (and, for SQLite, a different BM25), so they are never compared with each other.
+        """
+        hits = [SearchHit(interaction=i, score=score) for i, score in self._index.search(query, len(self._index))]
+        hits.sort(key=lambda h: h.interaction.timestamp, reverse=True)
+        if self._searcher and len(hits) < limit:
+            # Same split as page(): storage only answers for what it held when this view was made
+            until = self._loaded_at if query.until is None else min(query.until, self._loaded_at)
+            hits += self._searcher(replace(query, until=until), limit - len(hits))
+        return hits[:limit]
+
+    def recipients(self) -> List[str]:
+        names = set(self._by_recipient)
+        if self._recipients_loader:
+            names.update(self._recipients_loader())
+        return sorted(names)
+
+    def __iter__(self):
+        # Full walk, newest first. Only for tools that really need everything.
+        cursor = None
+        while True:
+            page = self.page(limit=200, before=cursor)
+            yield from page.items
+            if page.next_cursor is None:
+                return
+            cursor = page.next_cursor
+
+    def is_empty(self) -> bool:
+        # Explicit, since it may have to ask storage
+        return not self.page(limit=1).items
+
 @dataclass
 class AgentMemory:
     """
@@ -72,7 +204,9 @@ class AgentMemory:
     Tracks preferences per relationship type.
     """
     relationship_preferences: Dict[str, Dict[str, float]] = field(default_factory=dict)
-    history: List[Interaction] = field(default_factory=list)
+    history: HistoryView = field(default_factory=HistoryView)
+    # Accepted/rejected counts of interactions that expired out of history: [relationship][tone] -> counts
+    history_stats: Dict[str, Dict[str, Dict[str, int]]] = field(default_factory=dict)
 
     def add_history(self, interaction: Interaction):
         self.history.append(interaction)
@@ -85,3 +219,42 @@ class AppUser:
     self_context: str = "" # e.g. "Software Engineer at Google"
     contacts: List[Contact] = field(default_factory=list)
     memory: AgentMemory = field(default_factory=AgentMemory)
+    # name -> Contact; kept in step by the contact methods below (mutate contacts through them)
+    _contacts_by_name: Dict[str, Contact] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        for c in self.contacts:
+            self._contacts_by_name.setdefault(c.name, c)
+
+    # --- Contacts ---
+
+    def get_contact(self, name: str) -> Optional[Contact]:
+        return self._contacts_by_name.get(name)
+
+    def add_contact(self, contact: Contact) -> bool:
+        if contact.name in self._contacts_by_name:
+            return False # Names are unique (they key the UI buttons and the API paths)
+        self.contacts.append(contact)
+        self._contacts_by_name[contact.name] = contact
+        return True
+
+    def remove_contact(self, name: str) -> bool:
+        if self._contacts_by_name.pop(name, None) is None:
+            return False
+        self.contacts = [c for c in self.contacts if c.name != name]
+        return True
+
+    def update_contact(self, old_name: str, name: str, relationship: str, description: str) -> Optional[Contact]:
+        """
+        Returns the updated contact, or None if `old_name` doesn't exist or `name` is taken by another contact.
+        """
+        contact = self._contacts_by_name.get(old_name)
+        if contact is None or (name != old_name and name in self._contacts_by_name):
+            return None
+        if name != old_name:
+            del self._contacts_by_name[old_name]
+            self._contacts_by_name[name] = contact
+        contact.name = name
+        contact.relationship = relationship
+        contact.description = description
+        return contact
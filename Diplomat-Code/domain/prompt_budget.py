@@ -0,0 +1,90 @@
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import List, Dict, Tuple
+from infrastructure.rate_limiter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# app.py sends the situation context spliced into the draft
+_CONTEXT_RE = re.compile(r"^\[Context: (.*)\] \nMessage: (.*)$", re.DOTALL)
+
+TRUNCATION_MARK = " [...]"
+
+@dataclass
+class PromptSection:
+    name: str
+    text: str
+    priority: int # lower priority is trimmed first
+    min_tokens: int = 0 # never trimmed below this
+
+class PromptBudget:
+    """
+    Keeps the variable parts of the prompt (draft, situation context, persona) under
+    `max_tokens`. Over budget, the lowest-priority sections are cut down first:
+    persona, then situation context, then the draft itself (never below `min_draft_tokens`).
+    """
+    def __init__(self, max_tokens: int = None, min_draft_tokens: int = 256):
+        if max_tokens is None:
+            max_tokens = int(os.getenv("DIPLOMAT_PROMPT_TOKEN_BUDGET", "3000"))
+        self.max_tokens = max_tokens
+        self.min_draft_tokens = min_draft_tokens
+
+    def fit(self, sections: List[PromptSection]) -> Dict[str, str]:
+        """
+        Returns {section name: text that fits}. Logs the token count of every section.
+        """
+        used = {s.name: estimate_tokens(s.text) if s.text else 0 for s in sections}
+        texts = {s.name: s.text for s in sections}
+        before = dict(used)
+
+        excess = sum(used.values()) - self.max_tokens
+        for section in sorted(sections, key=lambda s: s.priority):
+            if excess <= 0:
+                break
+            keep = max(section.min_tokens, used[section.name] - excess)
+            if keep >= used[section.name]:
+                continue
+            texts[section.name] = self._truncate(section.text, keep)
+            excess -= used[section.name] - keep
+            used[section.name] = keep
+
+        logger.info(
+            "Prompt tokens: %s, total %d/%d%s",
+            ", ".join(f"{name}={before[name]}" + (f"->{used[name]}" if used[name] != before[name] else "") for name in used),
+            sum(used.values()), self.max_tokens,
+            " (trimmed)" if used != before else ""
+        )
+        return texts
+
+    @staticmethod
+    def _truncate(text: str, tokens: int) -> str:
+        if tokens <= 0:
+            return ""
+        # Keep the beginning: the newest reply of a pasted thread and the start of a persona matter most
+        cut = text[:tokens * 4]
+        if " " in cut[len(cut) // 2:]:
+            cut = cut.rsplit(" ", 1)[0] # don't end mid-word
+        return cut + TRUNCATION_MARK
+
+    # --- Draft ---
+
+    def fit_request(self, content: str, personal_context: str) -> Tuple[str, str]:
+        """
+        Splits app.py's "[Context: ...] \\nMessage: ..." draft into its sections, fits them and
+        puts the draft back together. Returns (content, personal_context).
+        """
+        match = _CONTEXT_RE.match(content)
+        situation, draft = (match.group(1), match.group(2)) if match else ("", content)
+
+        fitted = self.fit([
+            PromptSection("draft", draft, priority=3, min_tokens=self.min_draft_tokens),
+            PromptSection("situation", situation, priority=2),
+            PromptSection("persona", personal_context or "", priority=1),
+        ])
+        if match and fitted["situation"]:
+            content = f"[Context: {fitted['situation']}] \nMessage: {fitted['draft']}"
+        else:
+            content = fitted["draft"]
+        return content, fitted["persona"]
@@ -1,18 +1,99 @@
+import os
+import threading
 from domain.models import Tone
-from infrastructure.llm_provider import GeminiProvider
+from domain.prompt_budget import PromptBudget
+from infrastructure.providers import LLMProvider, create_provider
 
 class RuleEngine:
     """
     The 'Think' component - upgraded to use LLM.
     """
-    def __init__(self):
-        self.llm = GeminiProvider()
+    def __init__(self, combined: bool = None, provider: LLMProvider = None, budget: PromptBudget = None):
+        # DIPLOMAT_LLM_PROVIDER picks the backend (e.g. "fake" for offline benchmarks);
+        # created on the first refine call, so startup doesn't pay for the SDK import
+        self._llm = provider
+        self._llm_lock = threading.Lock()
+        # Combined mode: one structured call for rewrite + explanation instead of two
+        if combined is None:
+            combined = os.getenv("DIPLOMAT_COMBINED_REFINE", "1") != "0"
+        self.combined = combined
+        # Caps draft + situation context + persona (DIPLOMAT_PROMPT_TOKEN_BUDGET)
+        self.budget = budget or PromptBudget()
 
-    def refine_message(self, content: str, target_tone: Tone, channel: str, recipient_history: dict, personal_context: str = "") -> (str, str, list):
+    @property
+    def llm(self) -> LLMProvider:
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = create_provider()
+        return self._llm
+
+    def refine_message(self, content: str, target_tone: Tone, channel: str, recipient_history: dict, personal_context: str = "", use_cache: bool = True) -> (str, str, list):
         """
         Uses Gemini to refine the message.
         """
-        # 1. Construct Learning Context
+        # 1. Construct Learning Context (trimmed to the token budget)
+        content, personal_context = self.budget.fit_request(content, personal_context)
+        context_notes = self._context_notes(target_tone, recipient_history, personal_context)
+        
+        # 2. + 3. in a single round trip, when the model gives us valid JSON
+        if self.combined:
+            result = self.llm.refine_and_explain(content, target_tone.value, channel, context_notes, use_cache=use_cache)
+            if result is not None:
+                refined_content, explanation, changes = result
+                return refined_content, explanation, changes or ["Used Generative AI for total rewrite"]
+        
+        # 2. Call LLM for Refinement (Think)
+        refined_content = self.llm.refine_message(content, target_tone.value, channel, context_notes, use_cache=use_cache)
+        
+        # 3. Call LLM for Explanation
+        explanation = self.llm.explain_changes(content, refined_content, target_tone.value, use_cache=use_cache)
+        
+        # 4. Changes List (heuristic diff for UI)
+        changes = ["Used Generative AI for total rewrite"]
+        
+        return refined_content, explanation, changes
+
+    def refine_message_stream(self, content: str, target_tone: Tone, channel: str, recipient_history: dict, personal_context: str = "", use_cache: bool = True):
+        """
+        Streaming variant: yields the rewrite as it arrives, then asks for the explanation.
+        The generator's return value is the same (refined, explanation, changes) tuple as refine_message.
+        """
+        content, personal_context = self.budget.fit_request(content, personal_context)
+        context_notes = self._context_notes(target_tone, recipient_history, personal_context)
+        
+        parts = []
+        for chunk in self.llm.refine_message_stream(content, target_tone.value, channel, context_notes, use_cache=use_cache):
+            parts.append(chunk)
+            yield chunk
+        refined_content = "".join(parts)
+        
+        # Explanation only makes sense once the whole rewrite is there
+        explanation = self.llm.explain_changes(content, refined_content, target_tone.value, use_cache=use_cache)
+        changes = ["Used Generative AI for total rewrite"]
+        
+        return refined_content, explanation, changes
+
+    async def refine_message_async(self, content: str, target_tone: Tone, channel: str, recipient_history: dict, personal_context: str = "", use_cache: bool = True) -> (str, str, list):
+        """
+        Async refine_message: same flow, awaiting the provider instead of blocking a thread.
+        """
+        content, personal_context = self.budget.fit_request(content, personal_context)
+        context_notes = self._context_notes(target_tone, recipient_history, personal_context)
+        
+        if self.combined:
+            result = await self.llm.refine_and_explain_async(content, target_tone.value, channel, context_notes, use_cache=use_cache)
+            if result is not None:
+                refined_content, explanation, changes = result
+                return refined_content, explanation, changes or ["Used Generative AI for total rewrite"]
+        
+        refined_content = await self.llm.refine_message_async(content, target_tone.value, channel, context_notes, use_cache=use_cache)
+        explanation = await self.llm.explain_changes_async(content, refined_content, target_tone.value, use_cache=use_cache)
+        changes = ["Used Generative AI for total rewrite"]
+        
+        return refined_content, explanation, changes
+
+    def _context_notes(self, target_tone: Tone, recipient_history: dict, personal_context: str) -> str:
         # Check history scores to advise the LLM
         context_notes = ""
         
@@ -26,13 +107,4 @@ class RuleEngine:
         elif tone_score > 3:
             context_notes += f"NOTE: The user LOVES this '{target_tone.value}' tone. You can be very expressive and fully embrace this style.\n"
         
-        # 2. Call LLM for Refinement (Think)
-        refined_content = self.llm.refine_message(content, target_tone.value, channel, context_notes)
-        
-        # 3. Call LLM for Explanation
-        explanation = self.llm.explain_changes(content, refined_content, target_tone.value)
-        
-        # 4. Changes List (heuristic diff for UI)
-        changes = ["Used Generative AI for total rewrite"]
-        
-        return refined_content, explanation, changes
+        return context_notes
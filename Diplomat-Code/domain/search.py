@@ -0,0 +1,189 @@
+import re
+import math
+import heapq
+import unicodedata
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Dict, Tuple, Any
+
+# Same word rule as SQLite FTS5's unicode61 tokenizer (letters and digits, diacritics removed),
+# so a query finds the same interactions whichever backend answers it
+_WORD = re.compile(r"[^\W_]+")
+_QUERY_PART = re.compile(r'"([^"]*)"?|(\S+)')
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return _WORD.findall(text)
+
+def parse_query(text: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    'budget "next week"' -> terms ["budget"], phrases [["next", "week"]].
+    Every term and phrase must match (AND). A bare word that tokenizes into
+    several words (e.g. "don't") is treated as a phrase.
+    """
+    terms, phrases = [], []
+    for quoted, word in _QUERY_PART.findall(text or ""):
+        tokens = tokenize(quoted if quoted else word)
+        if len(tokens) == 1:
+            terms.append(tokens[0])
+        elif tokens:
+            phrases.append(tokens)
+    return terms, phrases
+
+@dataclass
+class SearchQuery:
+    """
+    Full-text query over drafts, suggestions and final texts, plus optional filters.
+    `since` is inclusive, `until` exclusive.
+    """
+    text: str = ""
+    tone: Optional[str] = None
+    relationship: Optional[str] = None
+    recipient: Optional[str] = None
+    accepted: Optional[bool] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+class HistoryIndex:
+    """
+    Append-only inverted index over interactions, ranked with BM25.
+    Postings are (doc ids, term frequencies) arrays; doc ids grow with add(), so they
+    are sorted and a lookup is a bisect. Documents are expected in time order
+    (as history is stored): without search text, the newest matches come first.
+    Phrases are checked only on the best-scoring candidates, by re-reading their text.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._docs: List[Any] = []
+        self._texts: List[Tuple[str, str, str]] = []
+        self._meta: List[tuple] = [] # (timestamp iso, tone, relationship, recipient, accepted)
+        self._lengths = array("I")
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc: Any, draft: str, suggestion: str, final: str,
+            timestamp: str, tone: str, relationship: str, recipient: str, accepted: bool):
+        doc_id = len(self._docs)
+        counts: Dict[str, int] = {}
+        for text in (draft, suggestion, final):
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = (array("I"), array("I"))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+
+        length = sum(counts.values())
+        self._docs.append(doc)
+        self._texts.append((draft, suggestion, final))
+        self._meta.append((timestamp, tone, relationship, recipient, accepted))
+        self._lengths.append(length)
+        self._total_length += length
+
+    def add_record(self, record: dict):
+        """
+        Indexes a stored history record (see infrastructure/codec.py); the record itself is the doc.
+        """
+        orig = record.get("original_message", {})
+        self.add(record, orig.get("content", ""), record.get("refined_suggestion", ""), record.get("final_content", ""),
+                 record.get("timestamp", ""), orig.get("tone", ""), orig.get("relationship", ""),
+                 orig.get("recipient", ""), bool(record.get("accepted")))
+
+    # --- Search ---
+
+    def search(self, query: SearchQuery, limit: int = 20) -> List[Tuple[Any, float]]:
+        """
+        Best `limit` (doc, score) pairs, highest score first.
+        """
+        terms, phrases = parse_query(query.text)
+        tokens = set(terms).union(*phrases) if phrases else set(terms)
+        filters = self._filters(query)
+
+        if not tokens:
+            hits = []
+            for doc_id in range(len(self._docs) - 1, -1, -1):
+                if len(hits) >= limit:
+                    break
+                if self._passes(doc_id, filters):
+                    hits.append((self._docs[doc_id], 0.0))
+            return hits
+
+        lists = []
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                return [] # AND: one unknown word means no match
+            lists.append((token, postings))
+        # Walk the rarest word's postings and look the others up
+        lists.sort(key=lambda item: len(item[1][0]))
+
+        n = len(self._docs)
+        avg_length = self._total_length / n
+        idf = [math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for _, (docs, _) in lists]
+        (_, (first_docs, first_tfs)), rest = lists[0], lists[1:]
+
+        scored = []
+        for i, doc_id in enumerate(first_docs):
+            if not self._passes(doc_id, filters):
+                continue
+            norm = self.K1 * (1 - self.B + self.B * self._lengths[doc_id] / avg_length)
+            score = idf[0] * first_tfs[i] * (self.K1 + 1) / (first_tfs[i] + norm)
+            for k, (_, (docs, tfs)) in enumerate(rest, start=1):
+                j = bisect_left(docs, doc_id)
+                if j == len(docs) or docs[j] != doc_id:
+                    break
+                score += idf[k] * tfs[j] * (self.K1 + 1) / (tfs[j] + norm)
+            else:
+                scored.append((score, doc_id))
+
+        if not phrases:
+            return [(self._docs[doc_id], score) for score, doc_id in heapq.nlargest(limit, scored)]
+
+        hits = []
+        scored.sort(reverse=True)
+        for score, doc_id in scored:
+            if len(hits) >= limit:
+                break
+            if all(self._has_phrase(doc_id, phrase) for phrase in phrases):
+                hits.append((self._docs[doc_id], score))
+        return hits
+
+    @staticmethod
+    def _filters(query: SearchQuery) -> list:
+        # (meta position, test) pairs for the filters that are set
+        filters = []
+        if query.since is not None:
+            since = query.since.isoformat()
+            filters.append((0, lambda ts: ts >= since))
+        if query.until is not None:
+            until = query.until.isoformat()
+            filters.append((0, lambda ts: ts < until))
+        for position, value in ((1, query.tone), (2, query.relationship), (3, query.recipient), (4, query.accepted)):
+            if value is not None:
+                filters.append((position, lambda v, expected=value: v == expected))
+        return filters
+
+    def _passes(self, doc_id: int, filters: list) -> bool:
+        meta = self._meta[doc_id]
+        return all(test(meta[position]) for position, test in filters)
+
+    def _has_phrase(self, doc_id: int, phrase: List[str]) -> bool:
+        # Phrases don't run across fields (same as FTS5 columns)
+        size = len(phrase)
+        for text in self._texts[doc_id]:
+            tokens = tokenize(text)
+            for start in range(len(tokens) - size + 1):
+                if tokens[start:start + size] == phrase:
+                    return True
+        return False
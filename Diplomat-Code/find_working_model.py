@@ -1,18 +1,11 @@
-import google.generativeai as genai
 import os
-from dotenv import load_dotenv
-import time
+from infrastructure.providers import gemini_models, gemini_router
+from infrastructure.response_cache import ResponseCache
 
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=api_key)
+# Same discovery and configuration as the app's provider factory (GEMINI_API_KEY from .env)
+models = gemini_models()
 
-print(f"Testing models with API Key ending in ...{api_key[-4:]}")
-
-working_model = None
-
-# Get all models that support generation
-models = [m for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+print(f"Testing models with API Key ending in ...{os.getenv('GEMINI_API_KEY')[-4:]}")
 
 print(f"Found {len(models)} candidate models.")
 
@@ -28,27 +21,19 @@ priority_order = [
 ]
 
 # Sort models: priority ones first, then others
-sorted_models = []
-for p in priority_order:
-    for m in models:
-        if m.name == p:
-            sorted_models.append(m)
-
-for m in models:
-    if m not in sorted_models:
-        sorted_models.append(m)
-
-for m in sorted_models:
-    print(f"Testing {m.name}...", end=" ", flush=True)
-    try:
-        model = genai.GenerativeModel(m.name)
-        response = model.generate_content("Test")
-        print("SUCCESS! ✅")
-        working_model = m.name
-        break
-    except Exception as e:
-        print(f"FAILED ❌ ({str(e)[:50]}...)")
-        time.sleep(1) # Be gentle
+sorted_models = [p for p in priority_order if p in models]
+sorted_models += [m for m in models if m not in sorted_models]
+
+# Same probing the app's ModelRouter does at runtime (failures also open that model's circuit breaker)
+router = gemini_router(sorted_models, max_attempts=1, cache=ResponseCache(path=None))
+working_model = router.probe(stop_at_first=True)
+
+for name, stats in router.stats().items():
+    if stats["calls"]:
+        if stats["errors"]:
+            print(f"{name}: FAILED ❌ ({stats['state']})")
+        else:
+            print(f"{name}: SUCCESS! ✅ ({stats['p50_ms']} ms)")
 
 if working_model:
     print(f"\nFOUND WORKING MODEL: {working_model}")
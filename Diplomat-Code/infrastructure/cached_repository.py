@@ -0,0 +1,222 @@
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
+from domain.models import AppUser, Interaction
+
+logger = logging.getLogger(__name__)
+
+class CachedRepository:
+    """
+    Bounded LRU of hydrated AppUser objects in front of a storage backend.
+
+    Reads are served from memory until the backend's version() token changes
+    underneath us (another process wrote the store). Writes are write-behind:
+    save_user() / append_interaction() only mark the user dirty or queue the
+    interaction, and a background thread pushes them to the backend every
+    `flush_interval` seconds (sooner once `batch_size` interactions are queued)
+    and once more at interpreter shutdown. Queued interactions of one user go
+    out in a single backend write. The queue holds at most `max_pending`
+    interactions; when it is full the caller flushes it before queueing more.
+    """
+    def __init__(self, backend, capacity: int = 256, flush_interval: float = 2.0,
+                 batch_size: int = 50, max_pending: int = 1000):
+        self.backend = backend
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._lock = threading.RLock()
+        # Serializes flushes so appends always reach the backend before the full saves queued after them
+        self._flush_lock = threading.Lock()
+        self._users: "OrderedDict[str, AppUser]" = OrderedDict()
+        self._dirty: Dict[str, AppUser] = {}
+        self._pending_appends: List[Tuple[AppUser, Interaction, str]] = []
+        # username -> writes not yet in the backend (queued appends, a pending save).
+        # Users in here are never dropped from the cache; an entry goes once its last write commits.
+        self._unflushed: Dict[str, int] = {}
+        self._known_version = backend.version()
+        self.stats = {"queued": 0, "append_writes": 0, "saves": 0, "caller_flushes": 0}
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._flush_loop, name="repository-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # --- Cache ---
+
+    def _check_version(self):
+        version = self.backend.version()
+        if version != self._known_version:
+            # Someone else wrote the store: drop everything we can re-read (dirty users stay, they are newer)
+            for username in list(self._users):
+                if username not in self._unflushed:
+                    del self._users[username]
+            self._known_version = version
+
+    def _remember(self, user: AppUser):
+        self._users[user.username] = user
+        self._users.move_to_end(user.username)
+        while len(self._users) > self.capacity:
+            evicted = next((name for name in self._users if name not in self._unflushed), None)
+            if evicted is None:
+                break # everything is dirty, the writer will make room
+            del self._users[evicted]
+
+    def _hold(self, username: str, count: int = 1):
+        # Caller holds self._lock
+        self._unflushed[username] = self._unflushed.get(username, 0) + count
+
+    def _release(self, username: str, count: int = 1):
+        with self._lock:
+            left = self._unflushed.get(username, 0) - count
+            if left > 0:
+                self._unflushed[username] = left
+            else:
+                self._unflushed.pop(username, None)
+
+    # --- Repository Interface ---
+
+    def get_user(self, username: str) -> Optional[AppUser]:
+        for _ in range(3):
+            with self._lock:
+                self._check_version()
+                user = self._users.get(username)
+                if user is not None:
+                    self._users.move_to_end(username)
+                    return user
+
+            before = self.backend.version()
+            user = self.backend.get_user(username)
+            with self._lock:
+                # Another thread may have loaded (or saved) it meanwhile; keep a single shared instance
+                cached = self._users.get(username)
+                if cached is not None:
+                    self._users.move_to_end(username)
+                    return cached
+                if self.backend.version() != before:
+                    continue # a flush landed while we read: what we have may already be stale
+                if user is not None:
+                    self._remember(user)
+                return user
+        return user # the store keeps changing: answer, but don't cache a possibly stale copy
+
+    def save_user(self, user: AppUser):
+        with self._lock:
+            if user.username not in self._dirty:
+                self._hold(user.username)
+            self._dirty[user.username] = user
+            self._remember(user)
+
+    def append_interaction(self, user: AppUser, interaction: Interaction, relationship: str):
+        with self._lock:
+            full = len(self._pending_appends) >= self.max_pending
+            if full:
+                self.stats["caller_flushes"] += 1
+        if full:
+            # Backpressure: the store can't keep up (or is failing), so this caller waits for (or sees) the write
+            self.flush()
+
+        with self._lock:
+            self._pending_appends.append((user, interaction, relationship))
+            self._hold(user.username)
+            self._remember(user)
+            self.stats["queued"] += 1
+            if len(self._pending_appends) >= self.batch_size:
+                self._wake.set()
+
+    def update_username(self, old_username: str, new_username: str) -> bool:
+        self.flush()
+        with self._lock:
+            ok = self.backend.update_username(old_username, new_username)
+            if ok:
+                user = self._users.pop(old_username, None)
+                if user is not None:
+                    self._users[new_username] = user
+                if old_username in self._unflushed:
+                    self._unflushed[new_username] = self._unflushed.pop(old_username)
+            self._known_version = self.backend.version()
+            return ok
+
+    def delete_user(self, username: str):
+        self.flush()
+        with self._lock:
+            self.backend.delete_user(username)
+            self._users.pop(username, None)
+            self._known_version = self.backend.version()
+
+    def compact(self):
+        self.flush()
+        self.backend.compact()
+
+    @staticmethod
+    def hash_password(password: str) -> str:
+        from infrastructure.repository import Repository
+        return Repository.hash_password(password)
+
+    def __getattr__(self, name):
+        # Backend-specific extras (e.g. import_json_data) pass straight through
+        return getattr(self.backend, name)
+
+    # --- Write-Behind ---
+
+    def flush(self):
+        """
+        Push all dirty users and pending interactions to the backend now.
+        """
+        with self._flush_lock:
+            with self._lock:
+                appends, self._pending_appends = self._pending_appends, []
+                dirty, self._dirty = self._dirty, {}
+
+            # One backend write per user, in the order the interactions were queued
+            batches: Dict[str, Tuple[AppUser, List[Tuple[Interaction, str]]]] = {}
+            for user, interaction, relationship in appends:
+                batches.setdefault(user.username, (user, []))[1].append((interaction, relationship))
+
+            try:
+                # Appends first: a full save of the same user then already sees them in the store
+                for username in list(batches):
+                    user, items = batches[username]
+                    self.backend.append_interactions(user, items)
+                    del batches[username]
+                    self._release(username, len(items))
+                    self.stats["append_writes"] += 1
+                for username in list(dirty):
+                    self.backend.save_user(dirty[username])
+                    del dirty[username]
+                    self._release(username)
+                    self.stats["saves"] += 1
+            except Exception:
+                logger.exception("Repository flush failed, will retry")
+                # Whatever didn't commit goes back in the queue, still counted in _unflushed
+                with self._lock:
+                    unwritten = [(user, interaction, relationship)
+                                 for user, items in batches.values() for interaction, relationship in items]
+                    self._pending_appends = unwritten + self._pending_appends
+                    for username, user in dirty.items():
+                        if username in self._dirty:
+                            self._release(username) # saved again meanwhile: the newer copy covers this one
+                        else:
+                            self._dirty[username] = user
+                raise
+            finally:
+                with self._lock:
+                    self._known_version = self.backend.version()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass # already logged, retried next tick
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self.flush()
@@ -0,0 +1,186 @@
+import os
+import json
+import gzip
+import logging
+from typing import List, Optional
+from datetime import datetime
+from domain.models import Interaction, Message, RefinedMessage, Tone, CommunicationChannel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# v2: original users_v2.json records; v3: + relationship / channel in original_message
+SCHEMA_VERSION = 3
+
+# Binary payloads start with this, so readers can tell them from JSON whatever codec is configured now
+BINARY_MAGIC = b"DPLMP1\n"
+
+class CodecError(ValueError):
+    """
+    A stored record that doesn't match the schema (or was written by a newer version).
+    """
+
+# --- Serializers ---
+
+class JsonSerializer:
+    name = "json"
+    binary = False
+
+    def dumps(self, obj) -> bytes:
+        # Compact separators: indent=4 made the snapshot ~40% whitespace
+        return json.dumps(obj, separators=(",", ":"), default=str).encode("utf-8")
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+class OrjsonSerializer(JsonSerializer):
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, default=str)
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+class MsgpackSerializer:
+    name = "msgpack"
+    binary = True
+
+    def dumps(self, obj) -> bytes:
+        return BINARY_MAGIC + msgpack.packb(obj, use_bin_type=True, default=str)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data[len(BINARY_MAGIC):], raw=False)
+
+def get_serializer(name: Optional[str] = None):
+    """
+    DIPLOMAT_CODEC: "json", "orjson" or "msgpack" (compact binary).
+    Defaults to orjson when it is installed, plain json otherwise.
+    """
+    name = (name or os.getenv("DIPLOMAT_CODEC") or ("orjson" if orjson else "json")).lower()
+    if name == "json":
+        return JsonSerializer()
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("DIPLOMAT_CODEC=orjson needs the 'orjson' package")
+        return OrjsonSerializer()
+    if name == "msgpack":
+        if msgpack is None:
+            raise ValueError("DIPLOMAT_CODEC=msgpack needs the 'msgpack' package")
+        return MsgpackSerializer()
+    raise ValueError(f"Unknown codec: {name}")
+
+def load_document(data: bytes):
+    """
+    Reads a snapshot written by any serializer (format is detected, not configured).
+    """
+    if data.startswith(BINARY_MAGIC):
+        if msgpack is None:
+            raise CodecError("Store is msgpack-encoded but the 'msgpack' package is not installed")
+        return MsgpackSerializer().loads(data)
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def dump_line(record: dict) -> str:
+    # Journal lines stay JSON whatever the snapshot codec: they must survive torn writes line by line
+    if orjson:
+        return orjson.dumps(record, default=str).decode("utf-8")
+    return json.dumps(record, separators=(",", ":"), default=str)
+
+def load_line(line: str) -> dict:
+    return orjson.loads(line) if orjson else json.loads(line)
+
+# --- Record Batches (cold segments) ---
+
+def encode_records(records: List[dict], serializer=None) -> bytes:
+    serializer = serializer or get_serializer()
+    if serializer.binary:
+        payload = serializer.dumps(records)
+    else:
+        payload = "\n".join(dump_line(r) for r in records).encode("utf-8")
+    return gzip.compress(payload)
+
+def decode_records(blob: bytes) -> List[dict]:
+    payload = gzip.decompress(blob)
+    if payload.startswith(BINARY_MAGIC):
+        return load_document(payload)
+    return [load_line(line) for line in payload.split(b"\n") if line]
+
+# --- Interactions ---
+
+_TONES = {t.value: t for t in Tone}
+_CHANNELS = {c.value: c for c in CommunicationChannel}
+
+def interaction_to_record(interaction: Interaction) -> dict:
+    msg = interaction.message
+    return {
+        "v": SCHEMA_VERSION,
+        "timestamp": interaction.timestamp.isoformat(),
+        "accepted": interaction.accepted,
+        "final_content": interaction.final_content,
+        "original_message": {
+            "content": msg.content,
+            "recipient": msg.recipient_name,
+            "relationship": msg.recipient_relationship,
+            "tone": msg.intended_tone.value,
+            "channel": msg.channel.value
+        },
+        "refined_suggestion": interaction.refined_message.suggested_content
+    }
+
+def interaction_from_record(record: dict) -> Interaction:
+    """
+    Strict decode: raises CodecError instead of building a half-valid Interaction.
+    Lookups go through prebuilt dicts and every default is passed explicitly,
+    which keeps hydration of large pages cheap.
+    """
+    try:
+        version = record.get("v", 2)
+        if version > SCHEMA_VERSION:
+            raise CodecError(f"Record schema v{version} is newer than supported v{SCHEMA_VERSION}")
+
+        orig = record["original_message"]
+        tone = _TONES.get(orig["tone"])
+        if tone is None:
+            raise CodecError(f"Unknown tone: {orig['tone']!r}")
+        channel = _CHANNELS.get(orig.get("channel", CommunicationChannel.CHAT.value))
+        if channel is None:
+            raise CodecError(f"Unknown channel: {orig['channel']!r}")
+        accepted = record["accepted"]
+        if not isinstance(accepted, bool):
+            raise CodecError(f"'accepted' must be a bool, got {accepted!r}")
+        timestamp = datetime.fromisoformat(record["timestamp"])
+
+        msg = Message(
+            content=orig["content"],
+            recipient_name=orig["recipient"],
+            recipient_relationship=orig.get("relationship", ""), # v2 records don't have it
+            intended_tone=tone,
+            channel=channel,
+            timestamp=timestamp
+        )
+        ref_msg = RefinedMessage(
+            original_message=msg,
+            suggested_content=record["refined_suggestion"],
+            reasoning="", # Not stored
+            changes_made=[] # Not stored
+        )
+        return Interaction(
+            message=msg,
+            refined_message=ref_msg,
+            accepted=accepted,
+            final_content=record["final_content"],
+            timestamp=timestamp
+        )
+    except CodecError:
+        raise
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise CodecError(f"Malformed interaction record: {e!r}") from e
@@ -0,0 +1,131 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Optional, List, Tuple
+from infrastructure.llm_errors import LLMError, RateLimitError
+
+class FakeProvider:
+    """
+    Offline stand-in for GeminiProvider, for benchmarks and load tests of our own code.
+    Output is a pure function of the input; latency, errors and 429s come from a seeded
+    RNG, so a sequential run replays exactly. Nothing is cached: every call pays the latency.
+    """
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, chunk_delay: float = 0.02,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 seed: int = 0, model_name: str = "fake"):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.model_name = model_name
+
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.stats = {"calls": 0, "errors": 0, "rate_limited": 0}
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        """
+        DIPLOMAT_FAKE_LATENCY / _JITTER / _CHUNK_DELAY (seconds), DIPLOMAT_FAKE_ERROR_RATE,
+        DIPLOMAT_FAKE_429_RATE (0..1 per call), DIPLOMAT_FAKE_SEED.
+        """
+        return cls(
+            latency=float(os.getenv("DIPLOMAT_FAKE_LATENCY", "0.2")),
+            jitter=float(os.getenv("DIPLOMAT_FAKE_JITTER", "0")),
+            chunk_delay=float(os.getenv("DIPLOMAT_FAKE_CHUNK_DELAY", "0.02")),
+            error_rate=float(os.getenv("DIPLOMAT_FAKE_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("DIPLOMAT_FAKE_429_RATE", "0")),
+            seed=int(os.getenv("DIPLOMAT_FAKE_SEED", "0"))
+        )
+
+    # --- Simulation ---
+
+    def _roll(self):
+        """
+        Decides this call's fate: (latency, simulated failure or None).
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            failure = self._rng.random()
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            if failure < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return delay, RateLimitError("429 Resource has been exhausted (fake)", retry_after=self.retry_after)
+            if failure < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return delay, LLMError("500 Internal error (fake)")
+        return delay, None
+
+    def _call(self) -> None:
+        # Failures take as long as successes: the real API also answers 429s after a round trip
+        delay, error = self._roll()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+
+    async def _call_async(self) -> None:
+        delay, error = self._roll()
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def _digest(*parts: str) -> str:
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:8]
+
+    def _rewrite(self, original_content: str, target_tone: str, channel: str, context_notes: str) -> str:
+        return f"[{target_tone} {channel} #{self._digest(original_content, target_tone, channel, context_notes)}] {original_content.strip()}"
+
+    def _explanation(self, original: str, refined: str, tone: str) -> str:
+        return f"- Adjusted the wording to a {tone} tone.\n- Kept the original meaning ({len(original.split())} words in, {len(refined.split())} out)."
+
+    # --- LLMProvider ---
+
+    def refine_message(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        self._call()
+        return self._rewrite(original_content, target_tone, channel, context_notes)
+
+    def refine_message_stream(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        # Latency is time to first chunk; then one word per chunk_delay
+        self._call()
+        words = self._rewrite(original_content, target_tone, channel, context_notes).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield word if i == len(words) - 1 else word + " "
+
+    def refine_and_explain(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> Optional[Tuple[str, str, List[str]]]:
+        self._call()
+        refined = self._rewrite(original_content, target_tone, channel, context_notes)
+        return refined, self._explanation(original_content, refined, target_tone), [f"Rewrote in a {target_tone} tone"]
+
+    def explain_changes(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        try:
+            self._call()
+        except LLMError:
+            return "Could not generate explanation." # same contract as GeminiProvider
+        return self._explanation(original, refined, tone)
+
+    def ping(self):
+        self._call()
+
+    async def refine_message_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        await self._call_async()
+        return self._rewrite(original_content, target_tone, channel, context_notes)
+
+    async def refine_and_explain_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> Optional[Tuple[str, str, List[str]]]:
+        await self._call_async()
+        refined = self._rewrite(original_content, target_tone, channel, context_notes)
+        return refined, self._explanation(original_content, refined, target_tone), [f"Rewrote in a {target_tone} tone"]
+
+    async def explain_changes_async(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        try:
+            await self._call_async()
+        except LLMError:
+            return "Could not generate explanation."
+        return self._explanation(original, refined, tone)
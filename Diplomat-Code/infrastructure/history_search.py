@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+from domain.search import HistoryIndex, SearchQuery
+
+class SearchIndexCache:
+    """
+    Per-user HistoryIndex for the file stores, built on the first search from the
+    user's full history (hot and cold) and then kept in step with our own writes.
+
+    Each index remembers the store version() it matches. Writes made through the
+    repository report themselves via advance(), which adds the new records to the
+    index and moves that version along, so only changes made by someone else
+    (another process) force a rebuild.
+
+    An index holds all of a user's texts, so only the `max_users` (DIPLOMAT_SEARCH_INDEXES)
+    most recently searched users keep theirs; the others rebuild on their next search.
+    """
+    def __init__(self, max_users: Optional[int] = None):
+        self.max_users = max_users or int(os.getenv("DIPLOMAT_SEARCH_INDEXES", "32"))
+        self._lock = threading.RLock()
+        # username -> [version, HistoryIndex], least recently searched first
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+
+    def search(self, username: str, version: tuple, load_records: Callable[[], Iterable[dict]],
+               query: SearchQuery, limit: int) -> List[Tuple[dict, float]]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(username)
+                return entry[1].search(query, limit)
+
+        # Build outside the lock (it reads the whole history). It is filed under the version read
+        # before building, so a write that lands meanwhile just makes it stale again.
+        index = HistoryIndex()
+        for record in load_records():
+            index.add_record(record)
+        with self._lock:
+            self._entries[username] = [version, index]
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return index.search(query, limit)
+
+    def advance(self, before: tuple, after: tuple, username: Optional[str] = None, records: Iterable[dict] = ()):
+        """
+        Records one of our own writes, which took the store from version `before` to `after`
+        (the caller keeps other writers out meanwhile). Indexes that were current stay current,
+        and `username`'s takes the newly written records.
+        """
+        with self._lock:
+            for name, entry in self._entries.items():
+                if entry[0] == before:
+                    entry[0] = after
+                    if name == username:
+                        for record in records:
+                            entry[1].add_record(record)
+
+    def rename(self, old_username: str, new_username: str):
+        with self._lock:
+            entry = self._entries.pop(old_username, None)
+            if entry is not None:
+                self._entries[new_username] = entry
+
+    def drop(self, username: Optional[str] = None):
+        """
+        Forget one user's index, or all of them (e.g. after retention expired old history).
+        """
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
@@ -0,0 +1,66 @@
+import re
+from typing import Optional
+
+class LLMError(Exception):
+    """
+    The model call failed; nothing usable came back. Never shown to the user as a suggestion.
+    """
+    retryable = False
+
+class RateLimitError(LLMError):
+    """
+    429 / quota exhausted, or our own limiter could not get a slot before the deadline.
+    """
+    retryable = True
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMUnavailableError(LLMError):
+    """
+    Transient provider failure (5xx, connection reset).
+    """
+    retryable = True
+
+class LLMTimeoutError(LLMError):
+    """
+    The request's deadline passed.
+    """
+
+# google.api_core exception classes, matched by name so they don't have to be imported here
+_RATE_LIMITED = {"ResourceExhausted", "TooManyRequests"}
+_TIMED_OUT = {"DeadlineExceeded", "GatewayTimeout", "RequestTimeout", "ReadTimeout", "ConnectTimeout"}
+_UNAVAILABLE = {"ServiceUnavailable", "InternalServerError", "BadGateway", "ServerError", "ConnectError"}
+# Their messages start with the HTTP status, e.g. "429 Resource has been exhausted"
+_STATUS_PREFIX = re.compile(r"^(\d{3}) ")
+
+def _status_code(e: Exception) -> Optional[int]:
+    for source in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "code"):
+            value = getattr(source, attr, None)
+            # grpc errors have a code() method instead; only HTTP statuses count here
+            if isinstance(value, int) and 100 <= value <= 599:
+                return value
+    match = _STATUS_PREFIX.match(str(e))
+    return int(match.group(1)) if match else None
+
+def classify_error(e: Exception) -> LLMError:
+    """
+    Maps whatever the SDK raised onto our exception types: by exception class (name, anywhere
+    in its MRO), then by HTTP status (attribute, or the status the message starts with).
+    """
+    if isinstance(e, LLMError):
+        return e
+    text = f"{type(e).__name__}: {e}"
+    names = {cls.__name__ for cls in type(e).__mro__}
+    status = _status_code(e)
+    if names & _RATE_LIMITED or status == 429:
+        lowered = text.lower()
+        match = re.search(r"retry in ([\d.]+)s", lowered) or re.search(r"seconds: (\d+)", lowered)
+        return RateLimitError(text, retry_after=float(match.group(1)) if match else None)
+    if names & _TIMED_OUT or status in (408, 504) or isinstance(e, TimeoutError):
+        return LLMTimeoutError(text)
+    if names & _UNAVAILABLE or (status is not None and status >= 500) or isinstance(e, ConnectionError):
+        return LLMUnavailableError(text)
+    return LLMError(text)
@@ -1,25 +1,272 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import json
+import time
+import asyncio
+import itertools
+from typing import List
+from infrastructure.response_cache import ResponseCache
+from infrastructure.rate_limiter import RateLimiter, get_shared_limiter, backoff_delay, estimate_tokens
+from infrastructure.llm_errors import LLMError, LLMTimeoutError, classify_error
 
-# Load environment variables
-load_dotenv()
+# Structured output for refine_and_explain
+COMBINED_CONFIG = {"response_mime_type": "application/json"}
 
 class GeminiProvider:
-    def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
+    """
+    Gemini calls go through the process-wide rate limiter and are retried with
+    jittered exponential backoff until `deadline_seconds`. Failures raise LLMError
+    subclasses (see llm_errors.py); error text is never returned as a suggestion.
+    """
+    def __init__(self, model_name: str = "gemini-2.5-flash", cache: ResponseCache = None, limiter: RateLimiter = None,
+                 max_attempts: int = None, model=None):
+        # `model`: anything with GenerativeModel's generate_content(_async), instead of building one (tests)
+        self.model_name = model_name
+        self.model = model
+        if self.model is None:
+            # Using the latest flash model alias for better availability
+            self.model = self._sdk().GenerativeModel(model_name)
+        # Identical requests (same draft to many recipients, double clicks) are answered from here
+        self.cache = cache or ResponseCache.from_env()
+        self.limiter = limiter or get_shared_limiter()
+        self.deadline_seconds = float(os.getenv("DIPLOMAT_LLM_DEADLINE", "60"))
+        # Behind a ModelRouter this is lowered: failing over to the next model beats waiting out a backoff
+        self.max_attempts = max_attempts or int(os.getenv("DIPLOMAT_LLM_MAX_ATTEMPTS", "5"))
+
+    @staticmethod
+    def _sdk():
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
             raise ValueError("GEMINI_API_KEY not found. Please set it in .env file.")
-        
-        genai.configure(api_key=self.api_key)
-        # Using the latest flash model alias for better availability
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        # The SDK is heavy to import; only pay for it when a Gemini provider is actually built
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        return genai
 
-    def refine_message(self, original_content: str, target_tone: str, channel: str, context_notes: str) -> str:
+    @classmethod
+    def available_models(cls) -> List[str]:
+        """
+        Names of the models this API key can call generate_content on.
+        """
+        return [m.name for m in cls._sdk().list_models() if "generateContent" in m.supported_generation_methods]
+
+    # --- Transport (limiter + retry) ---
+
+    @staticmethod
+    def _request_tokens(prompt: str) -> int:
+        # TPM counts input and output; assume the answer is about as long as the prompt
+        return estimate_tokens(prompt) * 2
+
+    def _generate_text(self, prompt: str, **kwargs) -> str:
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            self.limiter.acquire(self._request_tokens(prompt), deadline)
+            try:
+                response = self.model.generate_content(
+                    prompt, request_options={"timeout": max(1.0, deadline - time.monotonic())}, **kwargs
+                )
+                return response.text
+            except Exception as e:
+                error = classify_error(e)
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise error
+            attempt += 1
+            time.sleep(delay)
+
+    async def _generate_text_async(self, prompt: str, **kwargs) -> str:
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async(self._request_tokens(prompt), deadline)
+            try:
+                response = await self.model.generate_content_async(
+                    prompt, request_options={"timeout": max(1.0, deadline - time.monotonic())}, **kwargs
+                )
+                return response.text
+            except Exception as e:
+                error = classify_error(e)
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise error
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _start_stream(self, prompt: str, deadline: float):
+        """
+        Opens a streaming request and waits for its first chunk, retrying like _generate_text.
+        Returns (first chunk or None, the rest). Once text has reached the caller a retry
+        would repeat it, so errors after this point are only classified.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire(self._request_tokens(prompt), deadline)
+            try:
+                chunks = iter(self.model.generate_content(
+                    prompt, stream=True, request_options={"timeout": max(1.0, deadline - time.monotonic())}
+                ))
+                return next(chunks, None), chunks
+            except Exception as e:
+                error = classify_error(e)
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    raise error
+            attempt += 1
+            time.sleep(delay)
+
+    def _retry_delay(self, error: LLMError, attempt: int, deadline: float):
+        """
+        Seconds to wait before the next attempt, or None to give up.
+        """
+        if not error.retryable or attempt + 1 >= self.max_attempts:
+            return None
+        delay = backoff_delay(attempt, retry_after=getattr(error, "retry_after", None))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    # --- Blocking API ---
+
+    def refine_message(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
         """
         Sends a prompt to Gemini to refine the message.
+        use_cache=False always asks the model (e.g. "Regenerate") and refreshes the cached answer.
+        """
+        key = ResponseCache.make_key("refine", original_content, target_tone, channel, context_notes, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        prompt = self._refine_prompt(original_content, target_tone, channel, context_notes)
+        refined = self._generate_text(prompt).strip('`"') # Cleanup potential formatting
+
+        self.cache.put(key, refined)
+        return refined
+
+    def refine_message_stream(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        """
+        Same as refine_message, but yields the text chunk by chunk as Gemini produces it.
+        The complete (cleaned) text goes into the same cache entry refine_message uses.
         """
-        prompt = f"""
+        key = ResponseCache.make_key("refine", original_content, target_tone, channel, context_notes, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        prompt = self._refine_prompt(original_content, target_tone, channel, context_notes)
+        parts = []
+        # Same cleanup as refine_message: drop leading fences/quotes, hold back trailing ones until more text arrives
+        started = False
+        held = ""
+        first, rest = self._start_stream(prompt, time.monotonic() + self.deadline_seconds)
+        try:
+            for chunk in itertools.chain([] if first is None else [first], rest):
+                text = chunk.text
+                if not started:
+                    text = text.lstrip('`"')
+                    if not text:
+                        continue
+                    started = True
+                text = held + text
+                body = text.rstrip('`"')
+                held = text[len(body):]
+                if body:
+                    parts.append(body)
+                    yield body
+        except Exception as e:
+            raise classify_error(e)
+
+        self.cache.put(key, "".join(parts))
+
+    def refine_and_explain(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        """
+        One round trip for rewrite + explanation + list of changes, as structured JSON.
+        Returns (refined, explanation, changes), or None if the model couldn't produce valid JSON
+        so the caller can fall back to refine_message + explain_changes.
+        Rate limits and timeouts raise: the fallback would only hit them again.
+        """
+        key = ResponseCache.make_key("combined", original_content, target_tone, channel, context_notes, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return self._parse_combined(cached)
+
+        prompt = self._combined_prompt(original_content, target_tone, channel, context_notes)
+
+        try:
+            raw = self._generate_text(prompt, generation_config=COMBINED_CONFIG)
+        except LLMError as e:
+            if e.retryable or isinstance(e, LLMTimeoutError):
+                raise
+            return None
+
+        result = self._parse_combined(raw)
+        if result is not None:
+            self.cache.put(key, raw)
+        return result
+
+    @staticmethod
+    def _parse_combined(raw: str):
+        text = raw.strip()
+        if text.startswith("```"):
+            # Some models still wrap JSON in a code fence
+            text = text.strip("`")
+            if text.startswith("json"):
+                text = text[len("json"):]
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+
+        if not isinstance(data, dict):
+            return None
+        refined = data.get("refined_message")
+        explanation = data.get("explanation")
+        changes = data.get("changes", [])
+        if not isinstance(refined, str) or not refined.strip():
+            return None
+        if not isinstance(explanation, str):
+            return None
+        if not isinstance(changes, list) or not all(isinstance(c, str) for c in changes):
+            return None
+        return refined.strip('`"'), explanation.strip(), changes
+
+    @classmethod
+    def _combined_prompt(cls, original_content: str, target_tone: str, channel: str, context_notes: str) -> str:
+        return cls._rewrite_task(original_content, target_tone, channel, context_notes) + """
+        Output Format:
+        Return a single JSON object and nothing else:
+        {
+            "refined_message": "<the refined message only, no introductory text>",
+            "explanation": "<1 single sentence explaining your changes, starting with 'I changed...'>",
+            "changes": ["<short description of each change>", "..."]
+        }
+        """
+
+    @staticmethod
+    def _explain_prompt(original: str, refined: str, tone: str) -> str:
+        return f"""
+        You just rewrote a message to be more "{tone}".
+        
+        Original: "{original}"
+        New: "{refined}"
+        
+        Explain your changes in 1 single sentence. start with "I changed..."
+        """
+
+    @classmethod
+    def _refine_prompt(cls, original_content: str, target_tone: str, channel: str, context_notes: str) -> str:
+        return cls._rewrite_task(original_content, target_tone, channel, context_notes) + """
+        Output Format:
+        Return ONLY the refined message code. Do not include any introductory text like "Here is the refined message".
+        """
+
+    @staticmethod
+    def _rewrite_task(original_content: str, target_tone: str, channel: str, context_notes: str) -> str:
+        return f"""
         Act as an expert communication diplomat and editor.
         
         Your Goal: Rewrite the following message to match the target tone: "{target_tone}".
@@ -30,33 +277,85 @@ class GeminiProvider:
         
         Original Message:
         "{original_content}"
-        
-        Output Format:
-        Return ONLY the refined message code. Do not include any introductory text like "Here is the refined message".
         """
-        
-        try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip('`"') # Cleanup potential formatting
-        except Exception as e:
-            if "429" in str(e) or "quota" in str(e).lower():
-                return "System is currently cooling down (Rate Limit). Please wait 30-60 seconds and try again."
-            return f"Error generating suggestion: {str(e)}"
 
-    def explain_changes(self, original: str, refined: str, tone: str) -> str:
+    def explain_changes(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
         """
         Asks Gemini to explain why it made the changes.
         """
-        prompt = f"""
-        You just rewrote a message to be more "{tone}".
-        
-        Original: "{original}"
-        New: "{refined}"
-        
-        Explain your changes in 1 single sentence. start with "I changed..."
+        key = ResponseCache.make_key("explain", original, refined, tone, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        prompt = self._explain_prompt(original, refined, tone)
+        try:
+            explanation = self._generate_text(prompt).strip()
+        except LLMError:
+            # The suggestion itself is fine; a missing explanation isn't worth failing it
+            return "Could not generate explanation."
+
+        self.cache.put(key, explanation)
+        return explanation
+
+    def ping(self):
+        """
+        Smallest possible request; raises LLMError if the model can't be used.
         """
+        self._generate_text("Test")
+
+    # --- Async API ---
+    # Same contracts as the blocking methods above, on generate_content_async,
+    # so one event loop can keep many suggestions in flight.
+
+    async def refine_message_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        key = ResponseCache.make_key("refine", original_content, target_tone, channel, context_notes, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        refined = (await self._generate_text_async(
+            self._refine_prompt(original_content, target_tone, channel, context_notes)
+        )).strip('`"')
+
+        self.cache.put(key, refined)
+        return refined
+
+    async def refine_and_explain_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        key = ResponseCache.make_key("combined", original_content, target_tone, channel, context_notes, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return self._parse_combined(cached)
+
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
+            raw = await self._generate_text_async(
+                self._combined_prompt(original_content, target_tone, channel, context_notes),
+                generation_config=COMBINED_CONFIG
+            )
+        except LLMError as e:
+            if e.retryable or isinstance(e, LLMTimeoutError):
+                raise
+            return None
+
+        result = self._parse_combined(raw)
+        if result is not None:
+            self.cache.put(key, raw)
+        return result
+
+    async def explain_changes_async(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        key = ResponseCache.make_key("explain", original, refined, tone, self.model_name)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        try:
+            explanation = (await self._generate_text_async(self._explain_prompt(original, refined, tone))).strip()
+        except LLMError:
             return "Could not generate explanation."
+
+        self.cache.put(key, explanation)
+        return explanation
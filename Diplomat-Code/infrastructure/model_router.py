@@ -0,0 +1,369 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional
+from infrastructure.llm_errors import LLMError, LLMUnavailableError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures (or one quota error);
+    open -> half-open after the cooldown, where one trial call decides which way it goes.
+    """
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_started = None # half-open: when the trial call was let through
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.failure_threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        now = time.monotonic()
+        # A trial that was never reported back (e.g. the request didn't need this model) expires
+        if state == "half-open" and (self.trial_started is None or now - self.trial_started > self.cooldown):
+            self.trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.trial_started = None
+
+    def record_failure(self, cooldown: Optional[float] = None):
+        self.failures += 1
+        self.trial_started = None
+        if self.failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + max(self.cooldown, cooldown or 0)
+
+    def trip(self, cooldown: Optional[float] = None):
+        self.failures = max(self.failures, self.failure_threshold - 1)
+        self.record_failure(cooldown)
+
+class ModelStats:
+    def __init__(self, window: int = 200):
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.hedges = 0 # hedge requests sent to this model
+        self.hedges_won = 0
+        self.latencies = deque(maxlen=window) # seconds, successful unary calls only
+        self.first_token = deque(maxlen=window) # seconds to the first chunk of successful streams
+
+    def percentile(self, p: float, samples: Optional[deque] = None) -> Optional[float]:
+        samples = self.latencies if samples is None else samples
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def report(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        ttft = self.percentile(0.5, self.first_token)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "first_token_p50_ms": round(ttft * 1000) if ttft is not None else None,
+        }
+
+class _Attempt:
+    """
+    One model call submitted to the pool; `started` is set once a thread picks it up.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.started = threading.Event()
+        self.started_at: Optional[float] = None
+
+    def start(self, at: float):
+        self.started_at = at
+        self.started.set()
+
+class ModelRouter:
+    """
+    LLMProvider over an ordered list of models (one provider each, first = preferred).
+
+    - Fallback: a failed call moves on to the next model whose breaker allows it.
+    - Hedging: if the current model hasn't answered after its p95 latency (or `hedge_after`
+      seconds until there are enough samples), the same request also goes to the next model
+      and the first answer wins.
+    - Circuit breaker per model: quota errors open it at once, other errors after a few in a row.
+
+    Blocking calls run on a pool sized for `max_concurrency` requests at once (a primary
+    and at most one hedge each). Latency and the hedge timer count from when a call
+    actually starts, so time spent queued for a thread doesn't look like a slow model.
+    """
+    def __init__(self, providers: Dict[str, object], hedge_after: float = None, min_samples: int = 20,
+                 failure_threshold: int = 3, cooldown: float = 30.0, max_concurrency: int = None):
+        self.providers = providers
+        self.order: List[str] = list(providers)
+        self.model_name = self.order[0] if self.order else None
+        if hedge_after is None:
+            hedge_after = float(os.getenv("DIPLOMAT_HEDGE_AFTER", "8"))
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self.breakers = {name: CircuitBreaker(failure_threshold, cooldown) for name in self.order}
+        self.model_stats = {name: ModelStats() for name in self.order}
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("DIPLOMAT_LLM_CONCURRENCY", "8"))
+        # Losing hedges keep running here (a blocking SDK call can't be interrupted); their answers still fill the cache
+        self._executor = ThreadPoolExecutor(max_workers=2 * max_concurrency, thread_name_prefix="model-router")
+
+    def __getattr__(self, name):
+        # cache etc. of the preferred model's provider
+        return getattr(self.providers[self.order[0]], name)
+
+    # --- Bookkeeping ---
+
+    def _candidates(self) -> List[str]:
+        with self._lock:
+            return [name for name in self.order if self.breakers[name].allow()]
+
+    def _hedge_delay(self, name: str) -> float:
+        stats = self.model_stats[name]
+        with self._lock:
+            if len(stats.latencies) < self.min_samples:
+                return self.hedge_after
+            return stats.percentile(0.95)
+
+    def _record(self, name: str, started: float, error: Optional[LLMError] = None, stream: bool = False, trip: bool = False):
+        """
+        One finished call. Streams report their time to first chunk, kept apart from unary latencies
+        (which drive hedging). `trip` opens the breaker on any failure, not just quota errors.
+        """
+        with self._lock:
+            stats = self.model_stats[name]
+            stats.calls += 1
+            if error is None:
+                (stats.first_token if stream else stats.latencies).append(time.monotonic() - started)
+                self.breakers[name].record_success()
+                return
+            stats.errors += 1
+            if isinstance(error, RateLimitError):
+                stats.rate_limited += 1
+                self.breakers[name].trip(error.retry_after)
+            elif trip:
+                self.breakers[name].trip()
+            else:
+                self.breakers[name].record_failure()
+        logger.warning("Model %s failed: %s", name, error)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Per-model calls / errors / hedges / p50 / p95 and breaker state.
+        """
+        with self._lock:
+            return {name: dict(self.model_stats[name].report(), state=self.breakers[name].state) for name in self.order}
+
+    def _timed(self, name: str, method: str, args: tuple, attempt: Optional[_Attempt] = None, trip: bool = False):
+        started = time.monotonic()
+        if attempt is not None:
+            attempt.start(started)
+        try:
+            result = getattr(self.providers[name], method)(*args)
+        except LLMError as e:
+            self._record(name, started, e, trip=trip)
+            raise
+        self._record(name, started)
+        return result
+
+    async def _timed_async(self, name: str, method: str, args: tuple):
+        started = time.monotonic()
+        try:
+            result = await getattr(self.providers[name], method)(*args)
+        except LLMError as e:
+            self._record(name, started, e)
+            raise
+        self._record(name, started)
+        return result
+
+    def _hedged(self, name: str, primary: str):
+        with self._lock:
+            self.model_stats[name].hedges += 1
+        logger.info("Hedging to %s: %s is slower than its p95", name, primary)
+
+    def _won(self, name: str, hedged: set):
+        if name in hedged:
+            with self._lock:
+                self.model_stats[name].hedges_won += 1
+
+    # --- Routing ---
+
+    def _submit(self, name: str, method: str, args: tuple):
+        attempt = _Attempt(name)
+        return self._executor.submit(self._timed, name, method, args, attempt), attempt
+
+    def _call(self, method: str, *args):
+        candidates = self._candidates()
+        if not candidates:
+            raise LLMUnavailableError("All models are failing (circuit open), try again shortly")
+
+        pending = {} # future -> _Attempt
+        hedged = set()
+        last_error = None
+        next_index = 0
+        while True:
+            if not pending:
+                if next_index == len(candidates):
+                    raise last_error
+                name = candidates[next_index]
+                next_index += 1
+                future, attempt = self._submit(name, method, args)
+                pending[future] = attempt
+
+            # Only one hedge at a time: hedge while a single request is in flight and a fallback is left
+            can_hedge = len(pending) == 1 and next_index < len(candidates)
+            timeout = None
+            if can_hedge:
+                current = next(iter(pending.values()))
+                # The hedge timer starts when the call does, not while it waits for a pool thread
+                current.started.wait()
+                timeout = max(0.0, current.started_at + self._hedge_delay(current.name) - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                name = candidates[next_index]
+                next_index += 1
+                self._hedged(name, current.name)
+                hedged.add(name)
+                future, attempt = self._submit(name, method, args)
+                pending[future] = attempt
+                continue
+
+            for future in done:
+                name = pending.pop(future).name
+                try:
+                    result = future.result()
+                except LLMError as e:
+                    last_error = e
+                    continue
+                self._won(name, hedged)
+                return result
+
+    async def _call_async(self, method: str, *args):
+        candidates = self._candidates()
+        if not candidates:
+            raise LLMUnavailableError("All models are failing (circuit open), try again shortly")
+
+        pending = {} # task -> model
+        hedged = set()
+        last_error = None
+        next_index = 0
+        try:
+            while True:
+                if not pending:
+                    if next_index == len(candidates):
+                        raise last_error
+                    name = candidates[next_index]
+                    next_index += 1
+                    pending[asyncio.ensure_future(self._timed_async(name, method, args))] = name
+
+                can_hedge = len(pending) == 1 and next_index < len(candidates)
+                current = next(iter(pending.values()))
+                done, _ = await asyncio.wait(pending, timeout=self._hedge_delay(current) if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    name = candidates[next_index]
+                    next_index += 1
+                    self._hedged(name, current)
+                    hedged.add(name)
+                    pending[asyncio.ensure_future(self._timed_async(name, method, args))] = name
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except LLMError as e:
+                        last_error = e
+                        continue
+                    self._won(name, hedged)
+                    return result
+        finally:
+            # Async calls can be cancelled, so the losing hedge doesn't keep spending quota
+            for task in pending:
+                task.cancel()
+
+    # --- LLMProvider ---
+
+    def refine_message(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        return self._call("refine_message", original_content, target_tone, channel, context_notes, use_cache)
+
+    def refine_message_stream(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        """
+        No hedging for streams (two half-streams can't be merged); fallback happens only before the first chunk.
+        """
+        candidates = self._candidates()
+        if not candidates:
+            raise LLMUnavailableError("All models are failing (circuit open), try again shortly")
+        last_error = None
+        for name in candidates:
+            started = time.monotonic()
+            chunks = iter(self.providers[name].refine_message_stream(original_content, target_tone, channel, context_notes, use_cache))
+            try:
+                first = next(chunks, None)
+            except LLMError as e:
+                self._record(name, started, e, stream=True)
+                last_error = e
+                continue
+            self._record(name, started, stream=True)
+            if first is not None:
+                yield first
+                yield from chunks
+            return
+        raise last_error
+
+    def refine_and_explain(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        return self._call("refine_and_explain", original_content, target_tone, channel, context_notes, use_cache)
+
+    def explain_changes(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        return self._call("explain_changes", original, refined, tone, use_cache)
+
+    async def refine_message_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        return await self._call_async("refine_message_async", original_content, target_tone, channel, context_notes, use_cache)
+
+    async def refine_and_explain_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        return await self._call_async("refine_and_explain_async", original_content, target_tone, channel, context_notes, use_cache)
+
+    async def explain_changes_async(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        return await self._call_async("explain_changes_async", original, refined, tone, use_cache)
+
+    # --- Probing ---
+
+    def probe(self, stop_at_first: bool = False) -> Optional[str]:
+        """
+        Sends a tiny request to each model in order (see find_working_model.py).
+        Failing models get their breaker opened; returns the first model that answered.
+        """
+        working = None
+        for name in self.order:
+            if getattr(self.providers[name], "ping", None) is None:
+                continue
+            try:
+                # Recorded once, by _timed; a failed probe opens the breaker right away
+                self._timed(name, "ping", (), trip=True)
+            except LLMError:
+                continue
+            working = working or name
+            if stop_at_first:
+                break
+        return working
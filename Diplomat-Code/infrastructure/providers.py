@@ -0,0 +1,91 @@
+import os
+from typing import Protocol, Callable, Dict, Iterator, Optional, Tuple, List, runtime_checkable
+from infrastructure.single_flight import SingleFlightProvider
+
+@runtime_checkable
+class LLMProvider(Protocol):
+    """
+    What RuleEngine needs from a model backend. Failures raise LLMError (see llm_errors.py).
+    refine_and_explain returns None when the backend can't do the combined call,
+    and the caller falls back to refine_message + explain_changes.
+    """
+    model_name: str
+
+    def refine_message(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str: ...
+
+    def refine_message_stream(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> Iterator[str]: ...
+
+    def refine_and_explain(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> Optional[Tuple[str, str, List[str]]]: ...
+
+    def explain_changes(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str: ...
+
+    async def refine_message_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str: ...
+
+    async def refine_and_explain_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> Optional[Tuple[str, str, List[str]]]: ...
+
+    async def explain_changes_async(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str: ...
+
+# --- Registry ---
+
+PROVIDERS: Dict[str, Callable[[], LLMProvider]] = {}
+
+def register_provider(name: str, factory: Callable[[], LLMProvider]):
+    PROVIDERS[name.lower()] = factory
+
+def create_provider(name: Optional[str] = None) -> LLMProvider:
+    """
+    DIPLOMAT_LLM_PROVIDER: "gemini" (default) or "fake" (offline, deterministic; see fake_provider.py).
+    DIPLOMAT_LLM_SINGLE_FLIGHT=0 turns off merging of identical in-flight requests.
+    """
+    name = (name or os.getenv("DIPLOMAT_LLM_PROVIDER") or "gemini").lower()
+    factory = PROVIDERS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown LLM provider: {name} (known: {', '.join(sorted(PROVIDERS))})")
+    provider = factory()
+    if os.getenv("DIPLOMAT_LLM_SINGLE_FLIGHT", "1") != "0":
+        provider = SingleFlightProvider(provider)
+    return provider
+
+def _gemini() -> LLMProvider:
+    """
+    DIPLOMAT_LLM_MODELS: comma-separated, preferred first. More than one model puts a
+    ModelRouter (fallback, hedging, circuit breakers) in front of them.
+    """
+    models = [m.strip() for m in os.getenv("DIPLOMAT_LLM_MODELS", "gemini-2.5-flash,gemini-2.0-flash").split(",") if m.strip()]
+    if len(models) == 1:
+        # Imported here so the fake provider works without google-generativeai installed
+        from infrastructure.llm_provider import GeminiProvider
+        _load_dotenv()
+        return GeminiProvider(models[0])
+    return gemini_router(models)
+
+def _load_dotenv():
+    from dotenv import load_dotenv
+    load_dotenv() # no-op for variables already set (e.g. by the container)
+
+def gemini_router(models: List[str], max_attempts: int = 2, cache=None):
+    """
+    A ModelRouter over one GeminiProvider per model name, sharing one response cache.
+    `max_attempts` is kept low: failing over to the next model beats waiting out a backoff.
+    """
+    from infrastructure.llm_provider import GeminiProvider
+    from infrastructure.model_router import ModelRouter
+    from infrastructure.response_cache import ResponseCache
+    _load_dotenv()
+    cache = cache or ResponseCache.from_env()
+    return ModelRouter({name: GeminiProvider(name, cache=cache, max_attempts=max_attempts) for name in models})
+
+def gemini_models() -> List[str]:
+    """
+    Every model the GEMINI_API_KEY account can generate content with, as the API lists them.
+    """
+    from infrastructure.llm_provider import GeminiProvider
+    _load_dotenv()
+    return GeminiProvider.available_models()
+
+def _fake() -> LLMProvider:
+    from infrastructure.fake_provider import FakeProvider
+    return FakeProvider.from_env()
+
+register_provider("gemini", _gemini)
+register_provider("fake", _fake)
@@ -0,0 +1,149 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Optional
+from infrastructure.llm_errors import RateLimitError
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` is available (0 = available now). Refills as a side effect.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+        amount = min(amount, self.capacity) # oversized requests just wait for a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+class RateLimiter:
+    """
+    Client-side limiter for the account's RPM/TPM quota, shared by every session in the process.
+    Blocking and async callers queue together in FIFO order; each request takes 1 from the
+    request bucket and its estimated token count from the token bucket. Nobody polls: the head
+    of the queue sleeps for exactly its deficit, the others until the queue moves.
+    """
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._async_waiters = {} # ticket -> (loop, future) of async callers waiting for the queue to move
+
+    def _notify(self):
+        # Caller holds self._cond
+        self._cond.notify_all()
+        for loop, future in self._async_waiters.values():
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _try_take(self, tokens: int) -> float:
+        now = time.monotonic()
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait == 0.0:
+            self.requests.take(1)
+            self.tokens.take(tokens)
+        return wait
+
+    def acquire(self, tokens: int = 0, deadline: Optional[float] = None):
+        """
+        Blocks until there is capacity. `deadline` is a time.monotonic() timestamp;
+        raises RateLimitError if it passes while still queued.
+        """
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._queue[0] is ticket:
+                        wait = self._try_take(tokens)
+                        if wait == 0.0:
+                            return
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise RateLimitError("Request queue is full for the configured rate limit", retry_after=wait)
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._queue.remove(ticket)
+                self._notify()
+
+    async def acquire_async(self, tokens: int = 0, deadline: Optional[float] = None):
+        """
+        Same queue and budget as acquire(), but waits on the event loop instead of blocking a thread.
+        """
+        loop = asyncio.get_running_loop()
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = None
+                    if self._queue[0] is ticket:
+                        wait = self._try_take(tokens)
+                        if wait == 0.0:
+                            return
+                    moved = loop.create_future()
+                    self._async_waiters[ticket] = (loop, moved)
+                try:
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise RateLimitError("Request queue is full for the configured rate limit", retry_after=wait)
+                        wait = remaining if wait is None else min(wait, remaining)
+                    await asyncio.wait([moved], timeout=wait)
+                finally:
+                    with self._cond:
+                        self._async_waiters.pop(ticket, None)
+                    moved.cancel()
+        finally:
+            with self._cond:
+                self._queue.remove(ticket)
+                self._notify()
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0, retry_after: Optional[float] = None) -> float:
+    """
+    Full-jitter exponential backoff; never shorter than what the server asked for.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English; good enough for budgeting
+    return max(1, len(text) // 4)
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+def get_shared_limiter() -> RateLimiter:
+    """
+    DIPLOMAT_LLM_RPM / DIPLOMAT_LLM_TPM: the account limits (defaults: gemini-2.5-flash free tier).
+    """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter(
+                rpm=float(os.getenv("DIPLOMAT_LLM_RPM", "10")),
+                tpm=float(os.getenv("DIPLOMAT_LLM_TPM", "250000"))
+            )
+        return _shared_limiter
@@ -1,30 +1,332 @@
-import json
 import os
+import glob
 import hashlib
-from typing import Optional, Dict
-from domain.models import AppUser, AgentMemory, Interaction, Message, RefinedMessage, Tone, Contact
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Optional, List, Tuple, Iterable
+from domain.models import AppUser, HistoryView, Interaction, Contact, SearchHit
+from domain.search import SearchQuery
+from infrastructure.retention import RetentionPolicy, fold_record, segment_meta
+from infrastructure.history_search import SearchIndexCache
+from infrastructure.codec import (
+    SCHEMA_VERSION, CodecError, get_serializer, load_document, dump_line, load_line,
+    encode_records, decode_records, interaction_to_record, interaction_from_record
+)
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 class Repository:
-    def __init__(self, storage_path: str = "d:/Diplomat/users_v2.json"):
+    """
+    JSON snapshot + append-only journal.
+    learn() only appends one line to the active journal segment; the segments
+    are folded back into the snapshot every `compact_every` records, which is
+    also when the retention policy moves old history into gzip cold segments.
+    """
+    def __init__(self, storage_path: str = "d:/Diplomat/users_v2.json", compact_every: int = 200,
+                 retention: Optional[RetentionPolicy] = None, serializer=None):
         self.storage_path = storage_path
+        self.journal_base = os.path.splitext(storage_path)[0] + ".journal"
+        self.cold_dir = os.path.splitext(storage_path)[0] + ".cold"
+        self.compact_every = compact_every
+        self.retention = retention or RetentionPolicy()
+        self.serializer = serializer or get_serializer()
+        self._search = SearchIndexCache()
+        # Reads take it too: compaction deletes the journal segments a reader would be replaying
+        self._store_lock = threading.RLock()
+        self._read_cache = None # (version, data), see _read_data()
         self._ensure_storage()
+        self._journal_records = self._count_journal_records()
 
     def _ensure_storage(self):
         if not os.path.exists(self.storage_path):
-            with open(self.storage_path, "w") as f:
-                json.dump({"users": {}}, f)
+            self._save_data({"users": {}})
 
-    def _load_data(self) -> dict:
+    def _load_snapshot(self) -> dict:
         try:
-            with open(self.storage_path, "r") as f:
-                return json.load(f)
-        except Exception:
+            with open(self.storage_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return {"users": {}}
+        if not raw.strip():
             return {"users": {}}
 
+        try:
+            data = load_document(raw)
+        except ValueError as e:
+            # Don't pretend the store is empty: the next save would wipe it
+            raise CodecError(f"Unreadable store {self.storage_path}: {e}") from e
+        if data.get("schema_version", 2) > SCHEMA_VERSION:
+            raise CodecError(f"{self.storage_path} was written by a newer version (schema v{data['schema_version']})")
+        return data
+
+    def _load_data(self) -> dict:
+        """
+        Snapshot with every not-yet-compacted journal segment replayed on top.
+        """
+        with self._store_lock:
+            while True:
+                snapshot = self._snapshot_token()
+                data = self._load_snapshot()
+                data.setdefault("users", {})
+                first_segment = data.get("journal_segment", 0)
+                try:
+                    for segment in self._list_segments():
+                        if segment >= first_segment:
+                            self._replay_segment(data, segment)
+                except FileNotFoundError:
+                    # Another process compacted meanwhile: the segment is in its new snapshot
+                    continue
+                if self._snapshot_token() == snapshot:
+                    return data
+
+    def _snapshot_token(self) -> Optional[tuple]:
+        # Compaction swaps in a new file (os.replace), so this changes with every snapshot commit
+        try:
+            st = os.stat(self.storage_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_data(self) -> dict:
+        """
+        The parsed store for read-only callers (history pages, recipients, search index builds):
+        parsed again only when version() changes, and our own appends are applied to it in place.
+        Callers must not modify it.
+        """
+        with self._store_lock:
+            version = self.version()
+            if self._read_cache is None or self._read_cache[0] != version:
+                self._read_cache = (version, self._load_data())
+            return self._read_cache[1]
+
     def _save_data(self, data: dict):
-        with open(self.storage_path, "w") as f:
-            json.dump(data, f, indent=4, default=str)
+        # Write to a temp file and swap it in, so a crash never leaves a half-written snapshot
+        tmp_path = f"{self.storage_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data["schema_version"] = SCHEMA_VERSION
+        with open(tmp_path, "wb") as f:
+            f.write(self.serializer.dumps(data))
+        os.replace(tmp_path, self.storage_path)
+
+    def version(self) -> tuple:
+        """
+        Cheap change token (stat only) so caches can tell when another process wrote the store.
+        """
+        parts = []
+        for path in [self.storage_path] + [self._segment_path(n) for n in self._list_segments()]:
+            try:
+                st = os.stat(path)
+                parts.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                pass
+        return tuple(parts)
+
+    @contextmanager
+    def _own_write(self, username: Optional[str] = None, records: Iterable[dict] = ()):
+        # Our own writes keep the search indexes current instead of invalidating them
+        with self._store_lock:
+            before = self.version()
+            yield
+            self._search.advance(before, self.version(), username, records)
+
+    # --- Journal ---
+
+    def _segment_path(self, segment: int) -> str:
+        return f"{self.journal_base}.{segment:06d}.jsonl"
+
+    def _list_segments(self) -> List[int]:
+        segments = []
+        for path in glob.glob(glob.escape(self.journal_base) + ".*.jsonl"):
+            try:
+                segments.append(int(path[len(self.journal_base) + 1:-len(".jsonl")]))
+            except ValueError:
+                pass
+        return sorted(segments)
+
+    def _active_segment(self) -> int:
+        segments = self._list_segments()
+        return segments[-1] if segments else 0
+
+    def _count_journal_records(self) -> int:
+        count = 0
+        for segment in self._list_segments():
+            try:
+                with open(self._segment_path(segment), "r") as f:
+                    count += sum(1 for line in f if line.strip())
+            except FileNotFoundError:
+                pass # compacted by another process meanwhile
+        return count
+
+    def _replay_segment(self, data: dict, segment: int):
+        with open(self._segment_path(segment), "r") as f:
+            for line in f:
+                try:
+                    record = load_line(line)
+                except ValueError:
+                    # torn last line after a crash
+                    continue
+                self._apply_record(data, record)
+
+    def _apply_record(self, data: dict, record: dict):
+        users = data["users"]
+        # Users that were never saved (e.g. guest) get a bare entry, same as save_user would create
+        u_data = users.setdefault(record["user"], {
+            "email": "", "password_hash": "", "self_context": "", "contacts": [], "memory": {}
+        })
+        memory = u_data.setdefault("memory", {})
+        memory.setdefault("history", []).append(record["interaction"])
+        prefs = memory.setdefault("relationship_preferences", {})
+        for rel, scores in record.get("relationship_preferences", {}).items():
+            prefs[rel] = scores
+
+    def append_interaction(self, user: AppUser, interaction: Interaction, relationship: str):
+        """
+        Persist a single interaction (and the preference row it changed) in O(1).
+        """
+        self.append_interactions(user, [(interaction, relationship)])
+
+    def append_interactions(self, user: AppUser, items: List[Tuple[Interaction, str]]):
+        """
+        Several (interaction, relationship) pairs of one user in a single journal write.
+        """
+        records = [self._interaction_to_dict(interaction) for interaction, _ in items]
+        entries = [{
+            "user": user.username,
+            "interaction": h_data,
+            "relationship_preferences": {
+                relationship: dict(user.memory.relationship_preferences.get(relationship, {}))
+            }
+        } for h_data, (_, relationship) in zip(records, items)]
+        lines = [dump_line(entry) + "\n" for entry in entries]
+        with self._own_write(user.username, records):
+            before = self.version()
+            with open(self._segment_path(self._active_segment()), "a") as f:
+                f.write("".join(lines))
+            if self._read_cache is not None and self._read_cache[0] == before:
+                # Keep the parsed store current instead of parsing it all again on the next page
+                for entry in entries:
+                    self._apply_record(self._read_cache[1], entry)
+                self._read_cache = (self.version(), self._read_cache[1])
+
+            self._journal_records += len(items)
+            if self._journal_records >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """
+        Fold all journal segments into the snapshot.
+        New appends go to a fresh segment first, so nothing written meanwhile is lost.
+        """
+        with self._own_write():
+            folded, next_segment = self._rotate_journal()
+
+            data = self._load_snapshot()
+            data.setdefault("users", {})
+            for segment in folded:
+                if segment >= data.get("journal_segment", 0):
+                    self._replay_segment(data, segment)
+            expired_files = self._apply_retention(data)
+            self._commit_snapshot(data, folded, next_segment)
+            # Only drop cold files once the snapshot no longer points at them
+            self._remove_cold_files(expired_files)
+            if self.retention.expire_after_days is not None:
+                self._search.drop() # history may have expired: rebuild on the next search
+
+    def _rotate_journal(self):
+        folded = self._list_segments()
+        next_segment = (folded[-1] + 1) if folded else 1
+        open(self._segment_path(next_segment), "a").close()
+        return folded, next_segment
+
+    def _commit_snapshot(self, data: dict, folded: List[int], next_segment: int):
+        data["journal_segment"] = next_segment
+        self._save_data(data)
+        for segment in folded:
+            os.remove(self._segment_path(segment))
+        self._journal_records = 0
+
+    # --- Retention ---
+
+    def _apply_retention(self, data: dict) -> List[str]:
+        """
+        Spills old hot history into cold segments and folds expired interactions
+        into memory.history_stats. Returns cold files that are no longer referenced.
+        """
+        policy = self.retention
+        cutoff = policy.expired_before()
+        cutoff_iso = cutoff.isoformat() if cutoff else None
+        expired_files = []
+
+        for username, u_data in data["users"].items():
+            memory = u_data.setdefault("memory", {})
+            history = memory.get("history", [])
+            cold = memory.setdefault("cold_segments", [])
+
+            while policy.should_spill(len(history)):
+                chunk, history = history[:policy.segment_size], history[policy.segment_size:]
+                cold.append(self._write_cold_segment(username, chunk))
+
+            if cutoff_iso:
+                stats = memory.setdefault("history_stats", {})
+                while cold and cold[0]["last"] < cutoff_iso:
+                    segment = cold.pop(0)
+                    for h_data in self._read_cold_segment(segment):
+                        fold_record(stats, h_data)
+                    expired_files.append(segment["file"])
+                kept = []
+                for h_data in history:
+                    if h_data.get("timestamp", "") < cutoff_iso:
+                        fold_record(stats, h_data)
+                    else:
+                        kept.append(h_data)
+                history = kept
+
+            memory["history"] = history
+        return expired_files
+
+    def _write_cold_segment(self, username: str, records: List[dict]) -> dict:
+        os.makedirs(self.cold_dir, exist_ok=True)
+        user_hash = hashlib.sha256(username.encode()).hexdigest()[:16]
+        name = f"{user_hash}.{time.time_ns()}.jsonl.gz"
+        tmp_path = os.path.join(self.cold_dir, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(encode_records(records, self.serializer))
+        os.replace(tmp_path, os.path.join(self.cold_dir, name))
+
+        meta = segment_meta(records)
+        meta["file"] = name
+        return meta
+
+    def _read_cold_segment(self, segment: dict) -> List[dict]:
+        try:
+            with open(os.path.join(self.cold_dir, segment["file"]), "rb") as f:
+                return decode_records(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable cold segment %s: %s", segment["file"], e)
+            return []
+
+    def _remove_cold_files(self, files: List[str]):
+        for name in files:
+            try:
+                os.remove(os.path.join(self.cold_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def export_data(self) -> dict:
+        """
+        The whole store with cold segments inlined back into each user's history (for migrations).
+        """
+        with self._store_lock:
+            data = self._load_data()
+            for u_data in data["users"].values():
+                memory = u_data.get("memory", {})
+                cold_records = []
+                for segment in memory.pop("cold_segments", []):
+                    cold_records += self._read_cold_segment(segment)
+                memory["history"] = cold_records + memory.get("history", [])
+        return data
 
     # --- User Management ---
 
@@ -47,107 +349,235 @@ class Repository:
         
         # Contacts
         for c in u_data.get("contacts", []):
-            user.contacts.append(Contact(name=c["name"], relationship=c["relationship"], description=c.get("description", "")))
+            user.add_contact(Contact(name=c["name"], relationship=c["relationship"], description=c.get("description", "")))
             
         # Memory
         mem_data = u_data.get("memory", {})
         user.memory.relationship_preferences = mem_data.get("relationship_preferences", {})
+        user.memory.history_stats = mem_data.get("history_stats", {})
         
-        # Load History
-        for h_data in mem_data.get("history", []):
-            try:
-                # Reconstruct Message
-                orig_data = h_data["original_message"]
-                msg = Message(
-                    content=orig_data["content"],
-                    recipient_name=orig_data["recipient"],
-                    recipient_relationship="", # Not stored in v2 history schema explicitly, can infer or leave empty
-                    intended_tone=Tone(orig_data["tone"])
-                )
-                
-                # Reconstruct RefinedMessage (Partial)
-                ref_msg = RefinedMessage(
-                    original_message=msg,
-                    suggested_content=h_data["refined_suggestion"],
-                    reasoning="", # Not stored
-                    changes_made=[] # Not stored
-                )
-                
-                # Reconstruct Interaction
-                interaction = Interaction(
-                    message=msg,
-                    refined_message=ref_msg,
-                    accepted=h_data["accepted"],
-                    final_content=h_data["final_content"],
-                    timestamp=datetime.fromisoformat(h_data["timestamp"])
-                )
-                user.memory.history.append(interaction)
-            except Exception as e:
-                # robust against malformed history entries
-                pass
+        # History is loaded page by page, only when someone looks at it
+        self._attach_history(user)
         
         return user
 
+    def _attach_history(self, user: AppUser):
+        # Look the name up at call time: change_username renames the same AppUser object
+        user.memory.history = HistoryView(
+            loader=lambda before, limit, recipient, skip: self.load_history(user.username, before, limit, recipient, skip),
+            recipients_loader=lambda: self.history_recipients(user.username),
+            searcher=lambda query, limit: self.search_history(user.username, query, limit)
+        )
+
+    def _stored_memory(self, username: str) -> dict:
+        return self._read_data()["users"].get(username, {}).get("memory", {})
+
+    def load_history(self, username: str, before: datetime, limit: int, recipient: Optional[str] = None,
+                     skip: Optional[int] = None) -> List[Interaction]:
+        """
+        Newest-first interactions older than `before`, optionally for one recipient. With `skip`
+        set, those at exactly `before` count too, minus the first `skip` of them (see HistoryCursor).
+        Hot history first, then cold segments (newest first) as far as the page needs.
+        Only the returned page is turned into domain objects.
+        """
+        before_iso = before.isoformat()
+        page = []
+        # Held until the cold segments are read too, so retention can't remove them under us
+        with self._store_lock:
+            memory = self._stored_memory(username)
+            # Stored history is append-only, so it is already in time order
+            skip = self._collect_page(reversed(memory.get("history", [])), page, before_iso, limit, recipient, skip)
+
+            for segment in reversed(memory.get("cold_segments", [])):
+                if len(page) >= limit:
+                    break
+                if segment["first"] > before_iso or (segment["first"] == before_iso and skip is None):
+                    continue
+                if recipient is not None and recipient not in segment["recipients"]:
+                    continue
+                skip = self._collect_page(reversed(self._read_cold_segment(segment)), page, before_iso, limit, recipient, skip)
+        return page
+
+    def _collect_page(self, records, page: List[Interaction], before_iso: str, limit: int, recipient: Optional[str],
+                      skip: Optional[int] = None) -> Optional[int]:
+        """
+        Appends the matching records to `page`; returns how many ties at `before_iso` are still to skip.
+        """
+        for h_data in records:
+            if len(page) >= limit:
+                break
+            try:
+                timestamp = h_data.get("timestamp", "")
+                if timestamp > before_iso or (timestamp == before_iso and skip is None):
+                    continue
+                if recipient is not None and h_data.get("original_message", {}).get("recipient") != recipient:
+                    continue
+                if timestamp == before_iso and skip > 0:
+                    skip -= 1 # already on an earlier page
+                    continue
+                page.append(self._interaction_from_dict(h_data))
+            except CodecError as e:
+                # one bad entry shouldn't hide the rest of the history
+                logger.warning("Skipping malformed history entry: %s", e)
+        return skip
+
+    # --- Search ---
+
+    def search_history(self, username: str, query: SearchQuery, limit: int = 20) -> List[SearchHit]:
+        """
+        Ranked full-text search over the user's whole history, hot and cold (see domain/search.py).
+        The index is built on the first search and then updated as interactions are appended.
+        """
+        return self._search_hits(self._search.search(
+            username, self.version(), lambda: self._history_records(username), query, limit
+        ))
+
+    def _history_records(self, username: str) -> Iterable[dict]:
+        # Oldest first: cold segments, then hot history
+        with self._store_lock:
+            memory = self._stored_memory(username)
+            records = []
+            for segment in memory.get("cold_segments", []):
+                records += self._read_cold_segment(segment)
+            return records + memory.get("history", [])
+
+    def _search_hits(self, matches: List[Tuple[dict, float]]) -> List[SearchHit]:
+        hits = []
+        for h_data, score in matches:
+            try:
+                hits.append(SearchHit(interaction=self._interaction_from_dict(h_data), score=score))
+            except CodecError as e:
+                logger.warning("Skipping malformed history entry: %s", e)
+        return hits
+
+    def history_recipients(self, username: str) -> List[str]:
+        memory = self._stored_memory(username)
+        names = set()
+        for h_data in memory.get("history", []):
+            try:
+                names.add(h_data["original_message"]["recipient"])
+            except (KeyError, TypeError):
+                pass
+        for segment in memory.get("cold_segments", []):
+            names.update(segment["recipients"])
+        return sorted(names)
+
     def save_user(self, user: AppUser):
-        data = self._load_data()
-        
-        # Serialize User
-        user_dict = {
-            "email": user.email,
-            "password_hash": user.password_hash,
-            "self_context": user.self_context,
-            "contacts": [
-                {"name": c.name, "relationship": c.relationship, "description": c.description}
-                for c in user.contacts
-            ],
-            "memory": {
-                "relationship_preferences": user.memory.relationship_preferences,
-                "history": [self._interaction_to_dict(i) for i in user.memory.history]
-                # Note: This appends history every time. 
-                # Optimization: In a real app we wouldn't rewrite the whole history array every save.
+        # Load, change and commit under one lock, or an append landing in between would be lost
+        with self._store_lock:
+            data = self._load_data()
+            stored = data["users"].get(user.username, {}).get("memory", {})
+
+            # Serialize User
+            user_dict = {
+                "email": user.email,
+                "password_hash": user.password_hash,
+                "self_context": user.self_context,
+                "contacts": [
+                    {"name": c.name, "relationship": c.relationship, "description": c.description}
+                    for c in user.contacts
+                ],
+                "memory": {
+                    "relationship_preferences": user.memory.relationship_preferences,
+                    # History (hot and cold) and its counters are owned by storage, keep what is stored
+                    "history": stored.get("history", []),
+                    "cold_segments": stored.get("cold_segments", []),
+                    "history_stats": stored.get("history_stats", {})
+                }
             }
-        }
-        
-        data["users"][user.username] = user_dict
-        self._save_data(data)
 
-    def _interaction_to_dict(self, interaction: Interaction) -> dict:
-        return {
-            "timestamp": interaction.timestamp.isoformat(),
-            "accepted": interaction.accepted,
-            "final_content": interaction.final_content,
-            "original_message": {
-                "content": interaction.message.content,
-                "recipient": interaction.message.recipient_name,
-                "tone": interaction.message.intended_tone.value
-            },
-            "refined_suggestion": interaction.refined_message.suggested_content
-        }
+            data["users"][user.username] = user_dict
+            self._save_snapshot(data)
+
+    # Strict, schema-versioned record codec (see infrastructure/codec.py)
+    _interaction_to_dict = staticmethod(interaction_to_record)
+    _interaction_from_dict = staticmethod(interaction_from_record)
 
     @staticmethod
     def hash_password(password: str) -> str:
         return hashlib.sha256(password.encode()).hexdigest()
 
     def update_username(self, old_username: str, new_username: str) -> bool:
-        data = self._load_data()
-        users = data.get("users", {})
-        
-        if new_username in users:
-            return False # Taken
-        
-        if old_username not in users:
-            return False # Old doesn't exist?
-            
-        # Swap
-        user_data = users[old_username]
-        users[new_username] = user_data
-        del users[old_username]
-        
-        self._save_data(data)
+        with self._store_lock:
+            data = self._load_data()
+            users = data.get("users", {})
+
+            if new_username in users:
+                return False # Taken
+
+            if old_username not in users:
+                return False # Old doesn't exist?
+
+            # Swap
+            user_data = users[old_username]
+            users[new_username] = user_data
+            del users[old_username]
+
+            self._save_snapshot(data)
+            self._search.rename(old_username, new_username)
         return True
 
     def delete_user(self, username: str):
-        data = self._load_data()
-        if username in data.get("users", {}):
-            del data["users"][username]
-            self._save_data(data)
+        with self._store_lock:
+            data = self._load_data()
+            if username in data.get("users", {}):
+                cold = data["users"][username].get("memory", {}).get("cold_segments", [])
+                del data["users"][username]
+                self._save_snapshot(data)
+                self._search.drop(username)
+                self._remove_cold_files([segment["file"] for segment in cold])
+
+    def _save_snapshot(self, data: dict):
+        """
+        Full rewrite of data loaded via _load_data(): the journal is already
+        contained in it, so the folded segments can go. Load and save under
+        the same _store_lock hold, or appends made in between are dropped.
+        """
+        with self._own_write():
+            folded, next_segment = self._rotate_journal()
+            self._commit_snapshot(data, folded, next_segment)
+
+
+# --- Backend Selection ---
+
+DEFAULT_JSON_PATH = "d:/Diplomat/users_v2.json"
+DEFAULT_SQLITE_PATH = "d:/Diplomat/users_v2.db"
+DEFAULT_SHARD_ROOT = "d:/Diplomat/users"
+
+_shared_repository = None
+
+def get_repository() -> Repository:
+    """
+    Process-wide repository: the configured backend behind one shared user cache,
+    so AgentService and DiplomatAgent don't each parse the store on every call.
+    """
+    global _shared_repository
+    if _shared_repository is None:
+        from infrastructure.cached_repository import CachedRepository
+        _shared_repository = CachedRepository(
+            create_repository(),
+            capacity=int(os.getenv("DIPLOMAT_CACHE_SIZE", "256")),
+            flush_interval=float(os.getenv("DIPLOMAT_FLUSH_INTERVAL", "2.0")),
+            batch_size=int(os.getenv("DIPLOMAT_WRITE_BATCH", "50")),
+            max_pending=int(os.getenv("DIPLOMAT_WRITE_QUEUE", "1000"))
+        )
+    return _shared_repository
+
+def create_repository(backend: Optional[str] = None, storage_path: Optional[str] = None) -> Repository:
+    """
+    Builds the storage backend picked by DIPLOMAT_STORAGE ("json", "sqlite" or "sharded").
+    DIPLOMAT_STORAGE_PATH overrides the file (or, for "sharded", directory) location.
+    """
+    backend = (backend or os.getenv("DIPLOMAT_STORAGE", "json")).lower()
+    storage_path = storage_path or os.getenv("DIPLOMAT_STORAGE_PATH")
+    retention = RetentionPolicy.from_env()
+
+    if backend == "json":
+        return Repository(storage_path or DEFAULT_JSON_PATH, retention=retention)
+    if backend == "sqlite":
+        from infrastructure.sqlite_repository import SQLiteRepository
+        return SQLiteRepository(storage_path or DEFAULT_SQLITE_PATH, retention=retention)
+    if backend == "sharded":
+        from infrastructure.sharded_repository import ShardedRepository
+        return ShardedRepository(storage_path or DEFAULT_SHARD_ROOT, retention=retention)
+    raise ValueError(f"Unknown storage backend: {backend}")
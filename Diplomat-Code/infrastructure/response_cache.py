@@ -0,0 +1,127 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+class ResponseCache:
+    """
+    Two-level cache for LLM responses: an in-memory LRU in front of a small SQLite file.
+    Entries expire after `ttl_seconds`; both levels are capped by entry count.
+    """
+    def __init__(self, path: Optional[str] = None, ttl_seconds: float = 7 * 24 * 3600,
+                 memory_entries: int = 512, disk_entries: int = 10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict() # key -> (expires_at, value)
+        self._local = threading.local()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if self.path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses(expires_at)")
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """
+        DIPLOMAT_LLM_CACHE_PATH (empty = memory only), DIPLOMAT_LLM_CACHE_TTL (seconds).
+        """
+        return cls(
+            path=os.getenv("DIPLOMAT_LLM_CACHE_PATH", "d:/Diplomat/llm_cache.db") or None,
+            ttl_seconds=float(os.getenv("DIPLOMAT_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Keys ---
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        # Whitespace-only differences (trailing spaces, CRLF, padding) shouldn't miss the cache
+        text = text.replace("\r\n", "\n").strip()
+        return "\n".join(re.sub(r"[ \t]+", " ", line).strip() for line in text.split("\n"))
+
+    @classmethod
+    def make_key(cls, *parts: str) -> str:
+        normalized = "\x1f".join(cls._normalize(p or "") for p in parts)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    # --- Lookup ---
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+        if self.path:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                with self._lock:
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                return row[0]
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value: str):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self.stats["writes"] += 1
+
+        if self.path:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                # Size cap: drop expired rows, then the ones closest to expiring
+                conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+                excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.disk_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires_at LIMIT ?)",
+                        (excess,)
+                    )
+
+    def _remember(self, key: str, expires_at: float, value: str):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM responses")
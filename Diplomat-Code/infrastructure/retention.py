@@ -0,0 +1,60 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Dict, List
+from datetime import datetime, timedelta
+
+@dataclass
+class RetentionPolicy:
+    """
+    How much history a user keeps in the hot store.
+    The newest `hot_limit` interactions stay hot; older ones move to compressed
+    cold segments of `segment_size` records. Interactions older than
+    `expire_after_days` are folded into per-relationship counters and dropped.
+    """
+    hot_limit: int = 500
+    segment_size: int = 500
+    expire_after_days: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        expire = os.getenv("DIPLOMAT_HISTORY_EXPIRE_DAYS")
+        return cls(
+            hot_limit=int(os.getenv("DIPLOMAT_HOT_HISTORY", "500")),
+            segment_size=int(os.getenv("DIPLOMAT_COLD_SEGMENT_SIZE", "500")),
+            expire_after_days=int(expire) if expire else None
+        )
+
+    def should_spill(self, hot_count: int) -> bool:
+        # Spill whole segments only, so hot history stays between hot_limit and hot_limit + segment_size
+        return hot_count >= self.hot_limit + self.segment_size
+
+    def expired_before(self) -> Optional[datetime]:
+        if self.expire_after_days is None:
+            return None
+        return datetime.now() - timedelta(days=self.expire_after_days)
+
+# --- Aggregate Counters ---
+
+def fold_into_stats(stats: Dict[str, Dict[str, Dict[str, int]]], relationship: str, tone: str, accepted: bool):
+    """
+    stats[relationship][tone] = {"accepted": n, "rejected": m}
+    """
+    counters = stats.setdefault(relationship or "Unknown", {}).setdefault(tone, {"accepted": 0, "rejected": 0})
+    counters["accepted" if accepted else "rejected"] += 1
+
+def fold_record(stats: dict, h_data: dict):
+    orig = h_data.get("original_message", {})
+    fold_into_stats(stats, orig.get("relationship", ""), orig.get("tone", ""), bool(h_data.get("accepted")))
+
+# --- Cold Segments ---
+
+def segment_meta(records: List[dict]) -> dict:
+    """
+    Index entry kept in the hot store, so paging and filters can skip segments without opening them.
+    """
+    return {
+        "first": records[0]["timestamp"],
+        "last": records[-1]["timestamp"],
+        "count": len(records),
+        "recipients": sorted(set(r.get("original_message", {}).get("recipient", "") for r in records))
+    }
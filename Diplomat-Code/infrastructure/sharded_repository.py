@@ -0,0 +1,219 @@
+import os
+import glob
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple, Iterable
+from datetime import datetime
+from domain.models import AppUser, Interaction, SearchHit
+from domain.search import SearchQuery
+from infrastructure.repository import Repository
+from infrastructure.retention import RetentionPolicy
+from infrastructure.history_search import SearchIndexCache
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+class ShardedRepository(Repository):
+    """
+    One small JSON store (snapshot + journal, see Repository) per user, spread over
+    a hashed directory tree: <root>/<h[:2]>/<h>.json with h = sha256(username).
+    Writes take a per-user lock (thread + file lock), so users never contend with each other
+    and a save only rewrites that user's bytes.
+    """
+    def __init__(self, root: str = "d:/Diplomat/users", compact_every: int = 200,
+                 retention: Optional[RetentionPolicy] = None):
+        self.root = root
+        self.compact_every = compact_every
+        self.retention = retention or RetentionPolicy()
+        self._version_path = os.path.join(root, ".version")
+        os.makedirs(root, exist_ok=True)
+        open(self._version_path, "a").close()
+
+        self._locks_guard = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+        # Search indexes live here: shard Repository objects are short-lived
+        self._search = SearchIndexCache()
+
+    # --- Shards ---
+
+    def _shard_path(self, username: str) -> str:
+        h = hashlib.sha256(username.encode()).hexdigest()
+        return os.path.join(self.root, h[:2], h + ".json")
+
+    def _shard(self, username: str, create: bool = False) -> Optional[Repository]:
+        path = self._shard_path(username)
+        if not create and not os.path.exists(path):
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return Repository(path, compact_every=self.compact_every, retention=self.retention)
+
+    def _remove_shard(self, username: str):
+        path = self._shard_path(username)
+        shard_files = [path] + glob.glob(glob.escape(os.path.splitext(path)[0]) + ".journal.*.jsonl")
+        cold_dir = os.path.splitext(path)[0] + ".cold"
+        shard_files += glob.glob(os.path.join(glob.escape(cold_dir), "*"))
+        for p in shard_files:
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+        if os.path.isdir(cold_dir):
+            os.rmdir(cold_dir)
+
+    @contextmanager
+    def _user_lock(self, username: str):
+        with self._locks_guard:
+            lock = self._locks.setdefault(username, threading.Lock())
+        with lock:
+            path = self._shard_path(username)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Cross-process part: other app instances writing the same user
+            with open(path + ".lock", "a+") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextmanager
+    def _read_shard(self, username: str):
+        # Readers take the user's lock too: an append can compact away the journal segment being replayed
+        if not os.path.exists(self._shard_path(username)):
+            yield None # don't leave lock files behind for users that don't exist
+            return
+        with self._user_lock(username):
+            yield self._shard(username)
+
+    @contextmanager
+    def _shard_write(self, shard: Repository, username: str, records: Iterable[dict] = ()):
+        # Caller holds the user's lock. The shard's own version() tracks the user's search index.
+        before = shard.version()
+        yield
+        self._search.advance(before, shard.version(), username, records)
+
+    def _touch_version(self):
+        os.utime(self._version_path)
+
+    def version(self) -> tuple:
+        # Every write touches <root>/.version, so one stat covers the whole tree
+        try:
+            return (os.stat(self._version_path).st_mtime_ns,)
+        except OSError:
+            return (None,)
+
+    # --- User Management ---
+
+    def get_user(self, username: str) -> Optional[AppUser]:
+        with self._read_shard(username) as shard:
+            user = shard.get_user(username) if shard else None
+        if user is not None:
+            # Route history through this repository so it follows a rename
+            self._attach_history(user)
+        return user
+
+    def save_user(self, user: AppUser):
+        with self._user_lock(user.username):
+            shard = self._shard(user.username, create=True)
+            with self._shard_write(shard, user.username):
+                shard.save_user(user)
+        self._touch_version()
+
+    def append_interactions(self, user: AppUser, items: List[Tuple[Interaction, str]]):
+        records = [self._interaction_to_dict(interaction) for interaction, _ in items]
+        with self._user_lock(user.username):
+            shard = self._shard(user.username, create=True)
+            with self._shard_write(shard, user.username, records):
+                shard.append_interactions(user, items)
+            if shard._journal_records == 0 and self.retention.expire_after_days is not None:
+                self._search.drop(user.username) # the append compacted the shard, history may have expired
+        self._touch_version()
+
+    def load_history(self, username: str, before: datetime, limit: int, recipient: Optional[str] = None,
+                     skip: Optional[int] = None) -> List[Interaction]:
+        with self._read_shard(username) as shard:
+            return shard.load_history(username, before, limit, recipient, skip) if shard else []
+
+    def history_recipients(self, username: str) -> List[str]:
+        with self._read_shard(username) as shard:
+            return shard.history_recipients(username) if shard else []
+
+    def search_history(self, username: str, query: SearchQuery, limit: int = 20) -> List[SearchHit]:
+        with self._read_shard(username) as shard:
+            if shard is None:
+                return []
+            version = shard.version()
+        # The index (if it has to be built) reads the history under the lock again, see _history_records
+        return self._search_hits(self._search.search(
+            username, version, lambda: self._history_records(username), query, limit
+        ))
+
+    def _history_records(self, username: str) -> Iterable[dict]:
+        with self._read_shard(username) as shard:
+            return shard._history_records(username) if shard else []
+
+    def update_username(self, old_username: str, new_username: str) -> bool:
+        if old_username == new_username:
+            return False
+        # Fixed lock order so two concurrent renames can't deadlock
+        first, second = sorted([old_username, new_username])
+        with self._user_lock(first), self._user_lock(second):
+            if self._shard(new_username) is not None:
+                return False # Taken
+            old_shard = self._shard(old_username)
+            if old_shard is None:
+                return False # Old doesn't exist?
+
+            data = old_shard._load_data()
+            new_shard = self._shard(new_username, create=True)
+            if os.path.isdir(old_shard.cold_dir):
+                # Cold segments are referenced by file name, so they just move along
+                os.replace(old_shard.cold_dir, new_shard.cold_dir)
+            new_shard._save_snapshot({"users": {new_username: data["users"][old_username]}})
+            self._remove_shard(old_username)
+            self._search.drop(old_username) # the new shard has its own files (and version)
+        self._touch_version()
+        return True
+
+    def delete_user(self, username: str):
+        with self._user_lock(username):
+            self._remove_shard(username)
+            self._search.drop(username)
+        self._touch_version()
+
+    def compact(self):
+        for path in glob.glob(os.path.join(glob.escape(self.root), "*", "*.json")):
+            shard = Repository(path, compact_every=self.compact_every, retention=self.retention)
+            for username in shard._load_snapshot().get("users", {}):
+                with self._user_lock(username):
+                    with self._shard_write(shard, username):
+                        shard.compact()
+                    if self.retention.expire_after_days is not None:
+                        self._search.drop(username)
+
+    # --- Migration ---
+
+    def import_json_data(self, data: dict) -> int:
+        """
+        Splits a users_v2.json document into one shard per user. Returns the number of users imported.
+        """
+        count = 0
+        for username, u_data in data.get("users", {}).items():
+            with self._user_lock(username):
+                self._remove_shard(username)
+                self._shard(username, create=True)._save_snapshot({"users": {username: u_data}})
+                self._search.drop(username)
+            count += 1
+        self._touch_version()
+        return count
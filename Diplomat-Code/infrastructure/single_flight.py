@@ -0,0 +1,248 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException = None
+        self.callers = 1
+
+class _SharedStream:
+    """
+    One underlying stream, any number of readers. A pump thread pulls the upstream into a
+    buffer, so it advances whether or not anyone is reading right now; every reader gets
+    every chunk from the start. When the stream ends (or fails) or its last reader detaches,
+    on_finish removes it from the flight, so nobody joins a finished or abandoned stream.
+    """
+    def __init__(self, iterator: Iterator):
+        self._iterator = iterator
+        self.on_finish: Callable[[], None] = None
+        self.callers = 0
+        self._readers = 0
+        self._cond = threading.Condition()
+        self._chunks = []
+        self._finished = False
+        self._abandoned = False
+        self._forgotten = False
+        self._error: BaseException = None
+
+    def start(self):
+        threading.Thread(target=self._pump, name="single-flight-stream", daemon=True).start()
+
+    def _pump(self):
+        try:
+            for chunk in self._iterator:
+                with self._cond:
+                    if self._abandoned:
+                        break
+                    self._chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._error = e
+        finally:
+            if self._abandoned:
+                close = getattr(self._iterator, "close", None)
+                if close is not None:
+                    close() # nobody is listening: stop the model call
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+            self._forget()
+
+    def attach(self) -> bool:
+        with self._cond:
+            if self._abandoned:
+                return False
+            self._readers += 1
+            self.callers += 1
+            return True
+
+    def detach(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers > 0 or self._finished:
+                return
+            self._abandoned = True
+            self._chunks = []
+        self._forget()
+
+    def _forget(self):
+        # Outside self._cond: on_finish takes the flight's lock, which is held around attach()
+        with self._cond:
+            if self._forgotten:
+                return
+            self._forgotten = True
+        if self.on_finish is not None:
+            self.on_finish()
+
+    def get(self, i: int):
+        """
+        Chunk `i`, waiting for the pump if needed; StopIteration at the end.
+        """
+        with self._cond:
+            while i >= len(self._chunks) and not self._finished:
+                self._cond.wait()
+            if i < len(self._chunks):
+                return self._chunks[i]
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+
+class _StreamReader:
+    """
+    One caller's view of a _SharedStream. Detaches when exhausted, on close()
+    (e.g. a generator doing `yield from` it is closed) or when garbage collected.
+    """
+    def __init__(self, shared: _SharedStream):
+        self._shared = shared
+        self._position = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            chunk = self._shared.get(self._position)
+        except BaseException:
+            self.close()
+            raise
+        self._position += 1
+        return chunk
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._shared.detach()
+
+    def __del__(self):
+        self.close()
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution and its result (or exception).
+    stats: "calls" = executions, "merged" = callers served by someone else's execution.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"calls": 0, "merged": 0, "max_callers": 1}
+
+    def _merged(self, callers: int):
+        self.stats["merged"] += 1
+        self.stats["max_callers"] = max(self.stats["max_callers"], callers)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["calls"] += 1
+            else:
+                call.callers += 1
+                self._merged(call.callers)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterator]) -> Iterator:
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is not None and shared.attach():
+                self._merged(shared.callers)
+            else:
+                self.stats["calls"] += 1
+                shared = self._streams[key] = _SharedStream(iter(fn()))
+                shared.on_finish = lambda: self._forget_stream(key, shared)
+                shared.attach()
+                shared.start()
+        return _StreamReader(shared)
+
+    def _forget_stream(self, key: Hashable, shared: _SharedStream):
+        # Late arrivals start a fresh call (usually a cache hit)
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key) # tasks can't be awaited from another event loop
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is not None:
+                task.callers += 1
+                self._merged(task.callers)
+            else:
+                self.stats["calls"] += 1
+                task = self._tasks[task_key] = loop.create_task(fn())
+                task.callers = 1
+                task.add_done_callback(lambda t: self._forget_task(task_key, t))
+        # Shielded: one cancelled caller must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget_task(self, task_key, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(task_key) is task:
+                del self._tasks[task_key]
+
+class SingleFlightProvider:
+    """
+    LLMProvider wrapper: identical concurrent requests (same method and arguments, e.g. two
+    sessions or a double click) share one model call. Metrics are in `flight.stats`.
+    """
+    def __init__(self, provider, flight: SingleFlight = None):
+        self.provider = provider
+        self.flight = flight or SingleFlight()
+
+    def __getattr__(self, name):
+        # model_name, cache, stats, ... of the wrapped provider
+        return getattr(self.provider, name)
+
+    def refine_message(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        args = (original_content, target_tone, channel, context_notes, use_cache)
+        return self.flight.do(("refine",) + args, lambda: self.provider.refine_message(*args))
+
+    def refine_message_stream(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        args = (original_content, target_tone, channel, context_notes, use_cache)
+        return self.flight.stream(("refine_stream",) + args, lambda: self.provider.refine_message_stream(*args))
+
+    def refine_and_explain(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        args = (original_content, target_tone, channel, context_notes, use_cache)
+        return self.flight.do(("combined",) + args, lambda: self.provider.refine_and_explain(*args))
+
+    def explain_changes(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        args = (original, refined, tone, use_cache)
+        return self.flight.do(("explain",) + args, lambda: self.provider.explain_changes(*args))
+
+    async def refine_message_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True) -> str:
+        args = (original_content, target_tone, channel, context_notes, use_cache)
+        return await self.flight.do_async(("refine",) + args, lambda: self.provider.refine_message_async(*args))
+
+    async def refine_and_explain_async(self, original_content: str, target_tone: str, channel: str, context_notes: str, use_cache: bool = True):
+        args = (original_content, target_tone, channel, context_notes, use_cache)
+        return await self.flight.do_async(("combined",) + args, lambda: self.provider.refine_and_explain_async(*args))
+
+    async def explain_changes_async(self, original: str, refined: str, tone: str, use_cache: bool = True) -> str:
+        args = (original, refined, tone, use_cache)
+        return await self.flight.do_async(("explain",) + args, lambda: self.provider.explain_changes_async(*args))
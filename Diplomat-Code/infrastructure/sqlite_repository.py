@@ -0,0 +1,509 @@
+import json
+import os
+import logging
+import sqlite3
+import threading
+from typing import Optional, List, Tuple, Iterable
+from datetime import datetime
+from domain.models import AppUser, Interaction, Contact, SearchHit
+from domain.search import SearchQuery, parse_query
+from infrastructure.repository import Repository
+from infrastructure.history_search import SearchIndexCache
+from infrastructure.retention import RetentionPolicy, fold_record, segment_meta
+from infrastructure.codec import CodecError, get_serializer, encode_records, decode_records, interaction_from_record
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL DEFAULT '',
+    password_hash TEXT NOT NULL DEFAULT '',
+    self_context TEXT NOT NULL DEFAULT '',
+    relationship_preferences TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    relationship TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_contacts_user ON contacts(user_id, position);
+
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    timestamp TEXT NOT NULL,
+    accepted INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    relationship TEXT NOT NULL DEFAULT '',
+    tone TEXT NOT NULL,
+    channel TEXT NOT NULL DEFAULT '',
+    refined_suggestion TEXT NOT NULL,
+    final_content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_interactions_user_time ON interactions(user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_interactions_user_recipient_time ON interactions(user_id, recipient, timestamp);
+
+-- Cold history: gzip'd JSONL blobs of `segment_size` interactions each
+CREATE TABLE IF NOT EXISTS history_segments (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    first_ts TEXT NOT NULL,
+    last_ts TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    recipients TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_segments_user_time ON history_segments(user_id, last_ts);
+"""
+
+# Search corpus: every interaction, hot and cold, so history stays searchable after retention moves
+# it into compressed segments. history_fts is an FTS5 index over its text (external content, kept
+# in step by the triggers); filters and the no-text case use the plain (user_id, timestamp) index.
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_docs (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    timestamp TEXT NOT NULL,
+    accepted INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    relationship TEXT NOT NULL DEFAULT '',
+    tone TEXT NOT NULL,
+    channel TEXT NOT NULL DEFAULT '',
+    refined_suggestion TEXT NOT NULL,
+    final_content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_docs_user_time ON history_docs(user_id, timestamp);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    content, refined_suggestion, final_content,
+    content = 'history_docs', content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS history_docs_insert AFTER INSERT ON history_docs BEGIN
+    INSERT INTO history_fts (rowid, content, refined_suggestion, final_content)
+    VALUES (new.id, new.content, new.refined_suggestion, new.final_content);
+END;
+CREATE TRIGGER IF NOT EXISTS history_docs_delete AFTER DELETE ON history_docs BEGIN
+    INSERT INTO history_fts (history_fts, rowid, content, refined_suggestion, final_content)
+    VALUES ('delete', old.id, old.content, old.refined_suggestion, old.final_content);
+END;
+"""
+
+# Columns added after the first release, created on open if the database predates them
+COLUMN_MIGRATIONS = [
+    ("users", "history_stats", "TEXT NOT NULL DEFAULT '{}'"),
+]
+
+class SQLiteRepository(Repository):
+    """
+    Same interface as the JSON Repository, but every lookup is an indexed query
+    instead of a full-file parse. History search runs on SQLite FTS5 when the
+    sqlite3 build has it, otherwise on the in-memory index the file stores use.
+    """
+    def __init__(self, storage_path: str = "d:/Diplomat/users_v2.db", retention: Optional[RetentionPolicy] = None):
+        self.storage_path = storage_path
+        self.retention = retention or RetentionPolicy()
+        self.serializer = get_serializer()
+        # sqlite3 connections can't be shared across threads (Streamlit runs sessions on several)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            for table, column, definition in COLUMN_MIGRATIONS:
+                existing = [r["name"] for r in conn.execute(f"PRAGMA table_info({table})")]
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            self.fts = self._setup_fts(conn)
+        self._search = SearchIndexCache() # fallback without FTS5
+
+    def _setup_fts(self, conn: sqlite3.Connection) -> bool:
+        existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_fts'").fetchone() is not None
+        try:
+            conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite FTS5 not available, history search uses an in-memory index: %s", e)
+            return False
+        if not existed:
+            # Database from before search: index what is already there
+            for row in conn.execute("SELECT id FROM users").fetchall():
+                for record in self._history_records(row["id"], conn):
+                    self._index_record(conn, row["id"], record)
+        return True
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.storage_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def version(self) -> tuple:
+        parts = []
+        for path in (self.storage_path, self.storage_path + "-wal"):
+            try:
+                st = os.stat(path)
+                parts.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                parts.append(None)
+        return tuple(parts)
+
+    def _user_id(self, conn: sqlite3.Connection, username: str) -> Optional[int]:
+        row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        return row["id"] if row else None
+
+    # --- User Management ---
+
+    def get_user(self, username: str) -> Optional[AppUser]:
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+
+        user = AppUser(
+            username=row["username"],
+            email=row["email"],
+            password_hash=row["password_hash"],
+            self_context=row["self_context"]
+        )
+
+        for c in conn.execute(
+            "SELECT name, relationship, description FROM contacts WHERE user_id = ? ORDER BY position",
+            (row["id"],)
+        ):
+            user.add_contact(Contact(name=c["name"], relationship=c["relationship"], description=c["description"]))
+
+        user.memory.relationship_preferences = json.loads(row["relationship_preferences"])
+        user.memory.history_stats = json.loads(row["history_stats"])
+
+        # History is loaded page by page, only when someone looks at it
+        self._attach_history(user)
+
+        return user
+
+    def load_history(self, username: str, before: datetime, limit: int, recipient: Optional[str] = None,
+                     skip: Optional[int] = None) -> List[Interaction]:
+        conn = self._connect()
+        user_id = self._user_id(conn, username)
+        if user_id is None:
+            return []
+
+        before_iso = before.isoformat()
+        # With `skip`, rows at exactly `before` count too; they come first in this order
+        query = f"SELECT * FROM interactions WHERE user_id = ? AND timestamp {'<' if skip is None else '<='} ?"
+        params = [user_id, before_iso]
+        if recipient is not None:
+            query += " AND recipient = ?"
+            params.append(recipient)
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit + (skip or 0))
+
+        page = []
+        for h in conn.execute(query, params):
+            if len(page) >= limit:
+                break
+            if skip and h["timestamp"] == before_iso:
+                skip -= 1 # already on an earlier page
+                continue
+            try:
+                page.append(self._interaction_from_row(h))
+            except CodecError as e:
+                # one bad row shouldn't hide the rest of the history
+                logger.warning("Skipping malformed interaction row %s: %s", h["id"], e)
+
+        if len(page) < limit:
+            # Hot rows exhausted: continue into the cold segments, newest first
+            segments = conn.execute(
+                f"SELECT recipients, payload FROM history_segments WHERE user_id = ? AND first_ts {'<' if skip is None else '<='} ? "
+                "ORDER BY last_ts DESC",
+                (user_id, before_iso)
+            )
+            for segment in segments:
+                if len(page) >= limit:
+                    break
+                if recipient is not None and recipient not in json.loads(segment["recipients"]):
+                    continue
+                records = decode_records(segment["payload"])
+                skip = self._collect_page(reversed(records), page, before_iso, limit, recipient, skip)
+        return page
+
+    # --- Search ---
+
+    def search_history(self, username: str, query: SearchQuery, limit: int = 20) -> List[SearchHit]:
+        """
+        Ranked (BM25) full-text search over the user's whole history, see domain/search.py.
+        """
+        conn = self._connect()
+        user_id = self._user_id(conn, username)
+        if user_id is None:
+            return []
+        if not self.fts:
+            return self._search_hits(self._search.search(
+                username, self.version(), lambda: self._history_records(user_id, conn), query, limit
+            ))
+
+        terms, phrases = parse_query(query.text)
+        # Tokens are plain words (see tokenize), so quoting them is all the escaping needed
+        match = " AND ".join([f'"{t}"' for t in terms] + ['"' + " ".join(p) + '"' for p in phrases])
+
+        filters, params = ["d.user_id = ?"], [user_id]
+        for column, value in (("tone", query.tone), ("relationship", query.relationship), ("recipient", query.recipient)):
+            if value is not None:
+                filters.append(f"d.{column} = ?")
+                params.append(value)
+        if query.accepted is not None:
+            filters.append("d.accepted = ?")
+            params.append(int(query.accepted))
+        if query.since is not None:
+            filters.append("d.timestamp >= ?")
+            params.append(query.since.isoformat())
+        if query.until is not None:
+            filters.append("d.timestamp < ?")
+            params.append(query.until.isoformat())
+
+        if match:
+            sql = ("SELECT d.*, bm25(history_fts) AS score FROM history_fts JOIN history_docs d ON d.id = history_fts.rowid "
+                   "WHERE history_fts MATCH ? AND " + " AND ".join(filters) + " ORDER BY score, d.timestamp DESC LIMIT ?")
+            params = [match] + params
+        else:
+            sql = "SELECT d.*, 0.0 AS score FROM history_docs d WHERE " + " AND ".join(filters) + " ORDER BY d.timestamp DESC LIMIT ?"
+        params.append(limit)
+
+        # bm25() is lower-is-better; SearchHit scores are higher-is-better
+        return self._search_hits([(self._row_to_dict(row), -row["score"]) for row in conn.execute(sql, params)])
+
+    def _history_records(self, user_id: int, conn: sqlite3.Connection) -> Iterable[dict]:
+        # Oldest first: cold segments, then hot rows
+        for segment in conn.execute(
+            "SELECT payload FROM history_segments WHERE user_id = ? ORDER BY last_ts", (user_id,)
+        ).fetchall():
+            yield from decode_records(segment["payload"])
+        for row in conn.execute("SELECT * FROM interactions WHERE user_id = ? ORDER BY timestamp, id", (user_id,)).fetchall():
+            yield self._row_to_dict(row)
+
+    def _index_record(self, conn: sqlite3.Connection, user_id: int, record: dict):
+        orig = record.get("original_message", {})
+        conn.execute(
+            """
+            INSERT INTO history_docs (user_id, timestamp, accepted, content, recipient, relationship,
+                                      tone, channel, refined_suggestion, final_content)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, record.get("timestamp", ""), int(bool(record.get("accepted"))), orig.get("content", ""),
+             orig.get("recipient", ""), orig.get("relationship", ""), orig.get("tone", ""), orig.get("channel", ""),
+             record.get("refined_suggestion", ""), record.get("final_content", ""))
+        )
+
+    def history_recipients(self, username: str) -> List[str]:
+        conn = self._connect()
+        user_id = self._user_id(conn, username)
+        if user_id is None:
+            return []
+        names = set(r["recipient"] for r in conn.execute(
+            "SELECT DISTINCT recipient FROM interactions WHERE user_id = ?", (user_id,)
+        ))
+        for segment in conn.execute("SELECT recipients FROM history_segments WHERE user_id = ?", (user_id,)):
+            names.update(json.loads(segment["recipients"]))
+        return sorted(names)
+
+    def save_user(self, user: AppUser):
+        """
+        Upserts profile, preferences and contacts.
+        History is append-only and goes through append_interaction().
+        """
+        conn = self._connect()
+        with conn:
+            self._upsert_user(conn, user.username, user.email, user.password_hash, user.self_context,
+                              user.memory.relationship_preferences)
+            user_id = self._user_id(conn, user.username)
+            conn.execute("DELETE FROM contacts WHERE user_id = ?", (user_id,))
+            conn.executemany(
+                "INSERT INTO contacts (user_id, position, name, relationship, description) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, i, c.name, c.relationship, c.description) for i, c in enumerate(user.contacts)]
+            )
+
+    def _upsert_user(self, conn, username, email, password_hash, self_context, preferences):
+        conn.execute(
+            """
+            INSERT INTO users (username, email, password_hash, self_context, relationship_preferences)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET
+                email = excluded.email,
+                password_hash = excluded.password_hash,
+                self_context = excluded.self_context,
+                relationship_preferences = excluded.relationship_preferences
+            """,
+            (username, email, password_hash, self_context, json.dumps(preferences))
+        )
+
+    def append_interactions(self, user: AppUser, items: List[Tuple[Interaction, str]]):
+        # One transaction for the whole batch
+        conn = self._connect()
+        with conn:
+            user_id = self._user_id(conn, user.username)
+            if user_id is None:
+                # Users that were never saved (e.g. guest) get a bare row, same as the JSON journal
+                self._upsert_user(conn, user.username, "", "", "", {})
+                user_id = self._user_id(conn, user.username)
+            conn.execute(
+                "UPDATE users SET relationship_preferences = ? WHERE id = ?",
+                (json.dumps(user.memory.relationship_preferences), user_id)
+            )
+            for interaction, _ in items:
+                self._insert_interaction(conn, user_id, interaction)
+            hot_count = conn.execute("SELECT COUNT(*) FROM interactions WHERE user_id = ?", (user_id,)).fetchone()[0]
+            if self.retention.should_spill(hot_count):
+                self._apply_retention(conn, user_id)
+
+    def _insert_interaction(self, conn, user_id: int, interaction: Interaction):
+        msg = interaction.message
+        conn.execute(
+            """
+            INSERT INTO interactions (user_id, timestamp, accepted, content, recipient, relationship,
+                                      tone, channel, refined_suggestion, final_content)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, interaction.timestamp.isoformat(), int(interaction.accepted), msg.content,
+             msg.recipient_name, msg.recipient_relationship, msg.intended_tone.value, msg.channel.value,
+             interaction.refined_message.suggested_content, interaction.final_content)
+        )
+        if self.fts:
+            self._index_record(conn, user_id, self._interaction_to_dict(interaction)) # the trigger indexes its text
+
+    def compact(self):
+        conn = self._connect()
+        with conn:
+            for row in conn.execute("SELECT id FROM users").fetchall():
+                self._apply_retention(conn, row["id"])
+        # WAL checkpoint is the SQLite counterpart of folding the journal into the snapshot
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # --- Retention ---
+
+    def _apply_retention(self, conn: sqlite3.Connection, user_id: int):
+        """
+        Same policy as the JSON store: spill the oldest hot rows into compressed
+        segments, fold expired history into users.history_stats.
+        """
+        policy = self.retention
+        hot_count = conn.execute("SELECT COUNT(*) FROM interactions WHERE user_id = ?", (user_id,)).fetchone()[0]
+        while policy.should_spill(hot_count):
+            rows = conn.execute(
+                "SELECT * FROM interactions WHERE user_id = ? ORDER BY timestamp, id LIMIT ?",
+                (user_id, policy.segment_size)
+            ).fetchall()
+            records = [self._row_to_dict(r) for r in rows]
+            meta = segment_meta(records)
+            conn.execute(
+                "INSERT INTO history_segments (user_id, first_ts, last_ts, count, recipients, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, meta["first"], meta["last"], meta["count"], json.dumps(meta["recipients"]), encode_records(records, self.serializer))
+            )
+            conn.executemany("DELETE FROM interactions WHERE id = ?", [(r["id"],) for r in rows])
+            hot_count -= len(rows)
+
+        cutoff = policy.expired_before()
+        if cutoff is None:
+            return
+        cutoff_iso = cutoff.isoformat()
+        stats = json.loads(conn.execute("SELECT history_stats FROM users WHERE id = ?", (user_id,)).fetchone()[0])
+
+        expired_segments = conn.execute(
+            "SELECT id, payload FROM history_segments WHERE user_id = ? AND last_ts < ?", (user_id, cutoff_iso)
+        ).fetchall()
+        for segment in expired_segments:
+            for h_data in decode_records(segment["payload"]):
+                fold_record(stats, h_data)
+        conn.executemany("DELETE FROM history_segments WHERE id = ?", [(seg["id"],) for seg in expired_segments])
+
+        expired_rows = conn.execute(
+            "SELECT * FROM interactions WHERE user_id = ? AND timestamp < ?", (user_id, cutoff_iso)
+        ).fetchall()
+        for row in expired_rows:
+            fold_record(stats, self._row_to_dict(row))
+        conn.executemany("DELETE FROM interactions WHERE id = ?", [(r["id"],) for r in expired_rows])
+        if self.fts and (expired_segments or expired_rows):
+            # A segment that is only partly past the cutoff is kept whole, and so are its search rows
+            oldest_kept = conn.execute("SELECT MIN(first_ts) FROM history_segments WHERE user_id = ?", (user_id,)).fetchone()[0]
+            conn.execute("DELETE FROM history_docs WHERE user_id = ? AND timestamp < ?",
+                         (user_id, min(cutoff_iso, oldest_kept) if oldest_kept else cutoff_iso))
+
+        conn.execute("UPDATE users SET history_stats = ? WHERE id = ?", (json.dumps(stats), user_id))
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> dict:
+        # Same record shape as the JSON store, so cold segments are portable between backends
+        return {
+            "timestamp": row["timestamp"],
+            "accepted": bool(row["accepted"]),
+            "final_content": row["final_content"],
+            "original_message": {
+                "content": row["content"],
+                "recipient": row["recipient"],
+                "relationship": row["relationship"],
+                "tone": row["tone"],
+                "channel": row["channel"]
+            },
+            "refined_suggestion": row["refined_suggestion"]
+        }
+
+    @classmethod
+    def _interaction_from_row(cls, row: sqlite3.Row) -> Interaction:
+        # Same strict decoder as the file stores
+        return interaction_from_record(cls._row_to_dict(row))
+
+    def update_username(self, old_username: str, new_username: str) -> bool:
+        conn = self._connect()
+        with conn:
+            if self._user_id(conn, new_username) is not None:
+                return False # Taken
+            cur = conn.execute("UPDATE users SET username = ? WHERE username = ?", (new_username, old_username))
+            return cur.rowcount == 1
+
+    def delete_user(self, username: str):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    # --- Migration ---
+
+    def import_json_data(self, data: dict) -> int:
+        """
+        Bulk-loads a users_v2.json document (as returned by Repository._load_data()).
+        Existing users with the same name are replaced. Returns the number of users imported.
+        """
+        conn = self._connect()
+        count = 0
+        with conn:
+            for username, u_data in data.get("users", {}).items():
+                mem_data = u_data.get("memory", {})
+                conn.execute("DELETE FROM users WHERE username = ?", (username,))
+                self._upsert_user(conn, username, u_data.get("email", ""), u_data.get("password_hash", ""),
+                                  u_data.get("self_context", ""), mem_data.get("relationship_preferences", {}))
+                user_id = self._user_id(conn, username)
+                conn.execute("UPDATE users SET history_stats = ? WHERE id = ?",
+                             (json.dumps(mem_data.get("history_stats", {})), user_id))
+                conn.executemany(
+                    "INSERT INTO contacts (user_id, position, name, relationship, description) VALUES (?, ?, ?, ?, ?)",
+                    [(user_id, i, c["name"], c["relationship"], c.get("description", ""))
+                     for i, c in enumerate(u_data.get("contacts", []))]
+                )
+                for h_data in mem_data.get("history", []):
+                    try:
+                        interaction = self._interaction_from_dict(h_data)
+                    except CodecError as e:
+                        logger.warning("Not migrating malformed history entry of %s: %s", username, e)
+                        continue
+                    self._insert_interaction(conn, user_id, interaction)
+                count += 1
+        return count
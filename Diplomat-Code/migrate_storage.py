@@ -0,0 +1,23 @@
+import argparse
+import time
+from infrastructure.repository import Repository, create_repository, DEFAULT_JSON_PATH, DEFAULT_SQLITE_PATH, DEFAULT_SHARD_ROOT
+
+# One-off migration: users_v2.json (+ journal) -> SQLite or per-user shards.
+# Afterwards run the app with DIPLOMAT_STORAGE=<backend> (and DIPLOMAT_STORAGE_PATH if not using the default).
+
+DEFAULT_TARGETS = {"sqlite": DEFAULT_SQLITE_PATH, "sharded": DEFAULT_SHARD_ROOT}
+
+parser = argparse.ArgumentParser(description="Migrate the JSON user store to another storage backend.")
+parser.add_argument("--backend", choices=sorted(DEFAULT_TARGETS), default="sqlite", help="backend to migrate to")
+parser.add_argument("--source", default=DEFAULT_JSON_PATH, help="users_v2.json to read")
+parser.add_argument("--target", help="database file (sqlite) or directory (sharded) to write")
+args = parser.parse_args()
+target_path = args.target or DEFAULT_TARGETS[args.backend]
+
+start = time.perf_counter()
+data = Repository(args.source).export_data()
+target = create_repository(args.backend, target_path)
+count = target.import_json_data(data)
+target.compact()
+
+print(f"Migrated {count} users from {args.source} to {target_path} ({args.backend}) in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,27 @@
+import os
+import sys
+from datetime import datetime
+import pytest
+
+# The app runs from Diplomat-Code/ (flat imports: domain, infrastructure, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from domain.models import Message, RefinedMessage, Interaction, Tone
+from infrastructure.repository import create_repository
+
+BACKENDS = {"json": "users.json", "sqlite": "users.db", "sharded": "users"}
+
+def make_interaction(text: str, recipient: str = "Ana", timestamp: datetime = None) -> Interaction:
+    timestamp = timestamp or datetime.now()
+    msg = Message(text, recipient, "Friend", Tone.FRIENDLY, timestamp=timestamp)
+    return Interaction(msg, RefinedMessage(msg, "Hi, " + text, "", []), True, "Hi, " + text, timestamp=timestamp)
+
+@pytest.fixture(params=list(BACKENDS))
+def repo(request, tmp_path):
+    """
+    An empty store of each backend, compacting (and dropping journal segments) all the time.
+    """
+    repo = create_repository(request.param, os.path.join(tmp_path, BACKENDS[request.param]))
+    if hasattr(repo, "compact_every"):
+        repo.compact_every = 5
+    return repo
@@ -0,0 +1,125 @@
+import os
+import json
+import socket
+import threading
+import http.client
+import pytest
+from api_server import DiplomatApi, ApiServer, WorkerPool, ApiError, is_loopback
+from application.service import AgentService
+from domain.agent import DiplomatAgent
+from domain.rules import RuleEngine
+from infrastructure.fake_provider import FakeProvider
+from infrastructure.repository import create_repository
+
+@pytest.fixture
+def api(tmp_path):
+    repository = create_repository("json", os.path.join(tmp_path, "users.json"))
+    agent = DiplomatAgent(repository, brain=RuleEngine(provider=FakeProvider(latency=0, chunk_delay=0)))
+    return DiplomatApi(AgentService(repository, agent))
+
+@pytest.fixture
+def server(api):
+    server = ApiServer(("127.0.0.1", 0), api, WorkerPool(2, 4, 5.0), keepalive=5.0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def call(api: DiplomatApi, method: str, path: str, body: dict = None):
+    handler, params = api.route(method, path)
+    return handler(body or {}, *params)
+
+def test_bad_outcome_does_not_use_up_the_suggestion(api):
+    status, payload = call(api, "POST", "/v1/advice", {"text": "send me the report"})
+    assert status == 200
+    suggestion_id = payload["suggestion_id"]
+
+    with pytest.raises(ApiError) as e:
+        call(api, "POST", "/v1/outcome", {"suggestion_id": suggestion_id, "accepted": "yes"})
+    assert e.value.status == 400
+    assert call(api, "POST", "/v1/outcome", {"suggestion_id": suggestion_id, "accepted": True}) == (204, None)
+    with pytest.raises(ApiError) as e:
+        call(api, "POST", "/v1/outcome", {"suggestion_id": suggestion_id, "accepted": True})
+    assert e.value.status == 404
+
+def test_missing_fields_and_unknown_routes(api):
+    for method, path, body, status in [
+        ("POST", "/v1/advice", {}, 400),
+        ("POST", "/v1/outcome", {"accepted": True}, 400),
+        ("POST", "/v1/users", {"username": "ana"}, 400),
+        ("GET", "/v1/users/nobody", {}, 404),
+    ]:
+        with pytest.raises(ApiError) as e:
+            call(api, method, path, body)
+        assert e.value.status == status
+    with pytest.raises(ApiError) as e:
+        api.route("GET", "/v2/advice")
+    assert e.value.status == 404
+    with pytest.raises(ApiError) as e:
+        api.route("GET", "/v1/advice")
+    assert e.value.status == 405
+
+@pytest.mark.parametrize("method, path, body", [
+    ("POST", "/v1/advice", {"text": 42}),
+    ("POST", "/v1/advice", {"text": "hi", "tone": ["Formal"]}),
+    ("POST", "/v1/users", {"username": "ana", "password": 1234}),
+    ("POST", "/v1/users", {"username": {"name": "ana"}, "password": "pw"}),
+])
+def test_non_string_fields_are_rejected(api, method, path, body):
+    with pytest.raises(ApiError) as e:
+        call(api, method, path, body)
+    assert e.value.status == 400
+
+def raw_request(server, head: bytes) -> bytes:
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        sock.sendall(head)
+        data = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return data # the server closed the connection
+            data += chunk
+
+@pytest.mark.parametrize("length", [b"abc", b"-5"])
+def test_invalid_content_length_is_rejected_and_closes(server, length):
+    response = raw_request(server, b"POST /v1/advice HTTP/1.1\r\nHost: x\r\nContent-Length: " + length + b"\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 400")
+
+def test_rejected_token_closes_the_connection(server):
+    # The POST body is never read; parsed as the next request it would desync the connection
+    server.token = "secret"
+    body = b'{"text": "hi"}'
+    response = raw_request(server, b"POST /v1/advice HTTP/1.1\r\nHost: x\r\nAuthorization: Bearer wrong\r\n"
+                                   b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body +
+                                   b"GET /healthz HTTP/1.1\r\nHost: x\r\nAuthorization: Bearer secret\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 401")
+    assert response.count(b"HTTP/1.1 ") == 1
+    assert raw_request(server, b"GET /healthz HTTP/1.1\r\nHost: x\r\nAuthorization: Bearer secret\r\n"
+                               b"Connection: close\r\n\r\n").startswith(b"HTTP/1.1 200")
+
+def test_bad_json_bodies(server):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    for body in (b"{not json", b"[1, 2]"):
+        conn.request("POST", "/v1/advice", body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        assert response.status == 400
+        assert "error" in json.loads(response.read())
+    conn.request("GET", "/healthz")
+    assert conn.getresponse().status == 200
+    conn.close()
+
+def test_token_is_checked(server):
+    server.token = "secret"
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    conn.request("GET", "/v1/users/nobody")
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 401
+    conn.request("GET", "/v1/users/nobody", headers={"Authorization": "Bearer secret"})
+    assert conn.getresponse().status == 404
+    conn.close()
+
+def test_is_loopback():
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and is_loopback("localhost")
+    assert not is_loopback("0.0.0.0") and not is_loopback("10.0.0.1") and not is_loopback("example.com")
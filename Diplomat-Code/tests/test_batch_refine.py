@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import pytest
+import batch_refine
+
+def write_drafts(path, count: int):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"d{i}", "text": f"please send the report {i}", "tone": "Formal"}) + "\n")
+
+def read_output(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture
+def run(monkeypatch):
+    # main() and _init_worker set these; monkeypatch puts them back afterwards
+    for name, value in (("DIPLOMAT_LLM_PROVIDER", "fake"), ("DIPLOMAT_FAKE_LATENCY", "0"), ("DIPLOMAT_FAKE_CHUNK_DELAY", "0"),
+                        ("DIPLOMAT_LLM_RPM", "600"), ("DIPLOMAT_LLM_TPM", "1000000")):
+        monkeypatch.setenv(name, value)
+    def run(*args):
+        monkeypatch.setattr(sys, "argv", ["batch_refine.py", "--fake", "--workers", "3", "--checkpoint-every", "5", *args])
+        batch_refine.main()
+    return run
+
+def test_read_jsonl_seeks_to_the_checkpoint(tmp_path):
+    path = tmp_path / "drafts.jsonl"
+    write_drafts(path, 5)
+    rows = list(batch_refine.read_jsonl(str(path), 0, 0))
+    line, offset, _, _ = rows[3]
+    resumed = list(batch_refine.read_jsonl(str(path), line, offset))
+    assert resumed == rows[3:]
+
+def test_recover_output_trims_a_half_written_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    done = b'{"line": 0}\n{"line": 1}\n'
+    path.write_bytes(done + b'{"line": 4}\n{"line": 2}\n{"line": 7, "sugg')
+    assert batch_refine.recover_output(str(path), len(done)) == {4, 2}
+    assert path.read_bytes() == done + b'{"line": 4}\n{"line": 2}\n'
+
+def test_resume_finishes_every_row_exactly_once(tmp_path, run):
+    drafts, output = tmp_path / "drafts.jsonl", tmp_path / "out.jsonl"
+    write_drafts(drafts, 30)
+    run("--input", str(drafts), "--output", str(output))
+    complete = {r["line"]: r for r in read_output(output)}
+    assert sorted(complete) == list(range(30))
+
+    # A crash: rows 0-9 and, out of order, 12 and 15 are in the output (15 after the checkpoint
+    # was written), plus half of row 11; the checkpoint stops at row 10
+    rows = list(batch_refine.read_jsonl(str(drafts), 0, 0))
+    head = b"".join((json.dumps(complete[i]) + "\n").encode() for i in list(range(10)) + [12])
+    output.write_bytes(head + (json.dumps(complete[15]) + "\n").encode() + b'{"line": 11, "sugg')
+    batch_refine.save_checkpoint(str(output) + ".checkpoint", {
+        "line": 10, "input_offset": rows[10][1], "output_offset": len(head),
+        "finished_ahead": [12]
+    })
+
+    run("--input", str(drafts), "--output", str(output), "--resume")
+    lines = [r["line"] for r in read_output(output)]
+    assert sorted(lines) == list(range(30))
+    assert all("error" not in r for r in read_output(output))
+    checkpoint = batch_refine.load_checkpoint(str(output) + ".checkpoint")
+    assert checkpoint["line"] == 30 and checkpoint["output_offset"] == os.path.getsize(output)
+
+def test_refuses_to_overwrite_without_resume(tmp_path, run):
+    drafts, output = tmp_path / "drafts.jsonl", tmp_path / "out.jsonl"
+    write_drafts(drafts, 1)
+    output.write_text('{"line": 0}\n')
+    with pytest.raises(SystemExit):
+        run("--input", str(drafts), "--output", str(output))
@@ -0,0 +1,74 @@
+import os
+import logging
+import pytest
+from domain.models import AppUser
+from infrastructure.repository import create_repository
+from infrastructure.cached_repository import CachedRepository
+from conftest import make_interaction
+
+class FlakyBackend:
+    """
+    Passes everything through, but fails appends for one user while `failing` is set.
+    `during_append` (if set) runs inside every append, before it is written.
+    """
+    def __init__(self, backend, username: str):
+        self.backend = backend
+        self.username = username
+        self.failing = False
+        self.during_append = None
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def append_interactions(self, user, items):
+        if self.during_append:
+            self.during_append()
+        if self.failing and user.username == self.username:
+            raise OSError("disk full")
+        self.backend.append_interactions(user, items)
+
+@pytest.fixture
+def setup(tmp_path, caplog):
+    caplog.set_level(logging.CRITICAL)
+    backend = FlakyBackend(create_repository("json", os.path.join(tmp_path, "users.json")), "b")
+    repo = CachedRepository(backend, capacity=1, flush_interval=3600)
+    users = [AppUser(username=name, email="", password_hash="") for name in ("a", "b")]
+    for user in users:
+        repo.save_user(user)
+    for i in range(3):
+        for user in users:
+            interaction = make_interaction(f"{user.username}{i}")
+            user.memory.add_history(interaction) # as DiplomatAgent.learn does
+            repo.append_interaction(user, interaction, "Friend")
+    # Loading this one has to make room in the cache
+    backend.save_user(AppUser(username="c", email="", password_hash=""))
+    yield backend, repo, users
+    backend.failing = False
+    backend.during_append = None
+    repo.close()
+
+def test_failed_flush_keeps_writes_until_they_commit(setup):
+    backend, repo, (a, b) = setup
+    backend.failing = True
+    with pytest.raises(OSError):
+        repo.flush()
+    # Neither may be dropped (and re-read without its writes) to make room
+    assert repo.get_user("c") is not None
+    assert repo.get_user("b") is b
+    assert repo.get_user("a") is a
+
+    backend.failing = False
+    repo.flush()
+    for name in ("a", "b"):
+        assert len(list(backend.backend.get_user(name).memory.history)) == 3
+
+def test_users_stay_cached_while_their_flush_is_in_flight(setup):
+    backend, repo, (a, b) = setup
+    seen = []
+    def read_meanwhile():
+        backend.during_append = None
+        repo.get_user("c")
+        seen.extend([repo.get_user("a"), repo.get_user("b")])
+    backend.during_append = read_meanwhile
+    repo.flush()
+    assert seen[0] is a and seen[1] is b
@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from infrastructure.fake_provider import FakeProvider
+from infrastructure.llm_errors import LLMError, RateLimitError
+from infrastructure.providers import LLMProvider
+
+ARGS = ("send the report", "Formal", "Chat Message", "be brief")
+
+def outcomes(provider: FakeProvider, calls: int) -> list:
+    results = []
+    for _ in range(calls):
+        try:
+            results.append(provider.refine_message(*ARGS))
+        except LLMError as e:
+            results.append(type(e).__name__)
+    return results
+
+def test_same_seed_replays_the_same_run():
+    settings = dict(latency=0, error_rate=0.2, rate_limit_rate=0.2, seed=7)
+    first, second = FakeProvider(**settings), FakeProvider(**settings)
+    assert outcomes(first, 50) == outcomes(second, 50)
+    assert first.stats == second.stats
+    assert first.stats["errors"] and first.stats["rate_limited"] # the seed does produce failures
+    assert outcomes(FakeProvider(**dict(settings, seed=8)), 50) != outcomes(FakeProvider(**settings), 50)
+
+def test_output_is_a_pure_function_of_the_input():
+    provider = FakeProvider(latency=0, chunk_delay=0)
+    refined = provider.refine_message(*ARGS)
+    assert refined == FakeProvider(latency=0, seed=99).refine_message(*ARGS)
+    assert refined != provider.refine_message("send the report", "Casual", "Chat Message", "be brief")
+    assert "".join(provider.refine_message_stream(*ARGS)) == refined
+    assert asyncio.run(provider.refine_message_async(*ARGS)) == refined
+    assert provider.refine_and_explain(*ARGS)[0] == refined
+
+def test_failures_are_typed_and_explanations_degrade():
+    assert isinstance(FakeProvider(), LLMProvider)
+    with pytest.raises(RateLimitError) as e:
+        FakeProvider(latency=0, rate_limit_rate=1.0, retry_after=3).refine_message(*ARGS)
+    assert e.value.retry_after == 3
+    failing = FakeProvider(latency=0, error_rate=1.0)
+    with pytest.raises(LLMError):
+        failing.refine_message(*ARGS)
+    assert failing.explain_changes("a", "b", "Formal") == "Could not generate explanation."
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("DIPLOMAT_FAKE_LATENCY", "0.5")
+    monkeypatch.setenv("DIPLOMAT_FAKE_429_RATE", "0.25")
+    provider = FakeProvider.from_env()
+    assert provider.latency == 0.5 and provider.rate_limit_rate == 0.25
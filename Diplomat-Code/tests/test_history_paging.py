@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+from domain.models import AppUser
+from infrastructure.retention import RetentionPolicy
+from conftest import make_interaction
+
+def test_paging_keeps_timestamp_ties_across_pages(repo):
+    repo.retention = RetentionPolicy(hot_limit=10, segment_size=10) # older history goes to cold segments
+    user = AppUser(username="a", email="", password_hash="")
+    repo.save_user(user)
+    base = datetime.now() - timedelta(days=1)
+    for i in range(100):
+        # groups of 5 sharing a timestamp, so ties straddle the page boundaries
+        recipient = "Ana" if i % 3 else "Ben"
+        repo.append_interaction(user, make_interaction(f"m{i}", recipient, base + timedelta(seconds=i // 5)), "Friend")
+    if hasattr(repo, "compact"):
+        repo.compact()
+
+    history = repo.get_user("a").memory.history
+    for i in range(3):
+        history.append(make_interaction(f"new{i}"))
+    for recipient, expected in ((None, 103), ("Ana", 69)):
+        seen, cursor = [], None
+        while True:
+            page = history.page(limit=7, before=cursor, recipient=recipient)
+            seen += [i.message.content for i in page.items]
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+        assert len(seen) == len(set(seen)) == expected
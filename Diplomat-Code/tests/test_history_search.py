@@ -0,0 +1,45 @@
+import os
+from datetime import datetime, timedelta
+from domain.models import AppUser
+from domain.search import SearchQuery
+from infrastructure.history_search import SearchIndexCache
+from infrastructure.repository import create_repository
+from conftest import make_interaction
+
+RECORDS = [{"original_message": {"content": "budget report"}, "timestamp": "2025-01-01T00:00:00"}]
+
+def test_index_cache_keeps_the_most_recently_searched_users():
+    cache, builds = SearchIndexCache(max_users=2), []
+    def search(username):
+        return cache.search(username, (1,), lambda: builds.append(username) or RECORDS, SearchQuery("budget"), 5)
+
+    for username in ("a", "b", "a", "c"): # "b" is the least recently searched when "c" arrives
+        assert len(search(username)) == 1
+    assert builds == ["a", "b", "c"]
+    search("a")
+    search("b")
+    assert builds == ["a", "b", "c", "b"]
+    assert list(cache._entries) == ["a", "b"]
+
+def test_session_matches_come_first_newest_first(tmp_path):
+    repo = create_repository("json", os.path.join(tmp_path, "users.json"))
+    user = AppUser(username="a", email="", password_hash="")
+    repo.save_user(user)
+    base = datetime.now() - timedelta(days=1)
+    # Stored matches that a tiny session index would score far higher or lower; they must not interleave
+    stored = [make_interaction("budget budget budget " + "filler " * i, timestamp=base + timedelta(minutes=i))
+              for i in range(5)]
+    repo.append_interactions(user, [(i, "Friend") for i in stored])
+
+    history = repo.get_user("a").memory.history
+    session = [make_interaction(f"the budget note {i} " + "words " * 30) for i in range(3)]
+    for interaction in session:
+        history.append(interaction)
+
+    hits = history.search(SearchQuery("budget"), limit=6)
+    assert [h.interaction.message.content for h in hits[:3]] == [i.message.content for i in reversed(session)]
+    stored_hits = hits[3:]
+    assert len(stored_hits) == 3
+    assert all(h.interaction.message.content.startswith("budget budget budget") for h in stored_hits)
+    assert [h.score for h in stored_hits] == sorted((h.score for h in stored_hits), reverse=True)
+    assert len(history.search(SearchQuery("budget"), limit=2)) == 2
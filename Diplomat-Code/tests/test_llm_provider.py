@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+import pytest
+from infrastructure.fake_provider import FakeProvider
+from infrastructure.llm_errors import RateLimitError
+from infrastructure.llm_provider import GeminiProvider
+from infrastructure.rate_limiter import RateLimiter
+from infrastructure.response_cache import ResponseCache
+
+class FakeModel:
+    """
+    GenerativeModel.generate_content on top of FakeProvider: its seeded rolls decide which calls
+    fail, and a streamed answer fails when iterated, as the SDK's does. `fail_after` chunks, if set,
+    ends every stream with a 429 instead.
+    """
+    def __init__(self, fake: FakeProvider, fail_after: int = None):
+        self.fake = fake
+        self.fail_after = fail_after
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        text = self.fake._rewrite(prompt.strip()[-20:], "Formal", "Chat", "")
+        if not stream:
+            self.fake._call()
+            return SimpleNamespace(text=text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        self.fake._call()
+        for i, word in enumerate(text.split(" ")):
+            if i == self.fail_after:
+                raise RateLimitError("429 Resource has been exhausted (mid-stream)")
+            yield SimpleNamespace(text=word + " ")
+
+def make_provider(model: FakeModel) -> GeminiProvider:
+    return GeminiProvider("fake", cache=ResponseCache(path=None), limiter=RateLimiter(6000, 10 ** 7),
+                          max_attempts=3, model=model)
+
+def test_stream_retries_a_429_before_the_first_chunk():
+    # Seed 1: the first roll is a 429, the second succeeds
+    fake = FakeProvider(latency=0, rate_limit_rate=0.5, retry_after=0.01, seed=1)
+    provider = make_provider(FakeModel(fake))
+    text = "".join(provider.refine_message_stream("send the report", "Formal", "Chat", ""))
+    assert text.startswith("[Formal Chat #")
+    assert fake.stats == {"calls": 2, "errors": 0, "rate_limited": 1}
+    # The retried answer was cached like refine_message's
+    assert provider.refine_message("send the report", "Formal", "Chat", "") == text
+
+def test_stream_is_not_retried_once_text_was_sent():
+    fake = FakeProvider(latency=0)
+    provider = make_provider(FakeModel(fake, fail_after=2))
+    received = []
+    with pytest.raises(RateLimitError):
+        for chunk in provider.refine_message_stream("send the report", "Formal", "Chat", ""):
+            received.append(chunk)
+    assert len(received) == 2
+    assert fake.stats["calls"] == 1
+
+def test_stream_gives_up_after_max_attempts():
+    fake = FakeProvider(latency=0, rate_limit_rate=1.0, retry_after=0.01)
+    provider = make_provider(FakeModel(fake))
+    with pytest.raises(RateLimitError):
+        list(provider.refine_message_stream("send the report", "Formal", "Chat", ""))
+    assert fake.stats["rate_limited"] == 3
@@ -0,0 +1,94 @@
+import time
+import asyncio
+import pytest
+from infrastructure.fake_provider import FakeProvider
+from infrastructure.llm_errors import LLMError, LLMUnavailableError
+from infrastructure.model_router import ModelRouter, CircuitBreaker
+
+ARGS = ("send the report", "Formal", "Chat Message", "")
+
+def make_router(primary: FakeProvider, fallback: FakeProvider, **kwargs) -> ModelRouter:
+    kwargs.setdefault("hedge_after", 5.0)
+    return ModelRouter({"primary": primary, "fallback": fallback}, max_concurrency=2, **kwargs)
+
+def test_failures_fall_back_and_open_the_breaker():
+    primary, fallback = FakeProvider(latency=0, error_rate=1.0), FakeProvider(latency=0)
+    router = make_router(primary, fallback, failure_threshold=3)
+    for _ in range(4):
+        assert router.refine_message(*ARGS).startswith("[Formal")
+    stats = router.stats()
+    # The 4th call skips the open breaker
+    assert stats["primary"]["errors"] == 3 and primary.stats["calls"] == 3
+    assert stats["primary"]["state"] == "open"
+    assert stats["fallback"]["calls"] == 4
+
+def test_quota_error_opens_the_breaker_at_once():
+    primary = FakeProvider(latency=0, rate_limit_rate=1.0, retry_after=60)
+    router = make_router(primary, FakeProvider(latency=0))
+    router.refine_message(*ARGS)
+    assert router.stats()["primary"]["state"] == "open"
+    assert router.stats()["primary"]["rate_limited"] == 1
+
+def test_all_breakers_open_is_unavailable():
+    failing = dict(latency=0, rate_limit_rate=1.0, retry_after=60)
+    router = make_router(FakeProvider(**failing), FakeProvider(**failing))
+    with pytest.raises(LLMError):
+        router.refine_message(*ARGS)
+    with pytest.raises(LLMUnavailableError):
+        router.refine_message(*ARGS)
+
+def test_slow_primary_is_hedged_and_the_hedge_wins():
+    router = make_router(FakeProvider(latency=0.5), FakeProvider(latency=0), hedge_after=0.05)
+    started = time.monotonic()
+    router.refine_message(*ARGS)
+    assert time.monotonic() - started < 0.4
+    stats = router.stats()
+    assert stats["fallback"]["hedges"] == 1 and stats["fallback"]["hedges_won"] == 1
+
+def test_fast_primary_is_not_hedged():
+    router = make_router(FakeProvider(latency=0.01), FakeProvider(latency=0), hedge_after=1.0)
+    for _ in range(5):
+        router.refine_message(*ARGS)
+    assert router.stats()["fallback"]["calls"] == 0
+
+def test_hedge_delay_follows_p95_once_there_are_enough_samples():
+    primary = FakeProvider(latency=0.02)
+    router = make_router(primary, FakeProvider(latency=0), hedge_after=10.0, min_samples=5)
+    assert router._hedge_delay("primary") == 10.0
+    for _ in range(5):
+        router.refine_message(*ARGS)
+    assert 0.02 <= router._hedge_delay("primary") < 0.2
+    # Now well over its p95: hedged long before the 10 s default
+    primary.latency = 0.5
+    started = time.monotonic()
+    router.refine_message(*ARGS)
+    assert time.monotonic() - started < 0.4
+    assert router.stats()["fallback"]["hedges_won"] == 1
+
+def test_stream_falls_back_before_the_first_chunk():
+    primary = FakeProvider(latency=0, rate_limit_rate=1.0, retry_after=60)
+    router = make_router(primary, FakeProvider(latency=0, chunk_delay=0))
+    assert "".join(router.refine_message_stream(*ARGS)).startswith("[Formal")
+    stats = router.stats()
+    assert stats["primary"]["state"] == "open" and stats["fallback"]["first_token_p50_ms"] is not None
+
+def test_async_calls_fall_back():
+    router = make_router(FakeProvider(latency=0, error_rate=1.0), FakeProvider(latency=0))
+    assert asyncio.run(router.refine_message_async(*ARGS)).startswith("[Formal")
+    assert router.stats()["primary"]["errors"] == 1
+
+def test_probe_returns_the_first_working_model():
+    router = make_router(FakeProvider(latency=0, error_rate=1.0), FakeProvider(latency=0))
+    assert router.probe(stop_at_first=True) == "fallback"
+    assert router.stats()["primary"]["state"] == "open" # one failed probe is enough
+
+def test_breaker_half_opens_after_the_cooldown():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow() # the trial call
+    assert not breaker.allow() # only one at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
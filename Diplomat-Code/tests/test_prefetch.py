@@ -0,0 +1,70 @@
+import threading
+from application.prefetch import PrefetchScheduler, PrefetchKey
+
+def key(username: str, text: str) -> PrefetchKey:
+    return PrefetchKey(username, text, "Ana", "Friend", "Friendly", "Chat Message")
+
+class Gate:
+    """
+    compute() stand-in that blocks until opened, recording which drafts actually ran.
+    """
+    def __init__(self):
+        self.opened = threading.Event()
+        self.started = threading.Event()
+        self.ran = []
+
+    def compute(self, text: str):
+        def run():
+            self.ran.append(text)
+            self.started.set()
+            self.opened.wait(5)
+            return f"refined {text}"
+        return run
+
+def test_changed_draft_drops_the_running_prefetch():
+    scheduler, gate = PrefetchScheduler(workers=1, share=1.0, user_share=1.0, rpm=60), Gate()
+    assert scheduler.schedule(key("a", "draft"), gate.compute("draft"))
+    assert gate.started.wait(5)
+    assert scheduler.schedule(key("a", "draft, edited"), gate.compute("draft, edited"))
+    gate.opened.set()
+    # The first result arrives after the draft changed: nobody may be handed it
+    assert scheduler.take(key("a", "draft")) is None
+    assert scheduler.take(key("a", "draft, edited")) == "refined draft, edited"
+    assert scheduler.stats["cancelled"] == 1
+
+def test_changed_draft_cancels_a_queued_prefetch():
+    scheduler, gate = PrefetchScheduler(workers=1, share=1.0, user_share=1.0, rpm=60), Gate()
+    scheduler.schedule(key("b", "busy"), gate.compute("busy")) # occupies the only worker
+    assert gate.started.wait(5)
+    scheduler.schedule(key("a", "draft"), gate.compute("draft"))
+    scheduler.schedule(key("a", "draft, edited"), gate.compute("draft, edited"))
+    gate.opened.set()
+    assert scheduler.take(key("a", "draft, edited")) == "refined draft, edited"
+    assert "draft" not in gate.ran
+
+def test_served_key_is_not_prefetched_again():
+    scheduler, gate = PrefetchScheduler(share=1.0, user_share=1.0, rpm=60), Gate()
+    gate.opened.set()
+    assert scheduler.schedule(key("a", "draft"), gate.compute("draft"))
+    assert scheduler.take(key("a", "draft")) == "refined draft"
+    assert not scheduler.schedule(key("a", "draft"), gate.compute("draft"))
+
+def test_budget_caps_each_user_and_everyone():
+    # 3 prefetches a minute in total, 1 per user
+    scheduler, gate = PrefetchScheduler(share=0.05, user_share=0.02, rpm=60), Gate()
+    gate.opened.set()
+    assert scheduler.schedule(key("a", "one"), gate.compute("one"))
+    assert not scheduler.schedule(key("a", "two"), gate.compute("two")) # a's share is used up
+    assert scheduler.schedule(key("b", "one"), gate.compute("one"))
+    assert scheduler.schedule(key("c", "one"), gate.compute("one"))
+    assert not scheduler.schedule(key("d", "one"), gate.compute("one")) # d has budget, everyone doesn't
+    assert scheduler.stats["over_budget"] == 2
+    assert scheduler.stats["scheduled"] == 3
+
+def test_per_user_state_is_bounded():
+    scheduler, gate = PrefetchScheduler(share=1.0, user_share=1.0, rpm=6000, max_users=3), Gate()
+    gate.opened.set()
+    for i in range(10):
+        scheduler.schedule(key(f"user{i}", "draft"), gate.compute("draft"))
+        scheduler.take(key(f"user{i}", "draft"))
+    assert len(scheduler._served) <= 3 and len(scheduler._user_budgets) <= 3 and len(scheduler._jobs) <= 3
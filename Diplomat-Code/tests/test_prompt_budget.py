@@ -0,0 +1,44 @@
+from domain.prompt_budget import PromptBudget, PromptSection, TRUNCATION_MARK
+from infrastructure.rate_limiter import estimate_tokens
+
+def words(tokens: int, word: str = "word") -> str:
+    # About `tokens` as estimate_tokens counts them (~4 characters each)
+    return " ".join([word] * (tokens * 4 // (len(word) + 1)))
+
+def test_under_budget_nothing_changes():
+    budget = PromptBudget(max_tokens=1000)
+    assert budget.fit_request("short draft", "engineer") == ("short draft", "engineer")
+
+def test_persona_is_trimmed_first_then_situation_then_draft():
+    draft, situation, persona = words(400, "draft"), words(400, "situation"), words(300, "persona")
+    content = f"[Context: {situation}] \nMessage: {draft}"
+
+    # ~100 over: only the persona gives
+    fitted, fitted_persona = PromptBudget(max_tokens=1000).fit_request(content, persona)
+    assert fitted == content
+    assert fitted_persona.endswith(TRUNCATION_MARK) and 190 <= estimate_tokens(fitted_persona) <= 210
+
+    # ~500 over: the whole persona goes, then half the situation; the draft is kept
+    fitted, fitted_persona = PromptBudget(max_tokens=600).fit_request(content, persona)
+    assert fitted_persona == ""
+    fitted_situation, fitted_draft = fitted.split(" \nMessage: ")
+    assert fitted_draft == draft
+    assert fitted_situation.endswith(TRUNCATION_MARK + "]") and 190 <= estimate_tokens(fitted_situation) <= 215
+
+def test_draft_is_never_cut_below_the_floor():
+    budget = PromptBudget(max_tokens=100, min_draft_tokens=256)
+    draft = words(1000, "draft")
+    content, persona = budget.fit_request(f"[Context: {words(300, 'situation')}] \nMessage: {draft}", words(300))
+    # Persona and situation are gone; the draft stops at the floor, over the budget
+    assert persona == ""
+    assert not content.startswith("[Context:")
+    assert content.endswith(TRUNCATION_MARK)
+    assert 240 <= estimate_tokens(content) <= 260
+
+def test_sections_below_their_minimum_are_left_alone():
+    fitted = PromptBudget(max_tokens=10).fit([
+        PromptSection("keep", words(50), priority=1, min_tokens=100),
+        PromptSection("cut", words(50), priority=2),
+    ])
+    assert fitted["keep"] == words(50)
+    assert fitted["cut"] == ""
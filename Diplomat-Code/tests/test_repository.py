@@ -0,0 +1,42 @@
+import threading
+from domain.models import AppUser
+from conftest import make_interaction
+
+def test_reads_survive_concurrent_appends_and_compaction(repo):
+    writer_user = AppUser(username="a", email="", password_hash="")
+    saver_user = AppUser(username="b", email="", password_hash="")
+    repo.save_user(writer_user)
+    repo.save_user(saver_user)
+    errors, stop = [], threading.Event()
+
+    def write():
+        for i in range(300):
+            repo.append_interaction(writer_user, make_interaction(f"hello {i}"), "Friend")
+
+    def save():
+        for i in range(100):
+            saver_user.self_context = str(i)
+            repo.save_user(saver_user)
+
+    def read():
+        while not stop.is_set():
+            try:
+                user = repo.get_user("a")
+                if user:
+                    user.memory.history.page(limit=20)
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    writers = [threading.Thread(target=write), threading.Thread(target=save)]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    assert len(list(repo.get_user("a").memory.history)) == 300
+    assert repo.get_user("b").self_context == "99"
@@ -0,0 +1,60 @@
+import time
+from types import SimpleNamespace
+from infrastructure.llm_provider import GeminiProvider
+from infrastructure.rate_limiter import RateLimiter
+from infrastructure.response_cache import ResponseCache
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), ttl_seconds=0.05)
+    cache.put("k", "v")
+    assert cache.get("k") == "v"
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    # Expired on disk too, not just in memory
+    assert ResponseCache(path=str(tmp_path / "cache.db")).get("k") is None
+
+def test_memory_is_an_lru_in_front_of_the_disk(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), memory_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, key.upper())
+    cache.get("a") # "b" is now the least recently used
+    cache.put("c", "C")
+    assert list(cache._memory) == ["a", "c"]
+    assert cache.stats["evictions"] == 1
+    assert cache.get("b") == "B" and cache.stats["disk_hits"] == 1
+
+def test_memory_only_cache_forgets_evicted_entries():
+    cache = ResponseCache(path=None, memory_entries=1)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") is None and cache.get("b") == "B"
+
+def test_disk_keeps_the_entries_furthest_from_expiring(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), memory_entries=1, disk_entries=3)
+    for i in range(5):
+        cache.put(f"k{i}", str(i))
+    rows = cache._connect().execute("SELECT key FROM responses ORDER BY expires_at").fetchall()
+    assert [r[0] for r in rows] == ["k2", "k3", "k4"]
+    assert cache.get("k0") is None
+
+def test_keys_ignore_whitespace_differences():
+    assert ResponseCache.make_key("hello  world \r\n", "Formal") == ResponseCache.make_key(" hello world\n", "Formal")
+    assert ResponseCache.make_key("hello world", "Formal") != ResponseCache.make_key("hello world", "Casual")
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, request_options=None, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(text=f"answer {self.calls}")
+
+def test_use_cache_false_asks_again_and_refreshes_the_entry():
+    model = CountingModel()
+    provider = GeminiProvider("fake", cache=ResponseCache(path=None), limiter=RateLimiter(6000, 10 ** 7), model=model)
+    args = ("send the report", "Formal", "Chat Message", "")
+    assert provider.refine_message(*args) == "answer 1"
+    assert provider.refine_message(*args) == "answer 1"
+    assert provider.refine_message(*args, use_cache=False) == "answer 2"
+    assert provider.refine_message(*args) == "answer 2"
+    assert model.calls == 2
@@ -0,0 +1,88 @@
+import os
+import random
+from datetime import datetime, timedelta
+import pytest
+from domain.models import AppUser, Message, RefinedMessage, Interaction, Tone
+from domain.search import SearchQuery, parse_query, tokenize
+from infrastructure.repository import create_repository
+from infrastructure.retention import RetentionPolicy
+
+WORDS = ("meeting budget report deadline sorry thanks lunch tomorrow project review café naïve "
+         "invoice client proposal weekend party birthday gift contract schedule call update").split()
+WORDS += [f"w{i}" for i in range(300)]
+RELATIONSHIPS = ["Boss", "Friend", "Client", "Family"]
+BASE = datetime(2025, 1, 1)
+COUNT = 600
+
+def make_interactions():
+    rng = random.Random(3)
+    for i in range(COUNT):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30)))
+        if i % 97 == 0:
+            text += " see you next week"
+        ts = BASE + timedelta(minutes=i)
+        msg = Message(text, rng.choice(["Ann", "Bob", "Cy"]), rng.choice(RELATIONSHIPS), rng.choice(list(Tone)), timestamp=ts)
+        yield Interaction(msg, RefinedMessage(msg, "Refined: " + text[:40], "", []), i % 3 != 0, text[:30], timestamp=ts)
+
+INTERACTIONS = list(make_interactions())
+
+QUERIES = [
+    SearchQuery("budget"),
+    SearchQuery("cafe"),
+    SearchQuery("naive meeting", relationship="Boss"),
+    SearchQuery('"next week"'),
+    SearchQuery('"see you next week"', accepted=False),
+    SearchQuery("report deadline", tone="Formal", since=BASE + timedelta(minutes=COUNT // 2)),
+    SearchQuery("", tone="Witty", accepted=True),
+    SearchQuery("", recipient="Ann", until=BASE + timedelta(minutes=100)),
+    SearchQuery("nonexistentword"),
+    SearchQuery("w17 w18"),
+]
+
+def brute_force(query: SearchQuery) -> set:
+    terms, phrases = parse_query(query.text)
+    matches = set()
+    for interaction in INTERACTIONS:
+        msg = interaction.message
+        fields = [" ".join(tokenize(f)) for f in (msg.content, interaction.refined_message.suggested_content,
+                                                  interaction.final_content)]
+        words = set(" ".join(fields).split())
+        if not all(t in words for t in terms):
+            continue
+        if not all(any(f" {' '.join(p)} " in f" {f} " for f in fields) for p in phrases):
+            continue
+        if query.tone is not None and msg.intended_tone.value != query.tone:
+            continue
+        if query.relationship is not None and msg.recipient_relationship != query.relationship:
+            continue
+        if query.recipient is not None and msg.recipient_name != query.recipient:
+            continue
+        if query.accepted is not None and interaction.accepted != query.accepted:
+            continue
+        if query.since is not None and interaction.timestamp < query.since:
+            continue
+        if query.until is not None and interaction.timestamp >= query.until:
+            continue
+        matches.add(interaction.timestamp)
+    return matches
+
+@pytest.mark.parametrize("backend", ["json", "sqlite", "sharded"])
+def test_backends_agree_with_brute_force(backend, tmp_path):
+    repo = create_repository(backend, os.path.join(tmp_path, "store"))
+    repo.retention = RetentionPolicy(hot_limit=100, segment_size=50) # cold segments take part too
+    user = AppUser(username="al", email="", password_hash="")
+    repo.save_user(user)
+    half = COUNT // 2
+    batches = [INTERACTIONS[k:k + 50] for k in range(0, COUNT, 50)]
+    for k, batch in enumerate(batches):
+        repo.append_interactions(user, [(i, i.message.recipient_relationship) for i in batch])
+        if (k + 1) * 50 == half:
+            repo.search_history("al", QUERIES[0], 5) # build the index halfway, then keep it in step
+    if hasattr(repo, "compact"):
+        repo.compact()
+
+    for query in QUERIES:
+        hits = repo.search_history("al", query, limit=COUNT)
+        assert {h.interaction.timestamp for h in hits} == brute_force(query), query
+        scores = [h.score for h in hits]
+        assert scores == sorted(scores, reverse=True)
@@ -0,0 +1,62 @@
+import gc
+import time
+import pytest
+from infrastructure.single_flight import SingleFlight
+
+def wait_until(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class Upstream:
+    def __init__(self, chunks: int = 5, delay: float = 0.02):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = 0
+
+    def __call__(self):
+        try:
+            for i in range(self.chunks):
+                time.sleep(self.delay)
+                yield f"c{i}"
+        finally:
+            self.closed += 1
+
+def test_abandoned_stream_is_dropped_and_upstream_closed():
+    flight, upstream = SingleFlight(), Upstream()
+    reader = flight.stream("k", upstream)
+    assert next(reader) == "c0"
+    reader.close()
+    assert wait_until(lambda: upstream.closed == 1)
+    assert wait_until(lambda: not flight._streams)
+
+def test_unread_stream_is_dropped_when_collected():
+    flight, upstream = SingleFlight(), Upstream()
+    reader = flight.stream("k", upstream)
+    del reader
+    gc.collect()
+    assert wait_until(lambda: not flight._streams)
+
+def test_follower_gets_full_stream_after_leader_leaves():
+    flight, upstream = SingleFlight(), Upstream()
+    leader = flight.stream("k", upstream)
+    follower = flight.stream("k", upstream)
+    assert next(leader) == "c0"
+    leader.close()
+    assert list(follower) == [f"c{i}" for i in range(5)]
+    assert upstream.closed == 1
+    assert wait_until(lambda: not flight._streams)
+
+def test_error_reaches_every_reader():
+    def failing():
+        yield "x"
+        raise ValueError("boom")
+    flight = SingleFlight()
+    readers = [flight.stream("k", failing), flight.stream("k", failing)]
+    for reader in readers:
+        with pytest.raises(ValueError):
+            list(reader)
+    assert wait_until(lambda: not flight._streams)